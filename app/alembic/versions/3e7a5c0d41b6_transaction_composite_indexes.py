@@ -0,0 +1,83 @@
+"""Transaction composite indexes
+
+Revision ID: 3e7a5c0d41b6
+Revises: 8c1f3b2d9a4e
+Create Date: 2025-02-05 16:48:09.207114
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3e7a5c0d41b6"
+down_revision: Union[str, None] = "8c1f3b2d9a4e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+not_deleted = sa.column("is_deleted") == sa.false()
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_transaction_wallet_id_currency_created_at",
+        "transaction",
+        ["wallet_id", "currency", "created_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_transaction_wallet_id_created_at",
+        "transaction",
+        ["wallet_id", "created_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_transaction_business_name_created_at",
+        "transaction",
+        ["business_name", "created_at"],
+        unique=False,
+        postgresql_where=not_deleted,
+        sqlite_where=not_deleted,
+    )
+    op.create_index(
+        "ix_transaction_business_name_wallet_id_created_at",
+        "transaction",
+        ["business_name", "wallet_id", "created_at"],
+        unique=False,
+        postgresql_where=not_deleted,
+        sqlite_where=not_deleted,
+    )
+    op.create_index(
+        "ix_transaction_business_name_user_id_created_at",
+        "transaction",
+        ["business_name", "user_id", "created_at"],
+        unique=False,
+        postgresql_where=not_deleted,
+        sqlite_where=not_deleted,
+    )
+
+    # uid is the primary key; wallet_id is the prefix of the composites above
+    op.drop_index(op.f("ix_transaction_uid"), table_name="transaction")
+    op.drop_index(op.f("ix_transaction_wallet_id"), table_name="transaction")
+
+
+def downgrade() -> None:
+    op.create_index(
+        op.f("ix_transaction_wallet_id"), "transaction", ["wallet_id"], unique=False
+    )
+    op.create_index(op.f("ix_transaction_uid"), "transaction", ["uid"], unique=True)
+
+    op.drop_index(
+        "ix_transaction_business_name_user_id_created_at", table_name="transaction"
+    )
+    op.drop_index(
+        "ix_transaction_business_name_wallet_id_created_at", table_name="transaction"
+    )
+    op.drop_index("ix_transaction_business_name_created_at", table_name="transaction")
+    op.drop_index("ix_transaction_wallet_id_created_at", table_name="transaction")
+    op.drop_index(
+        "ix_transaction_wallet_id_currency_created_at", table_name="transaction"
+    )
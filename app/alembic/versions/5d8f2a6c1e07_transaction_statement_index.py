@@ -0,0 +1,42 @@
+"""Transaction statement covering index
+
+Revision ID: 5d8f2a6c1e07
+Revises: c7b3e1f05a92
+Create Date: 2025-02-14 11:02:37.641905
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5d8f2a6c1e07"
+down_revision: Union[str, None] = "c7b3e1f05a92"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index(
+        "ix_transaction_wallet_id_currency_created_at", table_name="transaction"
+    )
+    op.create_index(
+        "ix_transaction_wallet_id_currency_created_at",
+        "transaction",
+        ["wallet_id", "currency", "created_at"],
+        unique=False,
+        postgresql_include=["amount", "balance"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_transaction_wallet_id_currency_created_at", table_name="transaction"
+    )
+    op.create_index(
+        "ix_transaction_wallet_id_currency_created_at",
+        "transaction",
+        ["wallet_id", "currency", "created_at"],
+        unique=False,
+    )
@@ -0,0 +1,54 @@
+"""Wallet balance
+
+Revision ID: 8c1f3b2d9a4e
+Revises: 517a49204342
+Create Date: 2025-02-03 10:12:41.529013
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8c1f3b2d9a4e"
+down_revision: Union[str, None] = "517a49204342"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "wallet_balance",
+        sa.Column("wallet_id", sa.Uuid(), nullable=False),
+        sa.Column("currency", sa.String(), nullable=False),
+        sa.Column("balance", sa.Numeric(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("wallet_id", "currency"),
+    )
+
+    # backfill from the latest ledger row of every (wallet, currency)
+    op.execute(
+        """
+        INSERT INTO wallet_balance (wallet_id, currency, balance, updated_at)
+        SELECT wallet_id, currency, balance, created_at
+        FROM (
+            SELECT
+                wallet_id,
+                currency,
+                balance,
+                created_at,
+                row_number() OVER (
+                    PARTITION BY wallet_id, currency ORDER BY created_at DESC
+                ) AS row_number
+            FROM "transaction"
+        ) AS latest
+        WHERE row_number = 1
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("wallet_balance")
@@ -0,0 +1,61 @@
+"""Transaction daily rollup
+
+Revision ID: 9b4e7d2a5f18
+Revises: 5d8f2a6c1e07
+Create Date: 2025-02-17 09:41:22.318406
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9b4e7d2a5f18"
+down_revision: Union[str, None] = "5d8f2a6c1e07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # filled from the ledger on startup, or with
+    # `python -m apps.accounting.commands backfill-rollups`
+    op.create_table(
+        "transaction_daily_rollup",
+        sa.Column("business_name", sa.String(), nullable=False),
+        sa.Column("wallet_id", sa.Uuid(), nullable=False),
+        sa.Column("currency", sa.String(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("credit", sa.Numeric(), nullable=False),
+        sa.Column("debit", sa.Numeric(), nullable=False),
+        sa.Column("credit_count", sa.Integer(), nullable=False),
+        sa.Column("debit_count", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("business_name", "wallet_id", "currency", "day"),
+    )
+    op.create_index(
+        "ix_transaction_daily_rollup_wallet_id_currency_day",
+        "transaction_daily_rollup",
+        ["wallet_id", "currency", "day"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_transaction_daily_rollup_business_name_day",
+        "transaction_daily_rollup",
+        ["business_name", "day"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_transaction_daily_rollup_business_name_day",
+        table_name="transaction_daily_rollup",
+    )
+    op.drop_index(
+        "ix_transaction_daily_rollup_wallet_id_currency_day",
+        table_name="transaction_daily_rollup",
+    )
+    op.drop_table("transaction_daily_rollup")
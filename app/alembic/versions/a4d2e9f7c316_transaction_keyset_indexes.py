@@ -0,0 +1,54 @@
+"""Transaction keyset indexes
+
+Revision ID: a4d2e9f7c316
+Revises: 3e7a5c0d41b6
+Create Date: 2025-02-08 11:03:52.774120
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a4d2e9f7c316"
+down_revision: Union[str, None] = "3e7a5c0d41b6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+not_deleted = sa.column("is_deleted") == sa.false()
+
+listing_indexes = {
+    "ix_transaction_business_name_created_at": ["business_name"],
+    "ix_transaction_business_name_wallet_id_created_at": ["business_name", "wallet_id"],
+    "ix_transaction_business_name_user_id_created_at": ["business_name", "user_id"],
+}
+
+
+def upgrade() -> None:
+    # listing orders by (created_at, uid); uid makes the keyset seek exact
+    for name, columns in listing_indexes.items():
+        op.create_index(
+            f"{name}_uid",
+            "transaction",
+            columns + ["created_at", "uid"],
+            unique=False,
+            postgresql_where=not_deleted,
+            sqlite_where=not_deleted,
+        )
+        op.drop_index(name, table_name="transaction")
+
+
+def downgrade() -> None:
+    for name, columns in listing_indexes.items():
+        op.create_index(
+            name,
+            "transaction",
+            columns + ["created_at"],
+            unique=False,
+            postgresql_where=not_deleted,
+            sqlite_where=not_deleted,
+        )
+        op.drop_index(f"{name}_uid", table_name="transaction")
@@ -0,0 +1,35 @@
+"""Wallet balance held
+
+Revision ID: c7b3e1f05a92
+Revises: a4d2e9f7c316
+Create Date: 2025-02-12 14:26:05.318442
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c7b3e1f05a92"
+down_revision: Union[str, None] = "a4d2e9f7c316"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # filled from the active holds by WalletBalance.backfill_held on startup
+    op.add_column(
+        "wallet_balance",
+        sa.Column("held", sa.Numeric(), server_default="0", nullable=False),
+    )
+    op.add_column(
+        "wallet_balance", sa.Column("held_expires_at", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("wallet_balance", "held_expires_at")
+    op.drop_column("wallet_balance", "held")
@@ -0,0 +1,49 @@
+"""Ledger verification
+
+Revision ID: e2c6a9f4b731
+Revises: 9b4e7d2a5f18
+Create Date: 2025-02-19 15:27:08.914637
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e2c6a9f4b731"
+down_revision: Union[str, None] = "9b4e7d2a5f18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ledger_verification",
+        sa.Column("since", sa.DateTime(), nullable=True),
+        sa.Column("until", sa.DateTime(), nullable=False),
+        sa.Column("rows_checked", sa.Integer(), nullable=False),
+        sa.Column("drift_count", sa.Integer(), nullable=False),
+        sa.Column("drifts", sa.JSON(), nullable=False),
+        sa.Column("uid", sa.Uuid(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("is_deleted", sa.Boolean(), nullable=False),
+        sa.Column("meta_data", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("uid"),
+    )
+    op.create_index(
+        op.f("ix_ledger_verification_created_at"),
+        "ledger_verification",
+        ["created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_ledger_verification_created_at"), table_name="ledger_verification"
+    )
+    op.drop_table("ledger_verification")
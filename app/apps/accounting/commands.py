@@ -0,0 +1,67 @@
+"""Maintenance commands of the accounting app.
+
+    python -m apps.accounting.commands backfill-rollups --from 2025-01-01
+    python -m apps.accounting.commands verify-ledger --full --workers 8
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import date
+
+from server.config import Settings
+from server.db import async_session, dispose_engines
+
+from .models import TransactionDailyRollup
+from .reconciliation import verify_ledger
+
+
+async def backfill_rollups(from_day: date | None, to_day: date | None):
+    async with async_session() as session, session.begin():
+        await TransactionDailyRollup.backfill(session, from_day, to_day)
+    await dispose_engines()
+    logging.info(f"Recomputed the daily rollups of [{from_day}, {to_day})")
+
+
+async def verify(incremental: bool, workers: int | None, shards: int | None) -> int:
+    report = await verify_ledger(incremental, workers, shards)
+    await dispose_engines()
+    logging.info(
+        f"Checked {report.rows_checked} ledger rows of ({report.since}, "
+        f"{report.until}], {report.drift_count} drifts"
+    )
+    for drift in report.drifts:
+        logging.error(f"Ledger drift: {drift}")
+    return 1 if report.drift_count else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = commands.add_parser(
+        "backfill-rollups",
+        help="recompute the daily transaction rollups of [from, to) from the ledger",
+    )
+    backfill_parser.add_argument("--from", dest="from_day", type=date.fromisoformat)
+    backfill_parser.add_argument("--to", dest="to_day", type=date.fromisoformat)
+
+    verify_parser = commands.add_parser(
+        "verify-ledger",
+        help="check running balances and proposal legs, from the last watermark",
+    )
+    verify_parser.add_argument("--full", action="store_true", help="whole ledger")
+    verify_parser.add_argument("--workers", type=int)
+    verify_parser.add_argument("--shards", type=int)
+    args = parser.parse_args()
+
+    Settings.config_logger()
+    if args.command == "backfill-rollups":
+        asyncio.run(backfill_rollups(args.from_day, args.to_day))
+    elif args.command == "verify-ledger":
+        sys.exit(asyncio.run(verify(not args.full, args.workers, args.shards)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Replay of responses to retried requests that carry an `Idempotency-Key`.
+
+The first request with a key reserves it in `IdempotencyRecord`, unique per
+business and endpoint, and stores its response there once handled. Retries
+within IDEMPOTENCY_TTL get that response back without running the request
+again. Completed responses are also kept in an in-process LRU, so most
+replays do not reach Mongo.
+
+A reservation lasts IDEMPOTENCY_PENDING_TTL and is renewed for as long as its
+request runs, so only the key of a request whose process died can be used
+again before the response is stored.
+
+`expires_at` is naive UTC, the time Mongo's TTL monitor removes records by.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from beanie.odm.operators.update.general import Set
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+from pymongo.errors import DuplicateKeyError
+
+from core.cache import TTLCache
+from server.config import Settings
+
+from .models import IdempotencyRecord
+
+# key -> (fingerprint, status_code, body) of completed requests
+response_cache: TTLCache[str, tuple[str, int, str]] = TTLCache(
+    ttl=Settings.IDEMPOTENCY_TTL, max_size=Settings.IDEMPOTENCY_CACHE_MAX_SIZE
+)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def fingerprint(payload: Any) -> str:
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def error_response(error: Exception) -> tuple[int, dict]:
+    """The status code and body the exception handlers answer `error` with."""
+    if isinstance(error, BaseHTTPException):
+        return error.status_code, {"message": error.message, "error": error.error}
+    return 500, {"message": str(error), "error": "Exception"}
+
+
+def replay(key_fingerprint: str, stored: tuple[str, int, str]) -> Response:
+    stored_fingerprint, status_code, body = stored
+    if stored_fingerprint != key_fingerprint:
+        raise BaseHTTPException(
+            422,
+            error="idempotency_key_reused",
+            message="Idempotency-Key was used for a different request",
+        )
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+async def reserve(
+    key: str, key_fingerprint: str, business_name: str, user_id: uuid.UUID
+) -> IdempotencyRecord | Response:
+    """The new record of `key`, or the replay of its stored response."""
+    while True:
+        now = utcnow()
+        record = IdempotencyRecord(
+            business_name=business_name,
+            user_id=user_id,
+            key=key,
+            fingerprint=key_fingerprint,
+            expires_at=now + timedelta(seconds=Settings.IDEMPOTENCY_PENDING_TTL),
+        )
+        try:
+            await record.insert()
+            return record
+        except DuplicateKeyError:
+            pass
+
+        existing = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+        if existing is None:
+            continue
+        if existing.expires_at <= now:
+            # expired, but not removed by the TTL monitor yet; kept if its
+            # request renewed it meanwhile
+            await IdempotencyRecord.find_one(
+                IdempotencyRecord.id == existing.id,
+                IdempotencyRecord.expires_at <= now,
+            ).delete_one()
+            continue
+        if existing.status_code is None:
+            raise BaseHTTPException(
+                409,
+                error="request_in_progress",
+                message="A request with this Idempotency-Key is in progress",
+            )
+
+        stored = (existing.fingerprint, existing.status_code, existing.body)
+        remaining = (existing.expires_at - now).total_seconds()
+        response_cache.set(key, stored, ttl=remaining)
+        return replay(key_fingerprint, stored)
+
+
+async def renew(record: IdempotencyRecord):
+    """Extend the reservation of `record` until its response is stored."""
+    pending = timedelta(seconds=Settings.IDEMPOTENCY_PENDING_TTL)
+    while True:
+        await asyncio.sleep(pending.total_seconds() / 3)
+        renewed = await IdempotencyRecord.find_one(
+            IdempotencyRecord.id == record.id, IdempotencyRecord.status_code == None
+        ).update(Set({"expires_at": utcnow() + pending}))
+        if not renewed.modified_count:
+            return
+
+
+async def idempotent(
+    key: str,
+    payload: Any,
+    business_name: str,
+    user_id: uuid.UUID,
+    handler: Callable[[], Awaitable[tuple[int, Any]]],
+) -> Response:
+    """Run `handler`, returning its status code and body, once per `key`.
+
+    A handler that raises releases the key, so the request can be retried.
+    A handler that has already made its change must not raise, but return
+    the `error_response` to be replayed instead.
+    """
+    key_fingerprint = fingerprint(payload)
+    stored = response_cache.get(key)
+    if stored is not None:
+        return replay(key_fingerprint, stored)
+
+    record = await reserve(key, key_fingerprint, business_name, user_id)
+    if isinstance(record, Response):
+        return record
+
+    renewal = asyncio.create_task(renew(record))
+    try:
+        status_code, result = await handler()
+    except Exception:
+        await record.delete()
+        raise
+    finally:
+        renewal.cancel()
+
+    body = json.dumps(jsonable_encoder(result))
+    # only while the reservation is still this request's own
+    saved = await IdempotencyRecord.find_one(
+        IdempotencyRecord.id == record.id, IdempotencyRecord.status_code == None
+    ).update(
+        Set(
+            {
+                "status_code": status_code,
+                "body": body,
+                "expires_at": utcnow() + timedelta(seconds=Settings.IDEMPOTENCY_TTL),
+            }
+        )
+    )
+    if saved.modified_count:
+        response_cache.set(key, (key_fingerprint, status_code, body))
+    else:
+        logging.warning(f"Idempotency-Key {key} was reclaimed before it was answered")
+    return Response(body, status_code=status_code, media_type="application/json")
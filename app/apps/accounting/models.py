@@ -1,24 +1,52 @@
+import asyncio
 import uuid
-from datetime import date, datetime
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 from enum import Enum
-from typing import Literal
+from typing import AsyncIterator, Literal
 
 from beanie import Link
+from beanie.odm.operators.find.comparison import In
+from beanie.odm.operators.update.general import Set
+from beanie.odm.queries.update import UpdateResponse
 from fastapi_mongo_base.models import BusinessOwnedEntity
 from fastapi_mongo_base.tasks import TaskMixin
 from fastapi_mongo_base.utils.bsontools import decimal_amount
 from pydantic import field_validator
-from pymongo import ASCENDING, IndexModel
-from sqlalchemy import select
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from sqlalchemy import (
+    JSON,
+    Index,
+    and_,
+    case,
+    column,
+    delete,
+    false,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+    true,
+    update,
+)
 from sqlalchemy.orm import Mapped, mapped_column
 
-from apps.base.models import ImmutableBusinessOwnedEntity
+from apps.base.models import BaseEntity, ImmutableBusinessOwnedEntity
 from core.currency import Currency
+from core.pagination import TotalMode, mongo_total
 
 from .schemas import Participant, WalletSchema
 
 
+def naive_local(value: datetime) -> datetime:
+    """`value` in naive local time, like the `datetime.now()` timestamps
+    stored in both databases."""
+    if value.tzinfo:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
 class StatusEnum(str, Enum):
     ACTIVE = "active"
     INACTIVE = "inactive"
@@ -27,7 +55,87 @@ class StatusEnum(str, Enum):
 
 class Wallet(WalletSchema, BusinessOwnedEntity):
     class Settings:
-        indexes = BusinessOwnedEntity.Settings.indexes
+        indexes = BusinessOwnedEntity.Settings.indexes + [
+            IndexModel(
+                [
+                    ("business_name", ASCENDING),
+                    ("created_at", DESCENDING),
+                    ("uid", DESCENDING),
+                ]
+            ),
+        ]
+
+    @classmethod
+    async def list_items(
+        cls,
+        user_id: uuid.UUID = None,
+        business_name: str = None,
+        offset: int = 0,
+        limit: int = 10,
+        is_deleted: bool = False,
+        cursor: tuple[datetime, uuid.UUID] | None = None,
+        *args,
+        **kwargs,
+    ):
+        offset, limit = cls.adjust_pagination(offset, limit)
+        query = cls.get_query(
+            user_id=user_id,
+            business_name=business_name,
+            is_deleted=is_deleted,
+            *args,
+            **kwargs,
+        )
+        if cursor:
+            # keyset seek: documents strictly after (created_at, uid)
+            created_at, uid = cursor
+            query = query.find(
+                {
+                    "$or": [
+                        {"created_at": {"$lt": created_at}},
+                        {"created_at": created_at, "uid": {"$lt": uid}},
+                    ]
+                }
+            )
+
+        items_query = (
+            query.sort([("created_at", DESCENDING), ("uid", DESCENDING)])
+            .skip(offset)
+            .limit(limit)
+        )
+        return await items_query.to_list()
+
+    @classmethod
+    async def list_total_combined(
+        cls,
+        user_id: uuid.UUID = None,
+        business_name: str = None,
+        offset: int = 0,
+        limit: int = 10,
+        is_deleted: bool = False,
+        cursor: tuple[datetime, uuid.UUID] | None = None,
+        include_total: TotalMode = TotalMode.exact,
+        *args,
+        **kwargs,
+    ) -> tuple[list["Wallet"], int | None]:
+        query = cls.get_query(
+            user_id=user_id,
+            business_name=business_name,
+            is_deleted=is_deleted,
+            **kwargs,
+        )
+        items, total = await asyncio.gather(
+            cls.list_items(
+                user_id=user_id,
+                business_name=business_name,
+                offset=offset,
+                limit=limit,
+                is_deleted=is_deleted,
+                cursor=cursor,
+                **kwargs,
+            ),
+            mongo_total(query, include_total),
+        )
+        return items, total
 
     async def get_holds(
         self, currency: str | None = None, status: StatusEnum | None = StatusEnum.ACTIVE
@@ -47,7 +155,7 @@ class Wallet(WalletSchema, BusinessOwnedEntity):
         offset: int = 0,
         limit: int = 20,
     ):
-        from server.db import async_session
+        from server.db import get_session
 
         base_query = [Transaction.wallet_id == self.uid]
         if to_date is None:
@@ -56,13 +164,117 @@ class Wallet(WalletSchema, BusinessOwnedEntity):
             base_query.append(Transaction.created_at >= from_date)
             base_query.append(Transaction.created_at <= to_date)
 
-        async with async_session() as session:
+        async with get_session(read_only=True) as session:
             query = select(Transaction).where(*base_query).offset(offset).limit(limit)
             result = await session.execute(query)
             return result.scalars().all()
 
+    async def get_statement(
+        self, currency: str, from_date: datetime, to_date: datetime
+    ) -> dict:
+        """Opening and closing balance, credits, debits and transaction count of
+        `currency` between `from_date` and `to_date`, in one statement.
+
+        Whole days are summed from `TransactionDailyRollup`, only the partial
+        days at either end are aggregated from the ledger.
+        """
+        from server.db import get_session
+
+        from_date, to_date = naive_local(from_date), naive_local(to_date)
+
+        in_currency = [
+            Transaction.wallet_id == self.uid,
+            Transaction.currency == currency,
+        ]
+
+        def balance_where(*conditions):
+            return (
+                select(Transaction.balance)
+                .where(*in_currency, *conditions)
+                .order_by(Transaction.created_at.desc())
+                .limit(1)
+                .correlate(None)
+                .scalar_subquery()
+            )
+
+        # whole days are [first_day, last_day)
+        first_day = datetime.combine(from_date.date(), time.min)
+        if first_day < from_date:
+            first_day += timedelta(days=1)
+        last_day = datetime.combine(to_date.date(), time.min)
+
+        if first_day < last_day:
+            in_period = or_(
+                and_(
+                    Transaction.created_at >= from_date,
+                    Transaction.created_at < first_day,
+                ),
+                and_(
+                    Transaction.created_at >= last_day,
+                    Transaction.created_at <= to_date,
+                ),
+            )
+        else:
+            in_period = and_(
+                Transaction.created_at >= from_date,
+                Transaction.created_at <= to_date,
+            )
+
+        ledger = (
+            select(
+                func.sum(
+                    case((Transaction.amount > 0, Transaction.amount), else_=0)
+                ).label("credits"),
+                func.sum(
+                    case((Transaction.amount < 0, Transaction.amount), else_=0)
+                ).label("debits"),
+                func.count().label("count"),
+            )
+            .where(*in_currency, in_period)
+            .subquery()
+        )
+        rollup = TransactionDailyRollup.totals_query(
+            first_day.date(),
+            max(first_day, last_day).date(),
+            wallet_id=self.uid,
+            currency=currency,
+        ).subquery()
+
+        query = (
+            select(
+                balance_where(Transaction.created_at < from_date).label("opening"),
+                balance_where(Transaction.created_at <= to_date).label("closing"),
+                (
+                    func.coalesce(ledger.c.credits, 0)
+                    + func.coalesce(rollup.c.credits, 0)
+                ).label("credits"),
+                (
+                    func.coalesce(ledger.c.debits, 0)
+                    + func.coalesce(rollup.c.debits, 0)
+                ).label("debits"),
+                (ledger.c.count + func.coalesce(rollup.c.count, 0)).label("count"),
+            )
+            .select_from(ledger)
+            .join(rollup, true())
+        )
+
+        async with get_session(read_only=True) as session:
+            row = (await session.execute(query)).one()
+
+        return dict(
+            wallet_id=self.uid,
+            currency=currency,
+            from_date=from_date,
+            to_date=to_date,
+            opening_balance=row.opening or Decimal(0),
+            closing_balance=row.closing or Decimal(0),
+            total_credits=Decimal(row.credits),
+            total_debits=Decimal(row.debits),
+            transaction_count=row.count,
+        )
+
     async def get_currencies(self):
-        from server.db import async_session
+        from server.db import get_session
 
         currencies = []
 
@@ -72,11 +284,9 @@ class Wallet(WalletSchema, BusinessOwnedEntity):
         if self.wallet_type == "app_income":
             return currencies
 
-        async with async_session() as session:
-            query = (
-                select(Transaction.currency)
-                .where(Transaction.wallet_id == self.uid)
-                .distinct()
+        async with get_session(read_only=True) as session:
+            query = select(WalletBalance.currency).where(
+                WalletBalance.wallet_id == self.uid
             )
             result = await session.execute(query)
 
@@ -84,60 +294,135 @@ class Wallet(WalletSchema, BusinessOwnedEntity):
 
         return currencies
 
-    async def get_balance(self, currency: str | None = None) -> dict[str, Decimal]:
-        from server.db import async_session
+    @classmethod
+    async def get_balances_bulk(
+        cls, wallet_ids: list[uuid.UUID], read_only: bool = True
+    ) -> dict[uuid.UUID, dict[str, Decimal]]:
+        """Stored balances of all currencies of `wallet_ids` in one statement.
 
-        balance = {}
-        if currency is None:
-            for currency in await self.get_currencies():
-                balance.update(await self.get_balance(currency))
-            return balance
+        Read from the replica unless `read_only` is False, for callers acting
+        on the balance.
+        """
+        from server.db import get_session
 
-        if self.wallet_type == "app_income":
-            if currency == self.main_currency:
-                return {currency: Decimal("Infinity")}
-            return {currency: Decimal(0)}
+        balances: dict[uuid.UUID, dict[str, Decimal]] = {
+            wallet_id: {} for wallet_id in wallet_ids
+        }
+        if not wallet_ids:
+            return balances
 
-        async with async_session() as session:
-            query = (
-                select(Transaction.balance)
-                .where(
-                    Transaction.wallet_id == self.uid, Transaction.currency == currency
+        async with get_session(read_only=read_only) as session:
+            query = select(
+                WalletBalance.wallet_id, WalletBalance.currency, WalletBalance.balance
+            ).where(WalletBalance.wallet_id.in_(set(wallet_ids)))
+            result = await session.execute(query)
+            for row in result:
+                balances[row.wallet_id][row.currency] = row.balance
+
+        return balances
+
+    def balance_from_stored(
+        self, stored: dict[str, Decimal], currency: str | None = None
+    ) -> dict[str, Decimal]:
+        if currency:
+            currencies = {currency}
+        else:
+            currencies = set(stored) if self.wallet_type != "app_income" else set()
+            if self.main_currency != Currency.none:
+                currencies.add(self.main_currency)
+
+        if self.wallet_type == "app_income":
+            return {
+                currency: (
+                    Decimal("Infinity")
+                    if currency == self.main_currency
+                    else Decimal(0)
                 )
-                .order_by(Transaction.created_at.desc())
-                .limit(1)
+                for currency in currencies
+            }
+
+        return {
+            currency: stored.get(currency) or Decimal(0)
+            for currency in sorted(currencies)
+        }
+
+    async def get_balances_as_of(
+        self, as_of: datetime, currency: str | None = None, read_only: bool = True
+    ) -> dict[str, Decimal]:
+        """Balance of each currency at `as_of`, in one statement.
+
+        Every ledger row carries the running balance, so each currency is one
+        seek on (wallet_id, currency, created_at) for the last row up to
+        `as_of`; the currencies come from `wallet_balance`.
+        """
+        from server.db import get_session
+
+        as_of = naive_local(as_of)
+
+        latest = (
+            select(Transaction.balance)
+            .where(
+                Transaction.wallet_id == self.uid,
+                Transaction.currency == WalletBalance.currency,
+                Transaction.created_at <= as_of,
             )
+            .order_by(Transaction.created_at.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        query = select(WalletBalance.currency, latest.label("balance")).where(
+            WalletBalance.wallet_id == self.uid
+        )
+        if currency:
+            query = query.where(WalletBalance.currency == currency)
+
+        async with get_session(read_only=read_only) as session:
             result = await session.execute(query)
-            return {currency: result.scalars().one_or_none() or Decimal(0)}
+            return {
+                row.currency: row.balance
+                for row in result
+                if row.balance is not None
+            }
+
+    async def get_balance(
+        self,
+        currency: str | None = None,
+        read_only: bool = True,
+        as_of: datetime | None = None,
+    ) -> dict[str, Decimal]:
+        """Current balances, or the balances at `as_of` when given."""
+        stored = {}
+        if self.wallet_type != "app_income":
+            if as_of:
+                stored = await self.get_balances_as_of(as_of, currency, read_only)
+            else:
+                balances = await self.get_balances_bulk([self.uid], read_only)
+                stored = balances[self.uid]
+        return self.balance_from_stored(stored, currency)
 
     async def get_held_amount(
         self,
         currency: str | None = None,
         status: StatusEnum | None = None,
     ) -> Decimal:
-        from bson import UUID_SUBTYPE, Binary
-
-        uid = Binary.from_uuid(self.uid, UUID_SUBTYPE)
+        from server.db import async_session
 
-        current_time = datetime.now()
-        pipeline = [
-            {
-                "$match": {
-                    "wallet_id": uid,
-                    "status": "active",
-                    "expires_at": {"$gt": current_time},
-                    "currency": currency,
-                }
-            },
-            {"$group": {"_id": None, "total_amount": {"$sum": "$amount"}}},
-        ]
+        async def read_held():
+            async with async_session() as session:
+                result = await session.execute(
+                    select(WalletBalance.held, WalletBalance.held_expires_at).where(
+                        WalletBalance.wallet_id == self.uid,
+                        WalletBalance.currency == currency,
+                    )
+                )
+                return result.first()
 
-        result = await WalletHold.aggregate(pipeline).to_list()
+        held = await read_held()
+        if held and held.held_expires_at and held.held_expires_at <= datetime.now():
+            await WalletHold.expire_holds(wallet_id=self.uid, currency=currency)
+            held = await read_held()
 
-        if result:
-            return Decimal(result[0]["total_amount"])
-        else:
-            return Decimal("0.00")
+        return held.held if held else Decimal(0)
 
 
 class WalletHold(BusinessOwnedEntity):
@@ -148,19 +433,216 @@ class WalletHold(BusinessOwnedEntity):
     currency: str
     description: str | None = None
     wallet: Link[Wallet]
+    # set by the expire_holds call that moved the hold to inactive
+    sweep_id: uuid.UUID | None = None
 
     class Settings:
+        # equality fields first, then the sort field, then the range field
         indexes = BusinessOwnedEntity.Settings.indexes + [
-            IndexModel([("wallet_id", ASCENDING)]),
-            IndexModel([("expires_at", ASCENDING)]),
-            IndexModel([("status", ASCENDING)]),
-            IndexModel([("currency", ASCENDING)]),
+            # get_holds_query / list_total_combined: wallet listing, newest
+            # first, optionally within a created_at range
+            IndexModel(
+                [
+                    ("wallet_id", ASCENDING),
+                    ("status", ASCENDING),
+                    ("is_deleted", ASCENDING),
+                    ("created_at", DESCENDING),
+                ]
+            ),
+            # expire_holds for one wallet and the next hold to expire
+            IndexModel(
+                [
+                    ("wallet_id", ASCENDING),
+                    ("currency", ASCENDING),
+                    ("status", ASCENDING),
+                    ("is_deleted", ASCENDING),
+                    ("expires_at", ASCENDING),
+                ]
+            ),
+            # hold sweeper and backfill_held, over the active holds only
+            IndexModel(
+                [
+                    ("status", ASCENDING),
+                    ("is_deleted", ASCENDING),
+                    ("expires_at", ASCENDING),
+                ],
+                partialFilterExpression={"status": StatusEnum.ACTIVE.value},
+            ),
         ]
 
     @field_validator("amount", mode="before")
     def validate_amount(cls, value):
         return decimal_amount(value)
 
+    @field_validator("expires_at")
+    def validate_expires_at(cls, value):
+        # compared with `datetime.now()` by the sweeper
+        return naive_local(value)
+
+    @property
+    def held_amount(self) -> Decimal:
+        """What this hold adds to the held total of its wallet."""
+        if self.status == StatusEnum.ACTIVE and not self.is_deleted:
+            return self.amount
+        return Decimal(0)
+
+    @classmethod
+    async def create_item(cls, data: dict) -> "WalletHold":
+        item = cls(**data)
+        await item.insert()
+        if item.held_amount:
+            await WalletBalance.apply_held_change(
+                item.wallet_id, item.currency, item.amount, item.expires_at
+            )
+        return item
+
+    @classmethod
+    async def update_item(cls, item: "WalletHold", data: dict) -> "WalletHold":
+        changes = {
+            key: value
+            for key, value in data.items()
+            if hasattr(item, key)
+            and (not cls.update_field_set() or key in cls.update_field_set())
+            and not (cls.update_exclude_set() and key in cls.update_exclude_set())
+        }
+        return await cls.change_item(item, changes)
+
+    @classmethod
+    async def delete_item(cls, item: "WalletHold") -> "WalletHold":
+        return await cls.change_item(item, {"is_deleted": True})
+
+    @classmethod
+    async def change_item(cls, item: "WalletHold", changes: dict) -> "WalletHold":
+        """Write `changes` and move the held totals by what they change.
+
+        The write only matches the hold as `item` saw it, so the difference
+        is taken against the stored hold and a concurrent change, such as the
+        sweeper expiring it, is neither counted twice nor overwritten. On a
+        mismatch the changes are applied again to the current hold.
+        """
+        if changes.get("expires_at"):
+            changes = changes | {"expires_at": naive_local(changes["expires_at"])}
+        while True:
+            updated = await cls.find_one(
+                cls.id == item.id,
+                cls.wallet_id == item.wallet_id,
+                cls.currency == item.currency,
+                cls.status == item.status,
+                cls.amount == item.amount,
+                cls.is_deleted == item.is_deleted,
+            ).update(
+                Set(changes | {"updated_at": datetime.now()}),
+                response_type=UpdateResponse.NEW_DOCUMENT,
+            )
+            if updated:
+                break
+            item = await cls.get(item.id)
+            if item is None:
+                raise ValueError("Hold does not exist")
+
+        previous_held = item.held_amount
+        if (item.wallet_id, item.currency) != (updated.wallet_id, updated.currency):
+            if previous_held:
+                await WalletBalance.apply_held_change(
+                    item.wallet_id, item.currency, -previous_held
+                )
+            previous_held = Decimal(0)
+
+        expires_at = updated.expires_at if updated.held_amount else None
+        if updated.held_amount != previous_held or expires_at:
+            await WalletBalance.apply_held_change(
+                updated.wallet_id,
+                updated.currency,
+                updated.held_amount - previous_held,
+                expires_at,
+            )
+        return updated
+
+    @classmethod
+    async def drop_legacy_indexes(cls):
+        """Drop the single-field indexes replaced by the compound ones."""
+        collection = cls.get_motor_collection()
+        existing = await collection.index_information()
+        for name in ["wallet_id_1", "expires_at_1", "status_1", "currency_1"]:
+            if name in existing:
+                await collection.drop_index(name)
+
+    @classmethod
+    async def expire_holds(
+        cls,
+        wallet_id: uuid.UUID | None = None,
+        currency: str | None = None,
+        batch_size: int | None = None,
+    ) -> list["WalletHold"]:
+        """Move up to `batch_size` active holds past their `expires_at` to
+        inactive and release them from the held totals."""
+        now = datetime.now()
+        query = [
+            cls.status == StatusEnum.ACTIVE,
+            cls.is_deleted == False,
+            cls.expires_at <= now,
+        ]
+        if wallet_id:
+            query.append(cls.wallet_id == wallet_id)
+        if currency:
+            query.append(cls.currency == currency)
+
+        candidates = cls.find(*query).sort(+cls.expires_at)
+        if batch_size:
+            candidates = candidates.limit(batch_size)
+        candidates = await candidates.to_list()
+
+        expired: list[WalletHold] = []
+        if candidates:
+            # the token tells the holds this call moved from those a
+            # concurrent sweep got to first
+            sweep_id = uuid.uuid4()
+            ids = [hold.id for hold in candidates]
+            # holds deleted or extended since they were read are left alone
+            await cls.find(In(cls.id, ids), *query).update_many(
+                Set(
+                    {
+                        cls.status: StatusEnum.INACTIVE,
+                        cls.sweep_id: sweep_id,
+                        cls.updated_at: datetime.now(),
+                    }
+                )
+            )
+            expired = await cls.find(
+                In(cls.id, ids), cls.sweep_id == sweep_id
+            ).to_list()
+
+        released: dict[tuple[uuid.UUID, str], Decimal] = {}
+        if wallet_id and currency:
+            # refresh held_expires_at even if it pointed at a hold that moved
+            released[(wallet_id, currency)] = Decimal(0)
+        for hold in expired:
+            key = (hold.wallet_id, hold.currency)
+            released[key] = released.get(key, Decimal(0)) + hold.amount
+
+        for (hold_wallet_id, hold_currency), amount in released.items():
+            if amount:
+                await WalletBalance.apply_held_change(
+                    hold_wallet_id, hold_currency, -amount
+                )
+            next_hold = (
+                await cls.find(
+                    cls.wallet_id == hold_wallet_id,
+                    cls.currency == hold_currency,
+                    cls.status == StatusEnum.ACTIVE,
+                    cls.is_deleted == False,
+                )
+                .sort(+cls.expires_at)
+                .first_or_none()
+            )
+            await WalletBalance.reset_held_expires_at(
+                hold_wallet_id,
+                hold_currency,
+                next_hold.expires_at if next_hold else None,
+            )
+
+        return expired
+
     @classmethod
     def get_holds_query(
         cls,
@@ -191,8 +673,9 @@ class WalletHold(BusinessOwnedEntity):
         if from_date and to_date:
             base_query.append(cls.created_at >= from_date)
             base_query.append(cls.created_at <= to_date)
-        else:
-            base_query.append(cls.expires_at > datetime.now())
+        elif not status:
+            # expired holds are moved to inactive by the hold sweeper
+            base_query.append(cls.status == StatusEnum.ACTIVE)
 
         return cls.find(*base_query)
 
@@ -295,9 +778,10 @@ class WalletHold(BusinessOwnedEntity):
         is_deleted: bool = False,
         offset: int = 0,
         limit: int = 10,
+        include_total: TotalMode = TotalMode.exact,
         *args,
         **kwargs,
-    ) -> tuple[list["WalletHold"], int]:
+    ) -> tuple[list["WalletHold"], int | None]:
         offset, limit = cls.adjust_pagination(offset, limit)
         query = cls.get_holds_query(
             user_id=user_id,
@@ -313,34 +797,63 @@ class WalletHold(BusinessOwnedEntity):
         )
         items_query = query.sort("-created_at").skip(offset).limit(limit)
         items = await items_query.to_list()
-        total = await query.count()
+        total = await mongo_total(query, include_total)
 
         return items, total
 
 
 class Transaction(ImmutableBusinessOwnedEntity):
+    __table_args__ = (
+        # latest balance / statements of a wallet in one currency
+        Index(
+            "ix_transaction_wallet_id_currency_created_at",
+            "wallet_id",
+            "currency",
+            "created_at",
+            # index-only scans for Wallet.get_statement
+            postgresql_include=["amount", "balance"],
+        ),
+        # Wallet.get_transactions
+        Index("ix_transaction_wallet_id_created_at", "wallet_id", "created_at"),
+        # list_items of Transaction.get_query, newest first, keyset on uid
+        Index(
+            "ix_transaction_business_name_created_at_uid",
+            "business_name",
+            "created_at",
+            "uid",
+            postgresql_where=column("is_deleted") == false(),
+            sqlite_where=column("is_deleted") == false(),
+        ),
+        Index(
+            "ix_transaction_business_name_wallet_id_created_at_uid",
+            "business_name",
+            "wallet_id",
+            "created_at",
+            "uid",
+            postgresql_where=column("is_deleted") == false(),
+            sqlite_where=column("is_deleted") == false(),
+        ),
+        Index(
+            "ix_transaction_business_name_user_id_created_at_uid",
+            "business_name",
+            "user_id",
+            "created_at",
+            "uid",
+            postgresql_where=column("is_deleted") == false(),
+            sqlite_where=column("is_deleted") == false(),
+        ),
+    )
+
     proposal_id: Mapped[uuid.UUID] = mapped_column(index=True)
-    wallet_id: Mapped[uuid.UUID] = mapped_column(index=True)
+    wallet_id: Mapped[uuid.UUID]
     amount: Mapped[Decimal] = mapped_column(onupdate=None)
     currency: Mapped[str] = mapped_column(index=True)
     balance: Mapped[Decimal]
     description: Mapped[str | None]
 
-    async def get_note(self) -> str:
-        try:
-            note = (
-                await TransactionNote.find(TransactionNote.transaction_id == self.uid)
-                .sort("-created_at")
-                .first_or_none()
-            )
-
-            if note:
-                return note.note
-            return None
-        except Exception as e:
-            # Handle or log the exception
-            print(f"An error occurred: {e}")
-            return None
+    async def get_note(self) -> str | None:
+        notes = await TransactionNote.get_latest_notes([self.uid])
+        return notes.get(self.uid)
 
     @classmethod
     def get_query(
@@ -354,7 +867,8 @@ class Transaction(ImmutableBusinessOwnedEntity):
         *args,
         **kwargs,
     ):
-        base_query = [cls.is_deleted == is_deleted]
+        # literal so the partial `is_deleted = false` indexes can be used
+        base_query = [cls.is_deleted == (true() if is_deleted else false())]
 
         if hasattr(cls, "user_id") and user_id:
             base_query.append(cls.user_id == user_id)
@@ -369,6 +883,554 @@ class Transaction(ImmutableBusinessOwnedEntity):
 
         return base_query
 
+    @classmethod
+    async def export_batches(
+        cls, batch_size: int | None = None, **kwargs
+    ) -> AsyncIterator[list[dict]]:
+        """Rows of `get_query(**kwargs)`, oldest first, with their latest note.
+
+        Read over a server-side cursor `batch_size` rows at a time, as plain
+        rows so nothing piles up in the session.
+        """
+        from server.config import Settings
+        from server.db import get_session
+
+        batch_size = batch_size or Settings.EXPORT_BATCH_SIZE
+        columns = [
+            column
+            for column in cls.__table__.columns
+            if column.name not in ["is_deleted", "meta_data"]
+        ]
+        query = (
+            select(*columns)
+            .filter(*cls.get_query(**kwargs))
+            .order_by(cls.created_at, cls.uid)
+            .execution_options(yield_per=batch_size)
+        )
+
+        async with get_session(read_only=True) as session:
+            result = await session.stream(query)
+            async for rows in result.mappings().partitions():
+                notes = await TransactionNote.get_latest_notes(
+                    [row["uid"] for row in rows]
+                )
+                yield [dict(row, note=notes.get(row["uid"])) for row in rows]
+
+
+class WalletBalance(BaseEntity):
+    """Latest balance of each (wallet, currency), kept in step with `transaction`."""
+
+    __tablename__ = "wallet_balance"
+
+    uid = None
+    created_at = None
+    is_deleted = None
+    meta_data = None
+
+    wallet_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    currency: Mapped[str] = mapped_column(primary_key=True)
+    balance: Mapped[Decimal] = mapped_column(default=Decimal(0))
+    # total of the active holds and the earliest expires_at among them
+    held: Mapped[Decimal] = mapped_column(default=Decimal(0), server_default="0")
+    held_expires_at: Mapped[datetime | None]
+
+    @classmethod
+    def get_upsert_insert(cls, dialect_name: str):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            raise NotImplementedError(f"Upsert is not supported on {dialect_name}")
+        return dialect_insert
+
+    @classmethod
+    async def apply_changes(
+        cls, session, currency: str, changes: dict[uuid.UUID, Decimal]
+    ):
+        """Add `changes` (wallet_id -> amount) to the stored balances.
+
+        Must run inside the transaction that writes the matching ledger rows.
+        """
+        if not changes:
+            return
+
+        dialect_insert = cls.get_upsert_insert(session.bind.dialect.name)
+        now = datetime.now()
+        query = dialect_insert(cls).values(
+            [
+                dict(
+                    wallet_id=wallet_id,
+                    currency=currency,
+                    balance=amount,
+                    updated_at=now,
+                )
+                for wallet_id, amount in changes.items()
+            ]
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[cls.wallet_id, cls.currency],
+            set_=dict(
+                balance=cls.balance + query.excluded.balance,
+                updated_at=query.excluded.updated_at,
+            ),
+        )
+        await session.execute(query)
+
+    @classmethod
+    async def get_for_update(
+        cls, session, currency: str, wallet_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, Decimal]:
+        """Read (and on PostgreSQL row-lock) the balances of `wallet_ids`.
+
+        Rows are locked in wallet_id order so that concurrent proposals sharing
+        wallets always wait on each other in the same order and cannot
+        deadlock. Missing rows are created first so that there is a row to lock.
+        """
+        wallet_ids = sorted(set(wallet_ids))
+        query = (
+            select(cls.wallet_id, cls.balance)
+            .where(cls.wallet_id.in_(wallet_ids), cls.currency == currency)
+            .order_by(cls.wallet_id)
+        )
+
+        if session.bind.dialect.name == "postgresql":
+            dialect_insert = cls.get_upsert_insert("postgresql")
+            now = datetime.now()
+            await session.execute(
+                dialect_insert(cls)
+                .values(
+                    [
+                        dict(
+                            wallet_id=wallet_id,
+                            currency=currency,
+                            balance=Decimal(0),
+                            updated_at=now,
+                        )
+                        for wallet_id in wallet_ids
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=[cls.wallet_id, cls.currency])
+            )
+            query = query.with_for_update()
+
+        result = await session.execute(query)
+        return dict(result.all())
+
+    @classmethod
+    async def apply_held_change(
+        cls,
+        wallet_id: uuid.UUID,
+        currency: str,
+        amount: Decimal,
+        expires_at: datetime | None = None,
+    ):
+        """Add `amount` to the held total, moving `held_expires_at` earlier
+        when `expires_at` is sooner."""
+        from server.db import async_session
+
+        if expires_at:
+            expires_at = naive_local(expires_at)
+
+        async with async_session() as session, session.begin():
+            dialect_insert = cls.get_upsert_insert(session.bind.dialect.name)
+            query = dialect_insert(cls).values(
+                wallet_id=wallet_id,
+                currency=currency,
+                balance=Decimal(0),
+                held=amount,
+                held_expires_at=expires_at,
+                updated_at=datetime.now(),
+            )
+            query = query.on_conflict_do_update(
+                index_elements=[cls.wallet_id, cls.currency],
+                set_=dict(
+                    held=cls.held + query.excluded.held,
+                    held_expires_at=case(
+                        (
+                            or_(
+                                cls.held_expires_at.is_(None),
+                                cls.held_expires_at > query.excluded.held_expires_at,
+                            ),
+                            query.excluded.held_expires_at,
+                        ),
+                        else_=cls.held_expires_at,
+                    ),
+                    updated_at=query.excluded.updated_at,
+                ),
+            )
+            await session.execute(query)
+
+    @classmethod
+    async def reset_held_expires_at(
+        cls, wallet_id: uuid.UUID, currency: str, expires_at: datetime | None
+    ):
+        """Replace a `held_expires_at` that is already due, e.g. after expiry.
+
+        A sooner value written in the meantime by a new hold is kept.
+        """
+        from server.db import async_session
+
+        async with async_session() as session, session.begin():
+            await session.execute(
+                update(cls)
+                .where(
+                    cls.wallet_id == wallet_id,
+                    cls.currency == currency,
+                    cls.held_expires_at <= datetime.now(),
+                )
+                .values(held_expires_at=expires_at)
+            )
+
+    @classmethod
+    async def backfill_held(cls, session):
+        """Load the held totals from the active holds, unless already tracked."""
+        if await session.scalar(
+            select(func.count()).select_from(cls).where(cls.held != 0)
+        ):
+            return
+
+        pipeline = [
+            {"$match": {"status": StatusEnum.ACTIVE.value, "is_deleted": False}},
+            {
+                "$group": {
+                    "_id": {"wallet_id": "$wallet_id", "currency": "$currency"},
+                    "held": {"$sum": "$amount"},
+                    "held_expires_at": {"$min": "$expires_at"},
+                }
+            },
+        ]
+        from bson import UUID_SUBTYPE
+
+        totals = await WalletHold.aggregate(pipeline).to_list()
+        if not totals:
+            return
+
+        dialect_insert = cls.get_upsert_insert(session.bind.dialect.name)
+        now = datetime.now()
+        query = dialect_insert(cls).values(
+            [
+                dict(
+                    wallet_id=(
+                        total["_id"]["wallet_id"]
+                        if isinstance(total["_id"]["wallet_id"], uuid.UUID)
+                        else total["_id"]["wallet_id"].as_uuid(UUID_SUBTYPE)
+                    ),
+                    currency=total["_id"]["currency"],
+                    balance=Decimal(0),
+                    held=Decimal(str(total["held"])),
+                    held_expires_at=total["held_expires_at"],
+                    updated_at=now,
+                )
+                for total in totals
+            ]
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[cls.wallet_id, cls.currency],
+            set_=dict(
+                held=query.excluded.held,
+                held_expires_at=query.excluded.held_expires_at,
+            ),
+        )
+        await session.execute(query)
+
+    @classmethod
+    def backfill_query(cls):
+        """INSERT ... SELECT of the latest ledger balance per (wallet, currency)."""
+        latest = select(
+            Transaction.wallet_id,
+            Transaction.currency,
+            Transaction.balance,
+            Transaction.created_at,
+            func.row_number()
+            .over(
+                partition_by=(Transaction.wallet_id, Transaction.currency),
+                order_by=Transaction.created_at.desc(),
+            )
+            .label("row_number"),
+        ).subquery()
+
+        return insert(cls).from_select(
+            ["wallet_id", "currency", "balance", "updated_at"],
+            select(
+                latest.c.wallet_id,
+                latest.c.currency,
+                latest.c.balance,
+                latest.c.created_at,
+            ).where(latest.c.row_number == 1),
+        )
+
+    @classmethod
+    async def backfill(cls, session):
+        """Populate an empty balance table from the ledger."""
+        result = await session.execute(select(cls.wallet_id).limit(1))
+        if result.first() is not None:
+            return
+        await session.execute(cls.backfill_query())
+
+
+class TransactionDailyRollup(BaseEntity):
+    """Credit and debit totals of each (business, wallet, currency, day), kept
+    in step with `transaction` so that reports read O(days) rows."""
+
+    __tablename__ = "transaction_daily_rollup"
+
+    uid = None
+    created_at = None
+    is_deleted = None
+    meta_data = None
+
+    business_name: Mapped[str] = mapped_column(primary_key=True)
+    wallet_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    currency: Mapped[str] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    # credits are the rows with amount >= 0, debits (negative) the others
+    credit: Mapped[Decimal] = mapped_column(default=Decimal(0))
+    debit: Mapped[Decimal] = mapped_column(default=Decimal(0))
+    credit_count: Mapped[int] = mapped_column(default=0)
+    debit_count: Mapped[int] = mapped_column(default=0)
+
+    __table_args__ = (
+        # statements and reports of one wallet
+        Index(
+            "ix_transaction_daily_rollup_wallet_id_currency_day",
+            "wallet_id",
+            "currency",
+            "day",
+        ),
+        # business wide reports
+        Index(
+            "ix_transaction_daily_rollup_business_name_day", "business_name", "day"
+        ),
+    )
+
+    @classmethod
+    async def apply_transactions(cls, session, transactions: list[dict]):
+        """Add the ledger rows `transactions` to the totals of their days.
+
+        Must run inside the transaction that writes the rows.
+        """
+        totals: dict[tuple, dict] = {}
+        for transaction in transactions:
+            key = (
+                transaction["business_name"],
+                transaction["wallet_id"],
+                transaction["currency"],
+                transaction["created_at"].date(),
+            )
+            total = totals.setdefault(
+                key,
+                dict(
+                    credit=Decimal(0), debit=Decimal(0), credit_count=0, debit_count=0
+                ),
+            )
+            kind = "debit" if transaction["amount"] < 0 else "credit"
+            total[kind] += transaction["amount"]
+            total[f"{kind}_count"] += 1
+        if not totals:
+            return
+
+        dialect_insert = WalletBalance.get_upsert_insert(session.bind.dialect.name)
+        now = datetime.now()
+        query = dialect_insert(cls).values(
+            [
+                dict(
+                    business_name=business_name,
+                    wallet_id=wallet_id,
+                    currency=currency,
+                    day=day,
+                    updated_at=now,
+                    **total,
+                )
+                # sorted, so concurrent writers lock the rows in the same order
+                for (business_name, wallet_id, currency, day), total in sorted(
+                    totals.items(), key=lambda item: tuple(map(str, item[0]))
+                )
+            ]
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[cls.business_name, cls.wallet_id, cls.currency, cls.day],
+            set_=dict(
+                credit=cls.credit + query.excluded.credit,
+                debit=cls.debit + query.excluded.debit,
+                credit_count=cls.credit_count + query.excluded.credit_count,
+                debit_count=cls.debit_count + query.excluded.debit_count,
+                updated_at=query.excluded.updated_at,
+            ),
+        )
+        await session.execute(query)
+
+    @classmethod
+    def backfill_query(cls, from_day: date | None = None, to_day: date | None = None):
+        """INSERT ... SELECT of the ledger totals per day in [from_day, to_day)."""
+        day = func.date(Transaction.created_at)
+        conditions = []
+        if from_day:
+            conditions.append(
+                Transaction.created_at >= datetime.combine(from_day, time.min)
+            )
+        if to_day:
+            conditions.append(
+                Transaction.created_at < datetime.combine(to_day, time.min)
+            )
+
+        def total(amount):
+            return func.coalesce(func.sum(amount), 0)
+
+        is_debit = Transaction.amount < 0
+        return insert(cls).from_select(
+            [
+                "business_name",
+                "wallet_id",
+                "currency",
+                "day",
+                "credit",
+                "debit",
+                "credit_count",
+                "debit_count",
+                "updated_at",
+            ],
+            select(
+                Transaction.business_name,
+                Transaction.wallet_id,
+                Transaction.currency,
+                day,
+                total(case((is_debit, 0), else_=Transaction.amount)),
+                total(case((is_debit, Transaction.amount), else_=0)),
+                total(case((is_debit, 0), else_=1)),
+                total(case((is_debit, 1), else_=0)),
+                func.max(Transaction.created_at),
+            )
+            .where(*conditions)
+            .group_by(
+                Transaction.business_name,
+                Transaction.wallet_id,
+                Transaction.currency,
+                day,
+            ),
+        )
+
+    @classmethod
+    async def backfill(
+        cls,
+        session,
+        from_day: date | None = None,
+        to_day: date | None = None,
+        only_if_empty: bool = False,
+    ):
+        """Recompute the totals of the days in [from_day, to_day) from the ledger.
+
+        On PostgreSQL the table is locked against writers first: proposals
+        committed before the lock are read from the ledger, the ones waiting
+        on it add their rows to the recomputed totals afterwards.
+        """
+
+        async def is_empty():
+            result = await session.execute(select(cls.wallet_id).limit(1))
+            return result.first() is None
+
+        if only_if_empty and not await is_empty():
+            return
+        if session.bind.dialect.name == "postgresql":
+            await session.execute(
+                text(f"LOCK TABLE {cls.__tablename__} IN EXCLUSIVE MODE")
+            )
+            if only_if_empty and not await is_empty():
+                return
+
+        query = delete(cls)
+        if from_day:
+            query = query.where(cls.day >= from_day)
+        if to_day:
+            query = query.where(cls.day < to_day)
+        await session.execute(query)
+        await session.execute(cls.backfill_query(from_day, to_day))
+
+    @classmethod
+    def totals_query(cls, from_day: date, to_day: date, **filters):
+        """Credit and debit totals and counts over the days in [from_day, to_day)."""
+        return select(
+            func.sum(cls.credit).label("credits"),
+            func.sum(cls.debit).label("debits"),
+            func.sum(cls.credit_count + cls.debit_count).label("count"),
+        ).where(
+            *[getattr(cls, key) == value for key, value in filters.items()],
+            cls.day >= from_day,
+            cls.day < to_day,
+        )
+
+    @classmethod
+    async def volume(
+        cls,
+        business_name: str,
+        from_day: date,
+        to_day: date,
+        wallet_id: uuid.UUID | None = None,
+        currency: str | None = None,
+    ) -> list[dict]:
+        """Daily credit and debit totals of a business, or of one of its
+        wallets, for the days in [from_day, to_day]."""
+        from server.db import get_session
+
+        conditions = [
+            cls.business_name == business_name,
+            cls.day >= from_day,
+            cls.day <= to_day,
+        ]
+        if wallet_id:
+            conditions.append(cls.wallet_id == wallet_id)
+        if currency:
+            conditions.append(cls.currency == currency)
+
+        query = (
+            select(
+                cls.day,
+                cls.currency,
+                func.sum(cls.credit).label("credit"),
+                func.sum(cls.debit).label("debit"),
+                func.sum(cls.credit_count).label("credit_count"),
+                func.sum(cls.debit_count).label("debit_count"),
+            )
+            .where(*conditions)
+            .group_by(cls.day, cls.currency)
+            .order_by(cls.day, cls.currency)
+        )
+        async with get_session(read_only=True) as session:
+            result = await session.execute(query)
+            return [dict(row) for row in result.mappings()]
+
+
+class LedgerVerification(BaseEntity):
+    """Report of one run of `reconciliation.verify_ledger` over the ledger rows
+    created in (`since`, `until`]."""
+
+    __tablename__ = "ledger_verification"
+
+    since: Mapped[datetime | None]
+    until: Mapped[datetime]
+    rows_checked: Mapped[int] = mapped_column(default=0)
+    drift_count: Mapped[int] = mapped_column(default=0)
+    # the first LEDGER_VERIFY_MAX_DRIFTS drifted rows and proposals
+    drifts: Mapped[list] = mapped_column(JSON, default=list)
+
+    @classmethod
+    async def get_watermark(cls) -> datetime | None:
+        """`until` of the latest run, where an incremental run resumes."""
+        from server.db import get_session
+
+        async with get_session() as session:
+            return await session.scalar(select(func.max(cls.until)))
+
+    @classmethod
+    async def list_latest(cls, limit: int = 10) -> list["LedgerVerification"]:
+        from server.db import get_session
+
+        async with get_session(read_only=True) as session:
+            result = await session.execute(
+                select(cls).order_by(cls.created_at.desc()).limit(limit)
+            )
+            return result.scalars().all()
+
 
 class TransactionNote(BusinessOwnedEntity):
     transaction_id: uuid.UUID
@@ -376,7 +1438,80 @@ class TransactionNote(BusinessOwnedEntity):
 
     class Settings:
         indexes = BusinessOwnedEntity.Settings.indexes + [
-            IndexModel([("transaction_id", ASCENDING)]),
+            IndexModel(
+                [
+                    ("transaction_id", ASCENDING),
+                    ("created_at", DESCENDING),
+                    ("_id", DESCENDING),
+                ]
+            ),
+        ]
+
+    @classmethod
+    async def drop_legacy_indexes(cls):
+        """Drop the indexes replaced by the one behind `get_latest_notes`."""
+        collection = cls.get_motor_collection()
+        existing = await collection.index_information()
+        for name in ["transaction_id_1", "transaction_id_1_created_at_-1"]:
+            if name in existing:
+                await collection.drop_index(name)
+
+    @classmethod
+    async def get_latest_notes(
+        cls, transaction_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, str]:
+        """Latest note of each transaction, for a whole page in one aggregation."""
+        from bson import UUID_SUBTYPE, Binary
+
+        if not transaction_ids:
+            return {}
+
+        pipeline = [
+            {
+                "$match": {
+                    "transaction_id": {
+                        "$in": [
+                            Binary.from_uuid(uid, UUID_SUBTYPE)
+                            for uid in set(transaction_ids)
+                        ]
+                    }
+                }
+            },
+            # _id breaks created_at ties in insertion order
+            {"$sort": {"transaction_id": 1, "created_at": -1, "_id": -1}},
+            {"$group": {"_id": "$transaction_id", "note": {"$first": "$note"}}},
+        ]
+        result = await cls.aggregate(pipeline).to_list()
+
+        return {
+            (
+                item["_id"]
+                if isinstance(item["_id"], uuid.UUID)
+                else item["_id"].as_uuid(UUID_SUBTYPE)
+            ): item["note"]
+            for item in result
+        }
+
+
+class IdempotencyRecord(BusinessOwnedEntity):
+    """Response to the first request made with an `Idempotency-Key`, replayed
+    to its retries until `expires_at`."""
+
+    # business, endpoint and the client's key
+    key: str
+    # hash of the request payload, a key must not be reused for another one
+    fingerprint: str
+    # both unset while the first request is in progress
+    status_code: int | None = None
+    body: str | None = None
+    # naive UTC, as the TTL index reads it
+    expires_at: datetime
+
+    class Settings:
+        indexes = BusinessOwnedEntity.Settings.indexes + [
+            IndexModel([("key", ASCENDING)], unique=True),
+            # removed by Mongo once expired
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
         ]
 
 
@@ -390,10 +1525,13 @@ class Proposal(BusinessOwnedEntity, TaskMixin):
     # status: str | None
 
     participants: list[Participant]
+    # set while a worker owns the proposal, see `workers.ProposalWorkerPool`
+    lease_expires_at: datetime | None = None
 
     class Settings:
         indexes = BusinessOwnedEntity.Settings.indexes + [
             IndexModel([("issuer_id", ASCENDING)]),
+            IndexModel([("task_status", ASCENDING), ("created_at", ASCENDING)]),
         ]
 
     @field_validator("amount", mode="before")
@@ -401,9 +1539,9 @@ class Proposal(BusinessOwnedEntity, TaskMixin):
         return decimal_amount(value)
 
     async def get_transactions(self) -> list[Transaction]:
-        from server.db import async_session
+        from server.db import get_session
 
-        async with async_session() as session:
+        async with get_session() as session:
             query = select(Transaction).where(Transaction.proposal_id == self.uid)
             result = await session.execute(query)
             return result.scalars().all()
@@ -0,0 +1,300 @@
+"""Verification of the ledger invariants.
+
+- the `balance` of every transaction is the balance of the previous
+  transaction of its (wallet, currency) plus its `amount`
+- the legs of every proposal sum to zero
+
+The work is split into shards of the uuid space: balances by wallet_id,
+proposals by proposal_id. uuid4 values are uniformly random, so contiguous
+ranges spread the rows like a hash would, while each shard stays a range
+scan of the (wallet_id, currency, created_at) index. Shards run in a process
+pool, each streaming its rows over a server-side cursor.
+
+An incremental run checks the rows created since the `until` of the latest
+run, seeding every (wallet, currency) with its balance at that watermark.
+Rows younger than LEDGER_VERIFY_SETTLE_SECONDS are left to the next run, so
+that transactions still in flight cannot commit behind the watermark.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, select, tuple_
+
+from server.config import Settings
+
+from .models import LedgerVerification, Transaction, WalletBalance
+
+
+@dataclasses.dataclass
+class ShardResult:
+    rows_checked: int = 0
+    drift_count: int = 0
+    drifts: list[dict] = dataclasses.field(default_factory=list)
+
+    def add_drift(self, max_drifts: int, **drift):
+        self.drift_count += 1
+        if len(self.drifts) < max_drifts:
+            self.drifts.append(
+                {
+                    key: None if value is None else str(value)
+                    for key, value in drift.items()
+                }
+            )
+
+    def merge(self, other: "ShardResult", max_drifts: int):
+        self.rows_checked += other.rows_checked
+        self.drift_count += other.drift_count
+        self.drifts += other.drifts[: max_drifts - len(self.drifts)]
+
+
+def shard_range(column, shard: int, shards: int) -> list:
+    """Conditions selecting the `shard`-th of `shards` ranges of uuid `column`."""
+    conditions = [column >= uuid.UUID(int=(shard << 128) // shards)]
+    if shard + 1 < shards:
+        conditions.append(column < uuid.UUID(int=((shard + 1) << 128) // shards))
+    return conditions
+
+
+async def balances_at(
+    session, pairs: list[tuple[uuid.UUID, str]], as_of: datetime
+) -> dict[tuple[uuid.UUID, str], Decimal]:
+    """Balance of each (wallet, currency) at `as_of`, one index seek each."""
+    if not pairs:
+        return {}
+
+    latest = (
+        select(Transaction.balance)
+        .where(
+            Transaction.wallet_id == WalletBalance.wallet_id,
+            Transaction.currency == WalletBalance.currency,
+            Transaction.created_at <= as_of,
+        )
+        .order_by(Transaction.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        select(WalletBalance.wallet_id, WalletBalance.currency, latest).where(
+            tuple_(WalletBalance.wallet_id, WalletBalance.currency).in_(pairs)
+        )
+    )
+    return {
+        (wallet_id, currency): balance
+        for wallet_id, currency, balance in result
+        if balance is not None
+    }
+
+
+async def verify_balances(
+    shard: int,
+    shards: int,
+    since: datetime | None,
+    until: datetime,
+    result: ShardResult,
+    max_drifts: int,
+):
+    from server.db import async_session
+
+    conditions = shard_range(Transaction.wallet_id, shard, shards)
+    conditions.append(Transaction.created_at <= until)
+    if since:
+        conditions.append(Transaction.created_at > since)
+    query = (
+        select(
+            Transaction.uid,
+            Transaction.wallet_id,
+            Transaction.currency,
+            Transaction.created_at,
+            Transaction.amount,
+            Transaction.balance,
+        )
+        .where(*conditions)
+        .order_by(Transaction.wallet_id, Transaction.currency, Transaction.created_at)
+        .execution_options(yield_per=Settings.LEDGER_VERIFY_BATCH_SIZE)
+    )
+
+    pair, previous = None, Decimal(0)
+    async with async_session() as session, async_session() as seed_session:
+        stream = await session.stream(query)
+        async for rows in stream.partitions():
+            seeds = {}
+            if since:
+                # the streaming connection is busy, seeds are read on another
+                pairs = {(row.wallet_id, row.currency) for row in rows} - {pair}
+                seeds = await balances_at(seed_session, list(pairs), since)
+
+            for row in rows:
+                if (row.wallet_id, row.currency) != pair:
+                    pair = (row.wallet_id, row.currency)
+                    previous = seeds.get(pair, Decimal(0))
+
+                result.rows_checked += 1
+                # app income wallets carry an infinite balance, nothing to check
+                if row.balance.is_finite() and row.balance != previous + row.amount:
+                    result.add_drift(
+                        max_drifts,
+                        kind="balance",
+                        transaction_id=row.uid,
+                        wallet_id=row.wallet_id,
+                        currency=row.currency,
+                        created_at=row.created_at,
+                        amount=row.amount,
+                        balance=row.balance,
+                        expected=previous + row.amount,
+                    )
+                previous = row.balance
+
+
+async def verify_proposals(
+    shard: int,
+    shards: int,
+    since: datetime | None,
+    until: datetime,
+    result: ShardResult,
+    max_drifts: int,
+):
+    from server.db import async_session
+
+    conditions = shard_range(Transaction.proposal_id, shard, shards)
+    if since:
+        # all legs of the proposals with a leg in the period, even when the
+        # legs straddle a boundary
+        conditions.append(
+            Transaction.proposal_id.in_(
+                select(Transaction.proposal_id).where(
+                    *conditions,
+                    Transaction.created_at > since,
+                    Transaction.created_at <= until,
+                )
+            )
+        )
+    else:
+        conditions.append(Transaction.created_at <= until)
+
+    total = func.sum(Transaction.amount)
+    query = (
+        select(Transaction.proposal_id, Transaction.currency, total.label("total"))
+        .where(*conditions)
+        .group_by(Transaction.proposal_id, Transaction.currency)
+        .having(total != 0)
+    )
+    async with async_session() as session:
+        for row in await session.execute(query):
+            result.add_drift(
+                max_drifts,
+                kind="proposal",
+                proposal_id=row.proposal_id,
+                currency=row.currency,
+                total=row.total,
+            )
+
+
+async def verify_shard_async(
+    shard: int, shards: int, since: datetime | None, until: datetime
+) -> ShardResult:
+    max_drifts = Settings.LEDGER_VERIFY_MAX_DRIFTS
+    result = ShardResult()
+    await verify_balances(shard, shards, since, until, result, max_drifts)
+    await verify_proposals(shard, shards, since, until, result, max_drifts)
+    return result
+
+
+def verify_shard(
+    shard: int, shards: int, since: datetime | None, until: datetime
+) -> ShardResult:
+    """Entry point of the pool processes, each with its own engine."""
+    from server.db import dispose_engines
+
+    async def run():
+        try:
+            return await verify_shard_async(shard, shards, since, until)
+        finally:
+            await dispose_engines()
+
+    return asyncio.run(run())
+
+
+async def verify_ledger(
+    incremental: bool = True,
+    workers: int | None = None,
+    shards: int | None = None,
+) -> LedgerVerification:
+    """Check the ledger and store the report.
+
+    `workers=0` runs the shards in this process, one after the other.
+    """
+    workers = Settings.LEDGER_VERIFY_WORKERS if workers is None else workers
+    shards = shards or Settings.LEDGER_VERIFY_SHARDS
+    since = await LedgerVerification.get_watermark() if incremental else None
+    until = datetime.now() - timedelta(seconds=Settings.LEDGER_VERIFY_SETTLE_SECONDS)
+    if since and since >= until:
+        until = since
+
+    logging.info(f"Verifying the ledger rows of ({since}, {until}) in {shards} shards")
+    if workers:
+        loop = asyncio.get_running_loop()
+        # spawned, so no process inherits the connections of this one
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            results = await asyncio.gather(
+                *[
+                    loop.run_in_executor(
+                        pool, verify_shard, shard, shards, since, until
+                    )
+                    for shard in range(shards)
+                ]
+            )
+    else:
+        results = [
+            await verify_shard_async(shard, shards, since, until)
+            for shard in range(shards)
+        ]
+
+    total = ShardResult()
+    for result in results:
+        total.merge(result, Settings.LEDGER_VERIFY_MAX_DRIFTS)
+    if total.drift_count:
+        logging.error(f"Ledger verification found {total.drift_count} drifts")
+
+    return await LedgerVerification.create_item(
+        dict(
+            since=since,
+            until=until,
+            rows_checked=total.rows_checked,
+            drift_count=total.drift_count,
+            drifts=total.drifts,
+        )
+    )
+
+
+class LedgerVerifier:
+    """Runs `verify_ledger` in the background, one run at a time."""
+
+    def __init__(self):
+        self.task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, incremental: bool = True) -> bool:
+        if self.running:
+            return False
+        self.task = asyncio.create_task(self.run(incremental))
+        return True
+
+    async def run(self, incremental: bool):
+        try:
+            await verify_ledger(incremental)
+        except Exception as e:
+            logging.error(f"Ledger verification failed: {e}")
+
+
+ledger_verifier = LedgerVerifier()
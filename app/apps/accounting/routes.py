@@ -1,27 +1,49 @@
-import asyncio
+import csv
+import hmac
+import io
 import logging
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 
 import fastapi
-from fastapi import Query, Request
+from fastapi import Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi_mongo_base.core.exceptions import BaseHTTPException
 from fastapi_mongo_base.routes import AbstractTaskRouter
-from fastapi_mongo_base.schemas import PaginatedResponse
 from ufaas_fastapi_business.core.exceptions import AuthorizationException
 from ufaas_fastapi_business.middlewares import AuthorizationData
 from ufaas_fastapi_business.routes import AbstractAuthRouter
 
 from apps.base.routes import AbstractAuthSQLRouter
+from core.currency import Currency
+from core.pagination import TotalMode, decode_cursor, next_cursor, total_capped
 from server.config import Settings
 
-from .models import Proposal, Transaction, TransactionNote, Wallet, WalletHold
+from .idempotency import error_response, idempotent
+from .models import (
+    LedgerVerification,
+    Proposal,
+    Transaction,
+    TransactionDailyRollup,
+    TransactionNote,
+    Wallet,
+    WalletHold,
+    naive_local,
+)
+from .reconciliation import ledger_verifier
 from .schemas import (
+    CountedPaginatedResponse,
+    CursorPaginatedResponse,
+    ExportFormat,
+    LedgerVerificationSchema,
+    ProposalBatchCreateSchema,
     ProposalCreateSchema,
     ProposalSchema,
     ProposalUpdateSchema,
+    StatementSchema,
     TransactionNoteUpdateSchema,
     TransactionSchema,
+    VolumeSchema,
     WalletCreateSchema,
     WalletDetailSchema,
     WalletHoldCreateSchema,
@@ -30,6 +52,8 @@ from .schemas import (
     WalletType,
     WalletUpdateSchema,
 )
+from .services import process_proposals_batch
+from .workers import proposal_workers
 
 
 class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
@@ -44,10 +68,21 @@ class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
 
     def config_schemas(self, schema, **kwargs):
         super().config_schemas(schema)
+        self.list_response_schema = CursorPaginatedResponse[schema]
         self.retrieve_response_schema = WalletDetailSchema
         self.create_request_schema = WalletCreateSchema
         self.update_request_schema = WalletUpdateSchema
 
+    def config_routes(self, **kwargs):
+        super().config_routes(**kwargs)
+        self.router.add_api_route(
+            "/{uid:uuid}/statement",
+            self.statement,
+            methods=["GET"],
+            response_model=StatementSchema,
+            status_code=200,
+        )
+
     async def list_items(
         self,
         request: Request,
@@ -57,17 +92,28 @@ class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
         wallet_type: WalletType = None,
         created_at_from: datetime = None,
         created_at_to: datetime = None,
+        cursor: str | None = None,
+        include_total: TotalMode = TotalMode.exact,
     ):
         auth = await self.get_auth(request)
 
-        async def get_paginated(items: list[Wallet], total: int):
-            balances = await asyncio.gather(*[item.get_balance() for item in items])
+        async def get_paginated(items: list[Wallet], total: int | None):
+            balances = await Wallet.get_balances_bulk([item.uid for item in items])
             items_in_schema = [
-                self.list_item_schema(**item.model_dump(), balance=balance)
-                for item, balance in zip(items, balances)
+                self.list_item_schema(
+                    **item.model_dump(),
+                    balance=item.balance_from_stored(balances[item.uid]),
+                )
+                for item in items
             ]
-            paginated_response = PaginatedResponse(
-                items=items_in_schema, offset=offset, limit=limit, total=total
+            paginated_response = CursorPaginatedResponse(
+                items=items_in_schema,
+                offset=offset,
+                limit=limit,
+                total=total,
+                total_mode=include_total,
+                total_capped=total_capped(total, include_total),
+                next_cursor=next_cursor(items, limit),
             )
             return paginated_response
 
@@ -76,13 +122,19 @@ class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
             business_name=auth.business.name,
             offset=offset,
             limit=limit,
+            cursor=decode_cursor(cursor) if cursor else None,
+            include_total=include_total,
             wallet_type=wallet_type,
             created_at_from=created_at_from,
             created_at_to=created_at_to,
         )
         paginated_response = await get_paginated(items, total)
 
-        if auth.issuer_type == "Business" or paginated_response.total > 0:
+        if total is None:
+            has_wallets = bool(items or offset or cursor)
+        else:
+            has_wallets = total > 0
+        if auth.issuer_type == "Business" or has_wallets:
             # TODO check what to do if app
             return paginated_response
 
@@ -103,16 +155,53 @@ class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
         paginated_response = await get_paginated(items, total)
         return paginated_response
 
-    async def retrieve_item(self, request: Request, uid: uuid.UUID):
+    async def retrieve_item(
+        self, request: Request, uid: uuid.UUID, as_of: datetime | None = None
+    ):
         auth = await self.get_auth(request)
         item: Wallet = await self.get_item(
             uid,
             user_id=auth.user_id if auth.issuer_type == "User" else None,
             business_name=auth.business.name,
         )
-        balance = await item.get_balance()
+        if as_of:
+            balance = await item.get_balance(as_of=as_of)
+        else:
+            balances = await Wallet.get_balances_bulk([item.uid])
+            balance = item.balance_from_stored(balances[item.uid])
         return self.retrieve_response_schema(**item.model_dump(), balance=balance)
 
+    async def statement(
+        self,
+        request: Request,
+        uid: uuid.UUID,
+        from_date: datetime = Query(..., alias="from"),
+        to_date: datetime = Query(..., alias="to"),
+        currency: str | None = None,
+    ):
+        from_date, to_date = naive_local(from_date), naive_local(to_date)
+        if from_date > to_date:
+            raise BaseHTTPException(
+                400, error="invalid_period", message="from must not be after to"
+            )
+
+        auth = await self.get_auth(request)
+        item: Wallet = await self.get_item(
+            uid,
+            user_id=auth.user_id if auth.issuer_type == "User" else None,
+            business_name=auth.business.name,
+        )
+        if currency is None:
+            if item.main_currency == Currency.none:
+                raise BaseHTTPException(
+                    400, error="currency_required", message="currency is required"
+                )
+            currency = item.main_currency.value
+
+        return StatementSchema(
+            **await item.get_statement(currency, from_date, to_date)
+        )
+
     async def create_item(self, request: Request, data: WalletCreateSchema):
         auth = await self.get_auth(request)
         if auth.issuer_type == "User":
@@ -165,7 +254,8 @@ class WalletRouter(AbstractAuthRouter[Wallet, WalletDetailSchema]):
         item: Wallet = await self.get_item(
             uid, user_id=auth.user_id, business_name=auth.business.name
         )
-        balance = await item.get_balance()
+        balances = await Wallet.get_balances_bulk([item.uid], read_only=False)
+        balance = item.balance_from_stored(balances[item.uid])
         for key, value in balance.items():
             if value != 0:
                 raise BaseHTTPException(
@@ -188,6 +278,10 @@ class WalletHoldRouter(AbstractAuthRouter[WalletHold, WalletHoldSchema]):
             tags=["Hold"],
         )
 
+    def config_schemas(self, schema, **kwargs):
+        super().config_schemas(schema, **kwargs)
+        self.list_response_schema = CountedPaginatedResponse[schema]
+
     def config_routes(self, **kwargs):
         self.router.add_api_route(
             "/",
@@ -218,6 +312,7 @@ class WalletHoldRouter(AbstractAuthRouter[WalletHold, WalletHoldSchema]):
         currency: str | None = None,
         offset: int = Query(0, ge=0),
         limit: int = Query(10, ge=0, le=Settings.page_max_limit),
+        include_total: TotalMode = TotalMode.exact,
     ):
         import logging
 
@@ -235,12 +330,18 @@ class WalletHoldRouter(AbstractAuthRouter[WalletHold, WalletHoldSchema]):
             currency=currency,
             offset=offset,
             limit=limit,
+            include_total=include_total,
         )
 
         items_in_schema = [self.list_item_schema(**item.model_dump()) for item in items]
 
-        return PaginatedResponse(
-            items=items_in_schema, offset=offset, limit=limit, total=total
+        return CountedPaginatedResponse(
+            items=items_in_schema,
+            offset=offset,
+            limit=limit,
+            total=total,
+            total_mode=include_total,
+            total_capped=total_capped(total, include_total),
         )
 
     async def create_item(
@@ -269,8 +370,7 @@ class WalletHoldRouter(AbstractAuthRouter[WalletHold, WalletHoldSchema]):
             wallet=wallet,
         )
 
-        item = self.model(**data)
-        await item.save()
+        item = await self.model.create_item(data)
         return self.create_response_schema(**item.model_dump())
 
     async def update_item(
@@ -328,6 +428,10 @@ class TransactionRouter(AbstractAuthSQLRouter[Transaction, TransactionSchema]):
             tags=["Accounting"],
         )
 
+    def config_schemas(self, schema, **kwargs):
+        super().config_schemas(schema, **kwargs)
+        self.list_response_schema = CursorPaginatedResponse[schema]
+
     def config_routes(self, **kwargs):
         self.router.add_api_route(
             "/",
@@ -336,6 +440,13 @@ class TransactionRouter(AbstractAuthSQLRouter[Transaction, TransactionSchema]):
             response_model=self.list_response_schema,
             status_code=200,
         )
+        self.router.add_api_route(
+            "/export",
+            self.export_items,
+            methods=["GET"],
+            response_class=StreamingResponse,
+            status_code=200,
+        )
         self.router.add_api_route(
             "/{uid:uuid}",
             self.retrieve_item,
@@ -363,13 +474,11 @@ class TransactionRouter(AbstractAuthSQLRouter[Transaction, TransactionSchema]):
         limit: int = Query(10, ge=0, le=Settings.page_max_limit),
         created_at_from: datetime | None = None,
         created_at_to: datetime | None = None,
+        cursor: str | None = None,
+        include_total: TotalMode = TotalMode.exact,
     ):
         auth = await self.get_auth(request)
-        query_param = dict(
-            business_name=auth.business.name,
-            offset=offset,
-            limit=limit,
-        )
+        query_param = dict(business_name=auth.business.name)
         if wallet_id:
             query_param["wallet_id"] = wallet_id
         if auth.user_id:
@@ -381,13 +490,74 @@ class TransactionRouter(AbstractAuthSQLRouter[Transaction, TransactionSchema]):
         if created_at_to:
             query_param["created_at_to"] = created_at_to
 
-        items, total = await self.model.list_total_combined(**query_param)
+        items, total = await self.model.list_total_combined(
+            offset=offset,
+            limit=limit,
+            cursor=decode_cursor(cursor) if cursor else None,
+            include_total=include_total,
+            **query_param,
+        )
+        notes = await TransactionNote.get_latest_notes([item.uid for item in items])
 
-        items_in_schema = await asyncio.gather(
-            *[self.get_in_schema(item) for item in items]
+        items_in_schema = [
+            self.schema(**item.__dict__, note=notes.get(item.uid)) for item in items
+        ]
+        return CursorPaginatedResponse(
+            items=items_in_schema,
+            offset=offset,
+            limit=limit,
+            total=total,
+            total_mode=include_total,
+            next_cursor=next_cursor(items, limit),
         )
-        return PaginatedResponse(
-            items=items_in_schema, offset=offset, limit=limit, total=total
+
+    async def export_items(
+        self,
+        request: Request,
+        wallet_id: uuid.UUID | None = None,
+        export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+        created_at_from: datetime | None = None,
+        created_at_to: datetime | None = None,
+    ):
+        """All matching transactions, oldest first, streamed as NDJSON or CSV."""
+        auth = await self.get_auth(request)
+        query_param = dict(
+            business_name=auth.business.name,
+            user_id=auth.user_id if auth.issuer_type == "User" else None,
+            wallet_id=wallet_id,
+            created_at_from=created_at_from,
+            created_at_to=created_at_to,
+        )
+
+        async def ndjson_lines():
+            async for rows in self.model.export_batches(**query_param):
+                yield "".join(
+                    f"{self.schema(**row).model_dump_json()}\n" for row in rows
+                )
+
+        async def csv_lines():
+            fields = list(self.schema.model_fields)
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            async for rows in self.model.export_batches(**query_param):
+                writer.writerows(
+                    self.schema(**row).model_dump(mode="json") for row in rows
+                )
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+
+        if export_format == ExportFormat.csv:
+            content, media_type = csv_lines(), "text/csv"
+        else:
+            content, media_type = ndjson_lines(), "application/x-ndjson"
+        filename = f"transactions.{export_format.value}"
+        return StreamingResponse(
+            content,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
 
     async def retrieve_item(
@@ -472,6 +642,13 @@ class ProposalRouter(AbstractAuthRouter[Proposal, ProposalSchema]):
             response_model=self.create_response_schema,
             status_code=201,
         )
+        self.router.add_api_route(
+            "/batch",
+            self.create_batch,
+            methods=["POST"],
+            response_model=list[self.schema],
+            status_code=201,
+        )
         self.router.add_api_route(
             "/{uid:uuid}",
             self.update_item,
@@ -484,7 +661,7 @@ class ProposalRouter(AbstractAuthRouter[Proposal, ProposalSchema]):
             self.start_item,
             methods=["POST"],
             response_model=self.retrieve_response_schema,
-            status_code=200,
+            status_code=202,
         )
 
     async def get_auth(self, request: Request) -> AuthorizationData:
@@ -501,7 +678,44 @@ class ProposalRouter(AbstractAuthRouter[Proposal, ProposalSchema]):
     ):
         return await super().list_items(request, offset, limit)
 
-    async def create_item(self, request: Request, data: ProposalCreateSchema):
+    async def create_item(
+        self,
+        request: Request,
+        response: Response,
+        data: ProposalCreateSchema,
+        idempotency_key: str | None = Header(None),
+    ):
+        if idempotency_key is None:
+            return await self.create_proposal(request, response, data)
+
+        auth = await self.get_auth(request)
+
+        async def handler():
+            item = await self.save_proposal(request, data)
+            try:
+                result = await self.proposal_response(request, response, item)
+            except Exception as e:
+                # the proposal exists, a retry must not create another one
+                return error_response(e)
+            return response.status_code or 201, result
+
+        return await idempotent(
+            f"{auth.business.name}:proposals:create:{idempotency_key}",
+            data,
+            auth.business.name,
+            auth.business.user_id,
+            handler,
+        )
+
+    async def create_proposal(
+        self, request: Request, response: Response, data: ProposalCreateSchema
+    ):
+        item = await self.save_proposal(request, data)
+        return await self.proposal_response(request, response, item)
+
+    async def save_proposal(
+        self, request: Request, data: ProposalCreateSchema
+    ) -> Proposal:
         if data.task_status and data.task_status not in ["draft", "init"]:
             raise BaseHTTPException(
                 400, error="invalid_status", message="Invalid task status"
@@ -516,14 +730,38 @@ class ProposalRouter(AbstractAuthRouter[Proposal, ProposalSchema]):
 
         item: Proposal = self.model(**data)
         await item.save()
+        return item
 
+    async def proposal_response(
+        self, request: Request, response: Response, item: Proposal
+    ):
         if item.task_status == "init":
-            return await self.start_item(request, item.uid)
+            response.status_code = 202
+            return await self.start_proposal(request, item.uid)
 
         return self.create_response_schema(**item.model_dump())
 
+    async def create_batch(self, request: Request, data: ProposalBatchCreateSchema):
+        auth = await self.get_auth(request)
+        items = [
+            self.model(
+                **proposal.model_dump(),
+                business_name=auth.business.name,
+                issuer_id=auth.business.user_id,
+                user_id=auth.business.user_id,
+            )
+            for proposal in data.proposals
+        ]
+
+        await process_proposals_batch(auth.business, items)
+        return [self.schema(**item.model_dump()) for item in items]
+
     async def update_item(
-        self, request: Request, uid: uuid.UUID, data: ProposalUpdateSchema
+        self,
+        request: Request,
+        response: Response,
+        uid: uuid.UUID,
+        data: ProposalUpdateSchema,
     ):
         auth = await self.get_auth(request)
         item = await self.get_item(
@@ -545,24 +783,142 @@ class ProposalRouter(AbstractAuthRouter[Proposal, ProposalSchema]):
         )
 
         if item.task_status == "init":
-            return await self.start_item(request, item.uid)
+            response.status_code = 202
+            return await self.start_proposal(request, item.uid)
 
         return item
 
-    async def start_item(self, request: Request, uid: uuid.UUID):
+    async def start_item(
+        self,
+        request: Request,
+        uid: uuid.UUID,
+        idempotency_key: str | None = Header(None),
+    ):
+        if idempotency_key is None:
+            return await self.start_proposal(request, uid)
+
+        auth = await self.get_auth(request)
+
+        async def handler():
+            return 202, await self.start_proposal(request, uid)
+
+        return await idempotent(
+            f"{auth.business.name}:proposals:start:{idempotency_key}",
+            uid,
+            auth.business.name,
+            auth.business.user_id,
+            handler,
+        )
+
+    async def start_proposal(self, request: Request, uid: uuid.UUID):
         auth = await self.get_auth(request)
         # TODO check who can start processing of the proposal
         item: Proposal = await self.get_item(uid, business_name=auth.business.name)
-        await item.start_processing()
+        if item.task_status == "draft":
+            item.task_status = "init"
+            await item.save()
+        elif item.task_status != "init":
+            raise BaseHTTPException(
+                400, error="invalid_status", message="Proposal is already processed"
+            )
+
+        proposal_workers.notify(item.uid)
         return ProposalSchema(**item.model_dump())
 
 
+class ReportRouter(AbstractAuthSQLRouter[TransactionDailyRollup, VolumeSchema]):
+    def __init__(self):
+        super().__init__(
+            model=TransactionDailyRollup,
+            schema=VolumeSchema,
+            user_dependency=None,
+            prefix="/reports",
+            tags=["Reports"],
+        )
+
+    def config_routes(self, **kwargs):
+        self.router.add_api_route(
+            "/volume",
+            self.volume,
+            methods=["GET"],
+            response_model=list[VolumeSchema],
+            status_code=200,
+        )
+
+    async def volume(
+        self,
+        request: Request,
+        from_day: date = Query(..., alias="from"),
+        to_day: date = Query(..., alias="to"),
+        wallet_id: uuid.UUID | None = None,
+        currency: str | None = None,
+    ):
+        """Daily credit and debit totals of the business, or of one wallet,
+        for the days from `from` to `to`, both included."""
+        if from_day > to_day:
+            raise BaseHTTPException(
+                400, error="invalid_period", message="from must not be after to"
+            )
+
+        auth = await self.get_auth(request)
+        if auth.issuer_type == "User":
+            if wallet_id is None:
+                raise AuthorizationException("User can only report on own wallets")
+            wallet = await Wallet.get_item(
+                wallet_id, user_id=auth.user_id, business_name=auth.business.name
+            )
+            if wallet is None:
+                raise BaseHTTPException(
+                    404, error="not_found", message="Wallet not found"
+                )
+
+        rows = await self.model.volume(
+            auth.business.name,
+            from_day,
+            to_day,
+            wallet_id=wallet_id,
+            currency=currency,
+        )
+        return [VolumeSchema(**row) for row in rows]
+
+
+async def check_admin_key(x_admin_key: str = Header("")):
+    if not Settings.ADMIN_API_KEY or not hmac.compare_digest(
+        x_admin_key.encode(), Settings.ADMIN_API_KEY.encode()
+    ):
+        raise AuthorizationException("Admin key required")
+
+
+admin_router = fastapi.APIRouter(
+    prefix="/admin/ledger",
+    tags=["Admin"],
+    dependencies=[fastapi.Depends(check_admin_key)],
+)
+
+
+@admin_router.post("/verifications", status_code=202)
+async def start_ledger_verification(incremental: bool = True):
+    """Verify the ledger in the background; see `reconciliation`."""
+    if not ledger_verifier.start(incremental):
+        raise BaseHTTPException(
+            409, error="already_running", message="Ledger verification is running"
+        )
+    return {"status": "started", "incremental": incremental}
+
+
+@admin_router.get("/verifications", response_model=list[LedgerVerificationSchema])
+async def list_ledger_verifications(limit: int = Query(10, ge=1, le=100)):
+    items = await LedgerVerification.list_latest(limit)
+    return [LedgerVerificationSchema(**item.__dict__) for item in items]
+
+
 wallet_router = WalletRouter().router
 wallet_hold_router = WalletHoldRouter().router
 wallet_hold_router_business = WalletHoldHRouter().router
 transaction_router = TransactionRouter().router
 transaction_wallet_router = TransactionWRouter().router
 proposal_router = ProposalRouter().router
+report_router = ReportRouter().router
 
 router = fastapi.APIRouter()
 router.include_router(wallet_router)
@@ -571,3 +927,5 @@ router.include_router(wallet_hold_router_business)
 router.include_router(transaction_router)
 router.include_router(transaction_wallet_router)
 router.include_router(proposal_router)
+router.include_router(report_router)
+router.include_router(admin_router)
@@ -1,20 +1,36 @@
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from enum import Enum
-from typing import Literal
+from typing import Generic, Literal, TypeVar
 
-from fastapi_mongo_base.schemas import BusinessOwnedEntitySchema
+from fastapi_mongo_base.schemas import BusinessOwnedEntitySchema, PaginatedResponse
 from fastapi_mongo_base.utils.bsontools import decimal_amount
 from pydantic import (
     BaseModel,
     ConfigDict,
+    Field,
     field_serializer,
     field_validator,
     model_validator,
 )
 
 from core.currency import Currency
+from core.pagination import TotalMode
+from server.config import Settings
+
+T = TypeVar("T", bound=BusinessOwnedEntitySchema)
+
+
+class CountedPaginatedResponse(PaginatedResponse[T], Generic[T]):
+    total: int | None = None
+    total_mode: TotalMode = TotalMode.exact
+    # the estimated count stopped at COUNT_ESTIMATE_LIMIT, there are more items
+    total_capped: bool = False
+
+
+class CursorPaginatedResponse(CountedPaginatedResponse[T], Generic[T]):
+    next_cursor: str | None = None
 
 
 class WalletType(str, Enum):
@@ -120,6 +136,52 @@ class TransactionSchema(BusinessOwnedEntitySchema):
         return str(value)
 
 
+class StatementSchema(BaseModel):
+    wallet_id: uuid.UUID
+    currency: str
+    from_date: datetime
+    to_date: datetime
+    opening_balance: Decimal
+    closing_balance: Decimal
+    total_credits: Decimal
+    total_debits: Decimal
+    transaction_count: int
+
+    @field_serializer(
+        "opening_balance", "closing_balance", "total_credits", "total_debits"
+    )
+    def serialize_amount(self, value):
+        return str(value)
+
+
+class VolumeSchema(BaseModel):
+    day: date
+    currency: str
+    credit: Decimal
+    debit: Decimal
+    credit_count: int
+    debit_count: int
+
+    @field_serializer("credit", "debit")
+    def serialize_amount(self, value):
+        return str(value)
+
+
+class LedgerVerificationSchema(BaseModel):
+    uid: uuid.UUID
+    created_at: datetime
+    since: datetime | None = None
+    until: datetime
+    rows_checked: int
+    drift_count: int
+    drifts: list[dict[str, str | None]]
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
 class TransactionNoteUpdateSchema(BaseModel):
     note: str
 
@@ -141,6 +203,7 @@ class ProposalSchema(BusinessOwnedEntitySchema):
     currency: str
     # status: str
     task_status: str
+    task_report: str | None = None
     participants: list[Participant]
 
     @field_validator("amount", mode="before")
@@ -158,6 +221,12 @@ class ProposalCreateSchema(BaseModel):
     meta_data: dict | None = None
 
 
+class ProposalBatchCreateSchema(BaseModel):
+    proposals: list[ProposalCreateSchema] = Field(
+        min_length=1, max_length=Settings.PROPOSAL_BATCH_MAX_SIZE
+    )
+
+
 class ProposalUpdateSchema(BaseModel):
     # status: str | None
     task_status: Literal["init"] | None = None
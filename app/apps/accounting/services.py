@@ -1,8 +1,16 @@
 import asyncio
 import logging
+import uuid
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta
 from decimal import Decimal
 
+from beanie import PydanticObjectId
+from beanie.odm.operators.find.comparison import In
+from beanie.odm.operators.update.general import Set
 from pydantic import BaseModel, ConfigDict
+from sqlalchemy import insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from ufaas_fastapi_business.models import Business
 
@@ -10,20 +18,54 @@ from apps.accounting.models import (
     Participant,
     Proposal,
     Transaction,
+    TransactionDailyRollup,
     TransactionNote,
     Wallet,
+    WalletBalance,
 )
+from server.config import Settings
 from server.db import async_session
 
 
 class ParticipantWallet(BaseModel):
     amount: Decimal
     wallet: Wallet
-    balance: Decimal
+    balance: Decimal = Decimal(0)
+    held_amount: Decimal = Decimal(0)
 
     model_config = ConfigDict(allow_inf_nan=True)
 
 
+# in-process locks per (wallet_id, currency) for databases without row locks
+_wallet_locks: weakref.WeakValueDictionary[tuple[uuid.UUID, str], asyncio.Lock] = (
+    weakref.WeakValueDictionary()
+)
+
+
+@asynccontextmanager
+async def lock_wallets(
+    session: AsyncSession, currency: str, wallet_ids: list[uuid.UUID]
+):
+    """Serialize proposals that touch the same (wallet, currency) pairs.
+
+    PostgreSQL relies on the `FOR UPDATE` row locks taken by
+    `WalletBalance.get_for_update` inside the transaction. Other databases
+    (SQLite) fall back to asyncio locks, which only guard a single process.
+    Locks are always acquired in sorted wallet order to avoid deadlocks.
+    """
+    if session.bind.dialect.name == "postgresql":
+        yield
+        return
+
+    async with AsyncExitStack() as stack:
+        for wallet_id in sorted(set(wallet_ids)):
+            lock = _wallet_locks.get((wallet_id, currency))
+            if lock is None:
+                lock = _wallet_locks[(wallet_id, currency)] = asyncio.Lock()
+            await stack.enter_async_context(lock)
+        yield
+
+
 async def participant_validator(
     participant_wallet: ParticipantWallet, business: Business
 ):
@@ -38,45 +80,149 @@ async def fail_proposal(proposal: Proposal, message: str = None, **kwargs):
     await proposal.save_and_emit()
 
 
-async def success_proposal(
-    business: Business,
-    proposal: Proposal,
-    participants_wallets: list[ParticipantWallet],
+async def load_balances(
     session: AsyncSession,
-    **kwargs,
+    currency: str,
+    participants_wallets: list[ParticipantWallet],
 ):
-    async with session.begin():
-        meta_data = proposal.meta_data or {}
-        balances = {}
-
-        for participant in participants_wallets:
-            new_balance = (
-                balances.get(participant.wallet.id) or participant.balance
-            ) + participant.amount
-            transaction = Transaction(
+    stored = await WalletBalance.get_for_update(
+        session,
+        currency,
+        [participant.wallet.uid for participant in participants_wallets],
+    )
+    for participant in participants_wallets:
+        balance = participant.wallet.balance_from_stored(
+            {currency: stored.get(participant.wallet.uid, Decimal(0))}, currency
+        )
+        participant.balance = balance[currency]
+
+
+def build_transactions(
+    proposal: Proposal,
+    participants_wallets: list[ParticipantWallet],
+    balances: dict[uuid.UUID, Decimal],
+) -> list[dict]:
+    """Build the ledger rows of `proposal`.
+
+    `balances` holds the current balance of every participant wallet and is
+    moved forward in place. Row uids are generated here so that notes can
+    point at the rows without reading them back.
+    """
+    meta_data = proposal.meta_data or {}
+    transactions = []
+
+    for participant in participants_wallets:
+        wallet_id = participant.wallet.uid
+        balances[wallet_id] += participant.amount
+        transactions.append(
+            dict(
+                uid=uuid.uuid4(),
                 business_name=proposal.business_name,
                 user_id=participant.wallet.user_id,
                 meta_data=meta_data,
                 proposal_id=proposal.uid,
-                wallet_id=participant.wallet.uid,
+                wallet_id=wallet_id,
                 amount=participant.amount,
                 currency=proposal.currency,
-                balance=new_balance,
+                balance=balances[wallet_id],
                 description=proposal.description,
-                # note=proposal.note,
             )
-            balances[participant.wallet.id] = new_balance
-            session.add(transaction)
+        )
+
+    return transactions
+
+
+class ProposalAlreadyWritten(ValueError):
+    """The ledger already holds rows of the proposal, written by another run."""
+
+
+async def get_written_proposals(
+    session: AsyncSession, proposal_ids: list[uuid.UUID]
+) -> set[uuid.UUID]:
+    result = await session.execute(
+        select(Transaction.proposal_id)
+        .where(Transaction.proposal_id.in_(proposal_ids))
+        .distinct()
+    )
+    return set(result.scalars())
+
+
+async def insert_transactions(
+    session: AsyncSession, currency: str, transactions: list[dict]
+):
+    """Write `transactions` and move the stored balances and rollups.
+
+    Must run after the wallet rows are locked: a proposal that another run
+    has written meanwhile, e.g. after its lease expired and it was
+    requeued, is then visible and refused.
+    """
+    if not transactions:
+        return
+
+    written = await get_written_proposals(
+        session, list({transaction["proposal_id"] for transaction in transactions})
+    )
+    if written:
+        raise ProposalAlreadyWritten(
+            f"Proposals {', '.join(map(str, written))} are already written"
+        )
+
+    now = datetime.now()
+    for i, transaction in enumerate(transactions):
+        # strictly increasing, so the rows of a wallet written together keep
+        # their ledger order, and set here so the daily rollup uses the same day
+        transaction.setdefault("created_at", now + timedelta(microseconds=i))
+    await session.execute(insert(Transaction.__table__), transactions)
+
+    changes = {}
+    for transaction in transactions:
+        changes[transaction["wallet_id"]] = (
+            changes.get(transaction["wallet_id"], Decimal(0)) + transaction["amount"]
+        )
+    await WalletBalance.apply_changes(session, currency, changes)
+    await TransactionDailyRollup.apply_transactions(session, transactions)
+
+
+async def write_transactions(
+    proposal: Proposal,
+    participants_wallets: list[ParticipantWallet],
+    session: AsyncSession,
+) -> list[dict]:
+    balances = {
+        participant.wallet.uid: participant.balance
+        for participant in participants_wallets
+    }
+    transactions = build_transactions(proposal, participants_wallets, balances)
+    await insert_transactions(session, proposal.currency, transactions)
+    return transactions
+
+
+def build_notes(proposal: Proposal, transactions: list[dict]) -> list[TransactionNote]:
+    if not proposal.note:
+        return []
+
+    return [
+        TransactionNote(
+            business_name=proposal.business_name,
+            user_id=transaction["user_id"],
+            transaction_id=transaction["uid"],
+            note=proposal.note,
+        )
+        for transaction in transactions
+    ]
+
+
+async def success_proposal(
+    business: Business,
+    proposal: Proposal,
+    participants_wallets: list[ParticipantWallet],
+    transactions: list[dict],
+    **kwargs,
+):
+    notes = build_notes(proposal, transactions)
+    if notes:
+        await TransactionNote.insert_many(notes)
 
-    if proposal.note:
-        for transaction in await proposal.get_transactions():
-            note = TransactionNote(
-                business_name=proposal.business_name,
-                user_id=participant.wallet.user_id,
-                transaction_id=transaction.uid,
-                note=proposal.note,
-            )
-            await note.save()
     proposal.task_status = "completed"
     await proposal.save_report("Proposal processed successfully", emit=False)
     await proposal.save()
@@ -90,10 +236,7 @@ async def get_participant_wallets(
         wallet: Wallet = await Wallet.get_item(
             participant.wallet_id, business_name=business_name, user_id=None
         )
-        balance = (await wallet.get_balance(currency)).get(currency, 0)
-        return ParticipantWallet(
-            wallet=wallet, amount=participant.amount, balance=balance
-        )
+        return ParticipantWallet(wallet=wallet, amount=participant.amount)
 
     return await asyncio.gather(
         *[get_participant_wallet(participant) for participant in participants]
@@ -150,10 +293,22 @@ async def validate_participants(
             )
 
 
+async def load_held_amounts(sources: list[ParticipantWallet], currency: str):
+    """Read the held totals of `sources`.
+
+    Runs before the balance rows are locked, since reading a held total may
+    expire holds and update the same row.
+    """
+    held_amounts = await asyncio.gather(
+        *[source.wallet.get_held_amount(currency) for source in sources]
+    )
+    for source, held_amount in zip(sources, held_amounts):
+        source.held_amount = held_amount
+
+
 async def check_balances(sources: list[ParticipantWallet], currency: str):
     for source in sources:
-        held_amount = await source.wallet.get_held_amount(currency)
-        if source.balance - held_amount < -source.amount:
+        if source.balance - source.held_amount < -source.amount:
             raise ValueError(
                 f"Insufficient balance in source wallet {source.wallet.id}"
             )
@@ -187,10 +342,31 @@ async def process_proposal(proposal: Proposal):
 
             await validate_wallets(proposal, participants_wallets)
             await validate_amounts(proposal, participants_wallets)
-            await check_balances(sources, proposal.currency)
             await validate_participants(proposal, participants_wallets, business)
 
-            await success_proposal(business, proposal, participants_wallets, session)
+            await load_held_amounts(sources, proposal.currency)
+
+            wallet_ids = [
+                participant.wallet.uid for participant in participants_wallets
+            ]
+            async with lock_wallets(session, proposal.currency, wallet_ids):
+                async with session.begin():
+                    await load_balances(
+                        session, proposal.currency, participants_wallets
+                    )
+                    await check_balances(sources, proposal.currency)
+                    transactions = await write_transactions(
+                        proposal, participants_wallets, session
+                    )
+
+            await success_proposal(
+                business, proposal, participants_wallets, transactions
+            )
+
+        except ProposalAlreadyWritten as e:
+            # the run that wrote the rows completes the proposal
+            await session.rollback()
+            logging.warning(f"Skipped proposal {proposal.uid}: {e}")
 
         except Exception as e:
             import traceback
@@ -199,3 +375,199 @@ async def process_proposal(proposal: Proposal):
 
             await session.rollback()
             await fail_proposal(proposal, str(e), traceback=traceback_str)
+
+
+async def get_batch_participant_wallets(
+    proposals: list[Proposal], business_name: str
+) -> dict[uuid.UUID, Wallet]:
+    wallet_ids = {
+        participant.wallet_id
+        for proposal in proposals
+        for participant in proposal.participants
+    }
+    wallets = await Wallet.find(
+        In(Wallet.uid, list(wallet_ids)), Wallet.business_name == business_name
+    ).to_list()
+    return {wallet.uid: wallet for wallet in wallets}
+
+
+async def validate_batch_proposal(
+    proposal: Proposal, wallets: dict[uuid.UUID, Wallet], business: Business
+) -> list[ParticipantWallet]:
+    await validate_proposal(proposal)
+
+    participants_wallets = []
+    for participant in proposal.participants:
+        wallet = wallets.get(participant.wallet_id)
+        if wallet is None:
+            raise ValueError(f"Wallet {participant.wallet_id} does not exist")
+        participants_wallets.append(
+            ParticipantWallet(wallet=wallet, amount=participant.amount)
+        )
+
+    await validate_wallets(proposal, participants_wallets)
+    await validate_amounts(proposal, participants_wallets)
+    for participant in participants_wallets:
+        if not await participant_validator(participant, business):
+            raise ValueError(f"Participant {participant.wallet.id} is not valid")
+
+    return participants_wallets
+
+
+async def commit_batch_chunk(
+    currency: str, chunk: list[tuple[Proposal, list[ParticipantWallet]]]
+) -> list[tuple[Proposal, list[dict]]]:
+    """Write the ledger rows of `chunk` in one SQL transaction.
+
+    Proposals are checked against the running balances in order, so a
+    proposal without enough funds fails alone and the rest are committed.
+    """
+    participants = [participant for _, wallets in chunk for participant in wallets]
+    sources = {
+        participant.wallet.uid: participant.wallet
+        for participant in participants
+        if participant.amount < 0
+    }
+    held_amounts = dict(
+        zip(
+            sources,
+            await asyncio.gather(
+                *[wallet.get_held_amount(currency) for wallet in sources.values()]
+            ),
+        )
+    )
+
+    completed = []
+    async with async_session() as session:
+        wallet_ids = [participant.wallet.uid for participant in participants]
+        async with lock_wallets(session, currency, wallet_ids):
+            async with session.begin():
+                await load_balances(session, currency, participants)
+                balances = {
+                    participant.wallet.uid: participant.balance
+                    for participant in participants
+                }
+                written = await get_written_proposals(
+                    session, [proposal.uid for proposal, _ in chunk]
+                )
+
+                for proposal, participants_wallets in chunk:
+                    if proposal.uid in written:
+                        # requeued after its lease expired and run by a worker
+                        proposal.task_status = "completed"
+                        continue
+                    for source in participants_wallets:
+                        wallet_id = source.wallet.uid
+                        if source.amount >= 0:
+                            continue
+                        if (
+                            balances[wallet_id] - held_amounts[wallet_id]
+                            < -source.amount
+                        ):
+                            proposal.task_status = "error"
+                            await proposal.save_report(
+                                f"Insufficient balance in source wallet {source.wallet.id}",
+                                emit=False,
+                            )
+                            break
+                    else:
+                        transactions = build_transactions(
+                            proposal, participants_wallets, balances
+                        )
+                        completed.append((proposal, transactions))
+
+                await insert_transactions(
+                    session,
+                    currency,
+                    [
+                        transaction
+                        for _, transactions in completed
+                        for transaction in transactions
+                    ],
+                )
+
+    return completed
+
+
+async def renew_leases(proposals: list[Proposal], lease: timedelta):
+    """Extend the leases of `proposals` that are still being processed.
+
+    A proposal whose lease ran out meanwhile may have been requeued and run
+    by a worker; `insert_transactions` refuses to write it a second time.
+    """
+    lease_expires_at = datetime.now() + lease
+    await Proposal.find(
+        In(Proposal.uid, [proposal.uid for proposal in proposals]),
+        Proposal.task_status == "processing",
+    ).update(Set({"lease_expires_at": lease_expires_at}))
+    for proposal in proposals:
+        proposal.lease_expires_at = lease_expires_at
+
+
+async def process_proposals_batch(business: Business, proposals: list[Proposal]):
+    """Create and process many proposals of one business together.
+
+    Wallets are fetched with one query, proposals are stored with one insert
+    and the ledger rows of up to `Settings.PROPOSAL_BATCH_CHUNK_SIZE` proposals
+    are committed per SQL transaction. Every proposal gets its own final
+    status; a failing proposal does not fail the others.
+    """
+    queued = [proposal for proposal in proposals if proposal.task_status == "init"]
+    wallets = await get_batch_participant_wallets(queued, business.name)
+
+    valid: dict[str, list[tuple[Proposal, list[ParticipantWallet]]]] = {}
+    lease = timedelta(seconds=Settings.PROPOSAL_LEASE_SECONDS)
+    for proposal in queued:
+        try:
+            participants_wallets = await validate_batch_proposal(
+                proposal, wallets, business
+            )
+        except ValueError as e:
+            proposal.task_status = "error"
+            await proposal.save_report(str(e), emit=False)
+            continue
+
+        # leased like a worker-claimed proposal, so an interrupted batch is
+        # recovered by the worker pool; renewed as each chunk starts
+        proposal.task_status = "processing"
+        proposal.lease_expires_at = datetime.now() + lease
+        valid.setdefault(proposal.currency, []).append((proposal, participants_wallets))
+
+    for proposal in proposals:
+        proposal.id = PydanticObjectId()
+    await Proposal.insert_many(proposals)
+
+    completed: list[tuple[Proposal, list[dict]]] = []
+    chunk_size = Settings.PROPOSAL_BATCH_CHUNK_SIZE
+    for currency, items in valid.items():
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i : i + chunk_size]
+            try:
+                await renew_leases([proposal for proposal, _ in chunk], lease)
+                completed += await commit_batch_chunk(currency, chunk)
+            except Exception as e:
+                logging.error(f"Error processing proposal batch chunk: {e}")
+                for proposal, _ in chunk:
+                    proposal.task_status = "error"
+                    await proposal.save_report(str(e), emit=False)
+
+    notes = [
+        note
+        for proposal, transactions in completed
+        for note in build_notes(proposal, transactions)
+    ]
+    if notes:
+        await TransactionNote.insert_many(notes)
+
+    for proposal, _ in completed:
+        proposal.task_status = "completed"
+        await proposal.save_report("Proposal processed successfully", emit=False)
+
+    await asyncio.gather(*[proposal.save() for proposal in queued])
+    await asyncio.gather(
+        *[
+            Proposal.emit_signals(proposal)
+            for proposal in queued
+            if proposal.task_status == "error"
+        ]
+    )
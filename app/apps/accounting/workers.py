@@ -0,0 +1,251 @@
+"""Background execution of proposals and expiry of wallet holds.
+
+Proposals in `init` status are the queue: they are persisted in Mongo, so
+anything a stopped process left behind is picked up again by the next one.
+A worker claims a proposal by setting a lease on it, which keeps several app
+instances from processing the same proposal. The lease is renewed while the
+proposal is processed; should it still run out, e.g. on a stalled process,
+the ledger refuses a second write of the same proposal.
+
+Holds past their `expires_at` are moved to inactive by the hold sweeper, so
+reads can select the current holds by status alone.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+
+from beanie.odm.operators.find.logical import Or
+from beanie.odm.operators.update.general import Set
+from beanie.odm.queries.update import UpdateResponse
+
+from server.config import Settings
+
+from .models import Proposal, WalletHold
+from .services import process_proposal
+
+
+class ProposalWorkerPool:
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        poll_interval: float | None = None,
+        lease_seconds: float | None = None,
+    ):
+        self.concurrency = concurrency or Settings.PROPOSAL_WORKERS
+        self.poll_interval = poll_interval or Settings.PROPOSAL_POLL_INTERVAL
+        self.lease = timedelta(seconds=lease_seconds or Settings.PROPOSAL_LEASE_SECONDS)
+
+        self.queue: asyncio.Queue[uuid.UUID | None] = asyncio.Queue()
+        self.pending: set[uuid.UUID] = set()
+        self.workers: list[asyncio.Task] = []
+        self.poller: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.poller is not None
+
+    def notify(self, uid: uuid.UUID):
+        """Hand a freshly queued proposal to the workers without waiting for
+        the next poll."""
+        if not self.running or uid in self.pending:
+            return
+        self.pending.add(uid)
+        self.queue.put_nowait(uid)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.pending = set()
+        self.workers = [
+            asyncio.create_task(self.work()) for _ in range(self.concurrency)
+        ]
+        self.poller = asyncio.create_task(self.poll())
+        logging.info(f"Started {self.concurrency} proposal workers")
+
+    async def stop(self, timeout: float = 30):
+        """Stop polling and let the workers finish the proposal in hand."""
+        if not self.running:
+            return
+
+        self.poller.cancel()
+        self.poller = None
+        self.pending.clear()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        for _ in self.workers:
+            self.queue.put_nowait(None)
+
+        _, unfinished = await asyncio.wait(self.workers, timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def poll(self):
+        while True:
+            try:
+                await self.recover()
+                await self.fill()
+            except Exception as e:
+                logging.error(f"Proposal queue poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def fill(self):
+        free = 2 * self.concurrency - len(self.pending)
+        if free <= 0:
+            return
+
+        proposals = (
+            await Proposal.find(
+                Proposal.task_status == "init",
+                Proposal.is_deleted == False,
+                Or(
+                    Proposal.lease_expires_at == None,
+                    Proposal.lease_expires_at < datetime.now(),
+                ),
+            )
+            .sort(+Proposal.created_at)
+            .limit(free)
+            .to_list()
+        )
+        for proposal in proposals:
+            self.notify(proposal.uid)
+
+    async def recover(self):
+        """Requeue proposals whose worker died in the middle of processing.
+
+        If the ledger rows were already committed only the final status update
+        was lost, so the proposal is completed instead of being run twice.
+        """
+        stale = await Proposal.find(
+            Proposal.task_status == "processing",
+            Or(
+                Proposal.lease_expires_at == None,
+                Proposal.lease_expires_at < datetime.now(),
+            ),
+        ).to_list()
+
+        for proposal in stale:
+            task_status = "completed" if await proposal.get_transactions() else "init"
+            await Proposal.find_one(
+                Proposal.uid == proposal.uid,
+                Proposal.task_status == "processing",
+                Proposal.lease_expires_at == proposal.lease_expires_at,
+            ).update(Set({"task_status": task_status, "lease_expires_at": None}))
+            logging.warning(f"Recovered proposal {proposal.uid} as {task_status}")
+
+    async def claim(self, uid: uuid.UUID) -> Proposal | None:
+        now = datetime.now()
+        return await Proposal.find_one(
+            Proposal.uid == uid,
+            Proposal.task_status == "init",
+            Or(
+                Proposal.lease_expires_at == None,
+                Proposal.lease_expires_at < now,
+            ),
+        ).update(
+            Set({"lease_expires_at": now + self.lease}),
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+
+    async def renew(self, proposal: Proposal):
+        """Extend the lease of `proposal` for as long as it is processed."""
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            renewed = await Proposal.find_one(
+                Proposal.uid == proposal.uid,
+                Proposal.lease_expires_at == proposal.lease_expires_at,
+            ).update(
+                Set({"lease_expires_at": datetime.now() + self.lease}),
+                response_type=UpdateResponse.NEW_DOCUMENT,
+            )
+            if renewed is None:
+                logging.warning(f"Lost the lease of proposal {proposal.uid}")
+                return
+            # carried along by the saves of process_proposal
+            proposal.lease_expires_at = renewed.lease_expires_at
+
+    async def work(self):
+        while True:
+            uid = await self.queue.get()
+            if uid is None:
+                return
+
+            try:
+                proposal = await self.claim(uid)
+                if proposal:
+                    renewal = asyncio.create_task(self.renew(proposal))
+                    try:
+                        await process_proposal(proposal)
+                    finally:
+                        renewal.cancel()
+            except Exception as e:
+                logging.error(f"Proposal worker failed on {uid}: {e}")
+            finally:
+                self.pending.discard(uid)
+
+
+class HoldSweeper:
+    def __init__(
+        self, interval: float | None = None, batch_size: int | None = None
+    ):
+        self.interval = interval or Settings.HOLD_SWEEP_INTERVAL
+        self.batch_size = batch_size or Settings.HOLD_SWEEP_BATCH_SIZE
+
+        # called with every batch of holds the sweeper expired
+        self.listeners: list[Callable[[list[WalletHold]], Awaitable[None]]] = []
+        self.task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    def subscribe(self, listener: Callable[[list[WalletHold]], Awaitable[None]]):
+        self.listeners.append(listener)
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+        logging.info("Started hold sweeper")
+
+    async def stop(self):
+        if not self.running:
+            return
+
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"Hold sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        """Expire due holds batch by batch until none is left."""
+        count = 0
+        while True:
+            expired = await WalletHold.expire_holds(batch_size=self.batch_size)
+            if expired:
+                count += len(expired)
+                await self.emit(expired)
+            if len(expired) < self.batch_size:
+                return count
+
+    async def emit(self, holds: list[WalletHold]):
+        for hold in holds:
+            logging.info(f"Hold {hold.uid} of wallet {hold.wallet_id} expired")
+
+        for listener in self.listeners:
+            try:
+                await listener(holds)
+            except Exception as e:
+                logging.error(f"Hold expiry listener failed: {e}")
+
+
+proposal_workers = ProposalWorkerPool()
+hold_sweeper = HoldSweeper()
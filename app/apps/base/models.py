@@ -1,11 +1,15 @@
+import json
 import uuid
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import JSON, event, select
+from sqlalchemy import JSON, event, false, literal, select, true, tuple_
 from sqlalchemy.orm import Mapped, as_declarative, declared_attr, mapped_column
 from sqlalchemy.sql import func
 
+from core.pagination import TotalMode
+from server.config import Settings
+
 # Base = declarative_base()
 
 
@@ -19,12 +23,7 @@ class BaseEntity:
     def __tablename__(cls) -> str:
         return cls.__name__.lower()
 
-    uid: Mapped[uuid.UUID] = mapped_column(
-        primary_key=True,
-        default=uuid.uuid4,
-        unique=True,
-        index=True,
-    )
+    uid: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     created_at: Mapped[datetime] = mapped_column(
         default=lambda: datetime.now(),
         index=True,
@@ -71,7 +70,8 @@ class BaseEntity:
         is_deleted: bool = False,
         **kwargs,
     ):
-        base_query = [cls.is_deleted == is_deleted]
+        # literal so partial `is_deleted = false` indexes can be used
+        base_query = [cls.is_deleted == (true() if is_deleted else false())]
 
         if hasattr(cls, "user_id") and user_id:
             base_query.append(cls.user_id == user_id)
@@ -99,7 +99,7 @@ class BaseEntity:
         is_deleted: bool = False,
         **kwargs,
     ):
-        from server.db import async_session
+        from server.db import get_session
 
         base_query = cls.get_query(
             user_id=user_id,
@@ -109,7 +109,7 @@ class BaseEntity:
         )
         base_query.append(cls.uid == uid)
 
-        async with async_session() as session:
+        async with get_session(read_only=True) as session:
             query = select(cls).filter(*base_query)
             result = await session.execute(query)
             item = result.scalar_one_or_none()
@@ -123,9 +123,10 @@ class BaseEntity:
         is_deleted: bool = False,
         offset: int = 0,
         limit: int = 10,
+        cursor: tuple[datetime, uuid.UUID] | None = None,
         **kwargs,
     ):
-        from server.db import async_session
+        from server.db import get_session
 
         base_query = cls.get_query(
             user_id=user_id,
@@ -133,16 +134,19 @@ class BaseEntity:
             is_deleted=is_deleted,
             **kwargs,
         )
+        if cursor:
+            # keyset seek: rows strictly after (created_at, uid) in listing order
+            base_query.append(tuple_(cls.created_at, cls.uid) < tuple_(*cursor))
 
         items_query = (
             select(cls)
             .filter(*base_query)
-            .order_by(cls.created_at.desc())
+            .order_by(cls.created_at.desc(), cls.uid.desc())
             .offset(offset)
             .limit(limit)
         )
 
-        async with async_session() as session:
+        async with get_session(read_only=True) as session:
             items_result = await session.execute(items_query)
             items = items_result.scalars().all()
         return items
@@ -155,7 +159,7 @@ class BaseEntity:
         is_deleted: bool = False,
         **kwargs,
     ):
-        from server.db import async_session
+        from server.db import get_session
 
         base_query = cls.get_query(
             user_id=user_id,
@@ -167,73 +171,132 @@ class BaseEntity:
         # Query for getting the total count of items
         total_count_query = select(func.count()).filter(*base_query)  # .subquery()
 
-        async with async_session() as session:
+        async with get_session(read_only=True) as session:
             total_result = await session.execute(total_count_query)
         total = total_result.scalar()
 
         return total
 
     @classmethod
-    async def list_total_combined(
+    async def estimated_count(
         cls,
         user_id: uuid.UUID = None,
         business_name: str = None,
-        offset: int = 0,
-        limit: int = 10,
         is_deleted: bool = False,
         **kwargs,
-    ) -> tuple[list["BaseEntity"], int]:
-        items = await cls.list_items(
+    ) -> int:
+        """Row count from the Postgres planner statistics.
+
+        Small estimates, and other databases, get an exact count.
+        """
+        from server.db import get_session
+
+        base_query = cls.get_query(
             user_id=user_id,
             business_name=business_name,
-            offset=offset,
-            limit=limit,
             is_deleted=is_deleted,
             **kwargs,
         )
-        total = await cls.total_count(
+
+        async with get_session(read_only=True) as session:
+            dialect = session.bind.dialect
+            if dialect.name == "postgresql":
+                query = select(literal(1)).select_from(cls).filter(*base_query)
+                compiled = query.compile(dialect=dialect)
+                params = compiled.params
+                if compiled.positional:
+                    params = tuple(params[name] for name in compiled.positiontup)
+                connection = await session.connection()
+                result = await connection.exec_driver_sql(
+                    f"EXPLAIN (FORMAT JSON) {compiled}", params
+                )
+                plan = result.scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]["Plan"]["Plan Rows"])
+                if estimate >= Settings.COUNT_ESTIMATE_LIMIT:
+                    return estimate
+
+            return await session.scalar(select(func.count()).filter(*base_query))
+
+    @classmethod
+    async def list_total_combined(
+        cls,
+        user_id: uuid.UUID = None,
+        business_name: str = None,
+        offset: int = 0,
+        limit: int = 10,
+        is_deleted: bool = False,
+        cursor: tuple[datetime, uuid.UUID] | None = None,
+        include_total: TotalMode = TotalMode.exact,
+        **kwargs,
+    ) -> tuple[list["BaseEntity"], int | None]:
+        """A page of items and the total count, in one statement when the
+        total is exact."""
+        from server.db import get_session
+
+        if include_total != TotalMode.exact:
+            items = await cls.list_items(
+                user_id=user_id,
+                business_name=business_name,
+                offset=offset,
+                limit=limit,
+                is_deleted=is_deleted,
+                cursor=cursor,
+                **kwargs,
+            )
+            if include_total == TotalMode.none:
+                return items, None
+            if offset == 0 and not cursor and len(items) < limit:
+                # the whole listing fits on the first page
+                return items, len(items)
+            return items, await cls.estimated_count(
+                user_id=user_id,
+                business_name=business_name,
+                is_deleted=is_deleted,
+                **kwargs,
+            )
+
+        base_query = cls.get_query(
             user_id=user_id,
             business_name=business_name,
             is_deleted=is_deleted,
             **kwargs,
         )
-        return items, total
-
-        # TODO Not completed
-        base_query = [cls.is_deleted == is_deleted]
-
-        if hasattr(cls, "user_id"):
-            base_query.append(cls.user_id == user_id)
-        if hasattr(cls, "business_name"):
-            base_query.append(cls.business_name == business_name)
+        total_count_query = select(func.count()).filter(*base_query)
 
-        total_count_query = select(func.count()).filter(*base_query)  # .subquery()
+        if cursor:
+            # the total does not depend on the cursor, so it cannot be a window
+            # over the seeked rows
+            total_column = total_count_query.scalar_subquery()
+            base_query.append(tuple_(cls.created_at, cls.uid) < tuple_(*cursor))
+        else:
+            total_column = func.count().over()
 
-        # Create the base query for fetching the items
         items_query = (
-            select(cls)
+            select(cls, total_column.label("total"))
             .filter(*base_query)
-            .order_by(cls.created_at.desc())
+            .order_by(cls.created_at.desc(), cls.uid.desc())
             .offset(offset)
             .limit(limit)
-            # .subquery()
         )
 
-        # Combine both queries into a single select statement
-        combined_query = select(
-            total_count_query.subquery().c[0].label("total"), items_query.subquery()
-        )
-        # Execute the combined query
-        # result = await session.execute(combined_query)
-        # res2 = result.fetchall()
-        # res = result.scalars().all()
+        async with get_session(read_only=True) as session:
+            rows = (await session.execute(items_query)).all()
+            if rows:
+                return [row[0] for row in rows], rows[0].total
+            if offset == 0 and not cursor:
+                return [], 0
+            # past the last page, there is no row to carry the total
+            total = await session.scalar(total_count_query)
+        return [], total
 
     @classmethod
     async def create_item(cls, data: dict):
-        from server.db import async_session
+        from server.db import get_session
 
         item = cls(**data)
-        async with async_session() as session:
+        async with get_session() as session:
             session.add(item)
             await session.commit()
             await session.refresh(item)
@@ -241,7 +304,7 @@ class BaseEntity:
 
     @classmethod
     async def update_item(cls, item: "BaseEntity", data: dict):
-        from server.db import async_session
+        from server.db import get_session
 
         for key, value in data.items():
             if cls.update_field_set() and key not in cls.update_field_set():
@@ -251,19 +314,21 @@ class BaseEntity:
 
             setattr(item, key, value)
 
-        async with async_session() as session:
-            session.add(item)
+        async with get_session() as session:
+            # the item may have been read through the replica session
+            item = await session.merge(item)
             await session.commit()
             await session.refresh(item)
         return item
 
     @classmethod
     async def delete_item(cls, item: "BaseEntity"):
-        from server.db import async_session
+        from server.db import get_session
 
         item.is_deleted = True
-        async with async_session() as session:
-            session.add(item)
+        async with get_session() as session:
+            # the item may have been read through the replica session
+            item = await session.merge(item)
             await session.commit()
             await session.refresh(item)
         return item
@@ -0,0 +1,88 @@
+"""Requests per second through the app with and without the CORS middleware.
+
+Sends `--requests` GET requests with an allowed `Origin` through an
+in-process ASGI transport, `--concurrency` at a time, to a minimal FastAPI
+app: once bare, once behind a pass-through `BaseHTTPMiddleware` (the
+overhead the previous CORS layer carried) and once behind
+`DynamicCORSMiddleware`. The origin cache is filled up front, so no Mongo is
+needed and only the middleware itself is measured.
+
+    python -m benchmarks.cors_middleware --requests 20000
+"""
+
+import argparse
+import asyncio
+import time
+
+import fastapi
+import httpx
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from core.middlewares import DynamicCORSMiddleware, origin_cache
+
+HOSTNAME = "bench.uln.me"
+ORIGIN = "https://app.bench.uln.me"
+
+
+def create_app(middleware=None) -> fastapi.FastAPI:
+    app = fastapi.FastAPI()
+
+    @app.get("/")
+    async def home():
+        return {"status": "ok"}
+
+    if middleware == "base_http":
+
+        async def pass_through(request, call_next):
+            return await call_next(request)
+
+        app.add_middleware(BaseHTTPMiddleware, dispatch=pass_through)
+    elif middleware == "cors":
+        app.add_middleware(DynamicCORSMiddleware)
+    return app
+
+
+async def requests_per_second(app, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url=f"https://{HOSTNAME}"
+    ) as client:
+
+        async def worker(count: int):
+            for _ in range(count):
+                response = await client.get("/", headers={"Origin": ORIGIN})
+                response.raise_for_status()
+
+        await worker(100)  # warm up
+        started = time.perf_counter()
+        await asyncio.gather(
+            *[worker(requests // concurrency) for _ in range(concurrency)]
+        )
+        return requests / (time.perf_counter() - started)
+
+
+async def run(requests: int, concurrency: int):
+    origin_cache.set(HOSTNAME, [ORIGIN])
+
+    results = {}
+    for middleware in [None, "base_http", "cors"]:
+        app = create_app(middleware)
+        results[middleware or "none"] = await requests_per_second(
+            app, requests, concurrency
+        )
+
+    for name, rps in results.items():
+        print(f"{name:>10}: {rps:,.0f} req/s ({rps / results['none']:.0%} of bare)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
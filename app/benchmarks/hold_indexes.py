@@ -0,0 +1,238 @@
+"""Compare the wallet hold hot queries with and without the compound indexes.
+
+Seeds a `WalletHold` collection (1M documents by default) in a local mongod,
+then runs the query shapes of `WalletHold.get_holds_query`,
+`WalletHold.list_total_combined`, `WalletHold.expire_holds` and
+`WalletBalance.backfill_held` once with the initial single-field indexes and
+once with the compound indexes declared on `WalletHold`. The winning plan,
+keys/documents examined and latency of each are printed and written to
+`--output` as JSON.
+
+    python -m benchmarks.hold_indexes --mongo-uri mongodb://localhost:27017/
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from bson import Decimal128
+from fastapi_mongo_base.models import BusinessOwnedEntity
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+
+from apps.accounting.models import StatusEnum, WalletHold
+
+compound_indexes = WalletHold.Settings.indexes
+single_indexes = BusinessOwnedEntity.Settings.indexes + [
+    IndexModel([("wallet_id", ASCENDING)]),
+    IndexModel([("expires_at", ASCENDING)]),
+    IndexModel([("status", ASCENDING)]),
+    IndexModel([("currency", ASCENDING)]),
+]
+
+
+def seed(collection, holds: int, wallets: int, businesses: int, batch_size: int):
+    collection.drop()
+
+    business_names = [f"business_{i}" for i in range(businesses)]
+    wallet_owners = [
+        (uuid.uuid4(), uuid.uuid4(), random.choice(business_names))
+        for _ in range(wallets)
+    ]
+    now = datetime.now()
+
+    for offset in range(0, holds, batch_size):
+        batch = []
+        for _ in range(offset, min(offset + batch_size, holds)):
+            wallet_id, user_id, business_name = random.choice(wallet_owners)
+            created_at = now - timedelta(minutes=random.randint(0, 365 * 24 * 60))
+            expires_at = created_at + timedelta(hours=random.randint(1, 24 * 30))
+            # most holds have been released or have expired long ago
+            status = (
+                StatusEnum.ACTIVE if random.random() < 0.05 else StatusEnum.INACTIVE
+            )
+            batch.append(
+                dict(
+                    uid=uuid.uuid4(),
+                    wallet_id=wallet_id,
+                    user_id=user_id,
+                    business_name=business_name,
+                    amount=Decimal128(Decimal(random.randint(1, 1000))),
+                    currency=random.choice(["IRR", "USD"]),
+                    status=status.value,
+                    expires_at=expires_at,
+                    created_at=created_at,
+                    updated_at=created_at,
+                    is_deleted=False,
+                )
+            )
+        collection.insert_many(batch, ordered=False)
+        print(f"seeded {offset + len(batch)}/{holds}", end="\r")
+    print()
+
+    return wallet_owners
+
+
+def hot_queries(wallet_id: uuid.UUID, user_id: uuid.UUID, business_name: str):
+    now = datetime.now()
+    listing = {
+        "is_deleted": False,
+        "user_id": user_id,
+        "business_name": business_name,
+        "wallet_id": wallet_id,
+    }
+    active = {"status": StatusEnum.ACTIVE.value, "is_deleted": False}
+
+    return {
+        "holds_list": (
+            {**listing, "status": StatusEnum.ACTIVE.value},
+            [("created_at", DESCENDING)],
+        ),
+        "holds_list_currency": (
+            {**listing, "currency": "USD", "status": StatusEnum.ACTIVE.value},
+            [("created_at", DESCENDING)],
+        ),
+        "holds_list_date_range": (
+            {
+                **listing,
+                "status": StatusEnum.INACTIVE.value,
+                "created_at": {"$gte": now - timedelta(days=30), "$lte": now},
+            },
+            [("created_at", DESCENDING)],
+        ),
+        "expire_holds": (
+            {**active, "expires_at": {"$lte": now}},
+            [("expires_at", ASCENDING)],
+        ),
+        "next_expiring_hold": (
+            {**active, "wallet_id": wallet_id, "currency": "USD"},
+            [("expires_at", ASCENDING)],
+        ),
+        "backfill_held": [
+            {"$match": active},
+            {
+                "$group": {
+                    "_id": {"wallet_id": "$wallet_id", "currency": "$currency"},
+                    "held": {"$sum": "$amount"},
+                    "held_expires_at": {"$min": "$expires_at"},
+                }
+            },
+        ],
+    }
+
+
+def summarize(plan: dict) -> str:
+    """`IXSCAN {index} <- FETCH <- SORT` style description of a winning plan."""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if "indexName" in plan:
+            stage += f" {plan['indexName']}"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " <- ".join(reversed(stages))
+
+
+def explain(collection, query) -> dict:
+    if isinstance(query, list):
+        result = collection.database.command(
+            "explain",
+            {"aggregate": collection.name, "pipeline": query, "cursor": {}},
+            verbosity="executionStats",
+        )
+        if "stages" in result:
+            result = result["stages"][0]["$cursor"]
+    else:
+        filter, sort = query
+        result = collection.find(filter).sort(sort).limit(20).explain()
+
+    stats = result.get("executionStats", {})
+    winning_plan = result["queryPlanner"]["winningPlan"]
+    winning_plan = winning_plan.get("queryPlan", winning_plan)
+    return {
+        "winning_plan": summarize(winning_plan),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+
+def run(collection, query):
+    if isinstance(query, list):
+        return list(collection.aggregate(query))
+    filter, sort = query
+    return list(collection.find(filter).sort(sort).limit(20))
+
+
+def measure(collection, queries: dict, repeat: int) -> dict[str, dict]:
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run(collection, query)
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            "median_ms": statistics.median(timings),
+            **explain(collection, query),
+        }
+    return results
+
+
+def use_indexes(collection, indexes: list[IndexModel]):
+    collection.drop_indexes()
+    collection.create_indexes(indexes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+    )
+    parser.add_argument("--database", default="benchmark_hold_indexes")
+    parser.add_argument("--holds", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=50_000)
+    parser.add_argument("--businesses", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="hold_indexes.json")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri, uuidRepresentation="standard")
+    collection = client[args.database]["WalletHold"]
+    wallet_owners = seed(
+        collection, args.holds, args.wallets, args.businesses, args.batch_size
+    )
+    queries = hot_queries(*random.choice(wallet_owners))
+
+    use_indexes(collection, single_indexes)
+    before = measure(collection, queries, args.repeat)
+    use_indexes(collection, compound_indexes)
+    after = measure(collection, queries, args.repeat)
+
+    for name in queries:
+        print(
+            f"== {name}: {before[name]['median_ms']:.2f} ms"
+            f" -> {after[name]['median_ms']:.2f} ms"
+        )
+        for label, result in [("single-field", before), ("compound", after)]:
+            result = result[name]
+            print(
+                f"-- {label} indexes: {result['winning_plan']}"
+                f" (keys {result['keys_examined']}, docs {result['docs_examined']})"
+            )
+        print()
+
+    with open(args.output, "w") as f:
+        json.dump({"single-field": before, "compound": after}, f, indent=2)
+
+    client.drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
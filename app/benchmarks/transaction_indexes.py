@@ -0,0 +1,184 @@
+"""Compare the transaction hot queries with and without the composite indexes.
+
+Seeds `transaction` (10M rows by default), then runs the query shapes of
+`Wallet.get_transactions`, `Transaction.get_query` and `BaseEntity.list_items`
+once with the initial single-column indexes and once with the composite
+indexes declared on `Transaction`, printing the EXPLAIN plan and latency of
+each.
+
+`--database-url` must point at a dedicated benchmark database: the
+`transaction` table is created there and dropped after the run, and an
+existing one with rows is left alone.
+
+    python -m benchmarks.transaction_indexes \
+        --database-url postgresql+psycopg2://.../benchmark_transaction_indexes
+"""
+
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import Index, create_engine, func, insert, inspect, select
+
+from apps.accounting.models import Transaction
+from apps.base.models import Base
+
+table = Transaction.__table__
+composite_indexes = [index for index in table.indexes if len(index.columns) > 1]
+single_indexes = [
+    Index("ix_transaction_uid", table.c.uid, unique=True),
+    Index("ix_transaction_wallet_id", table.c.wallet_id),
+]
+
+
+def seed(engine, rows: int, wallets: int, businesses: int, batch_size: int):
+    if inspect(engine).has_table(table.name):
+        with engine.connect() as conn:
+            if conn.execute(select(1).select_from(table).limit(1)).first():
+                raise SystemExit(
+                    f"{engine.url!r} already has {table.name} rows, "
+                    "use a dedicated benchmark database"
+                )
+    Base.metadata.drop_all(engine, tables=[table])
+    Base.metadata.create_all(engine, tables=[table])
+
+    business_names = [f"business_{i}" for i in range(businesses)]
+    wallet_owners = [
+        (uuid.uuid4(), uuid.uuid4(), random.choice(business_names))
+        for _ in range(wallets)
+    ]
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / rows
+
+    with engine.begin() as conn:
+        for offset in range(0, rows, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, rows)):
+                wallet_id, user_id, business_name = random.choice(wallet_owners)
+                created_at = start + step * i
+                batch.append(
+                    dict(
+                        uid=uuid.uuid4(),
+                        proposal_id=uuid.uuid4(),
+                        wallet_id=wallet_id,
+                        user_id=user_id,
+                        business_name=business_name,
+                        amount=Decimal(random.randint(-1000, 1000)),
+                        currency=random.choice(["IRR", "USD"]),
+                        balance=Decimal(random.randint(0, 10**6)),
+                        created_at=created_at,
+                        updated_at=created_at,
+                        is_deleted=False,
+                    )
+                )
+            conn.execute(insert(table), batch)
+            print(f"seeded {offset + len(batch)}/{rows}", end="\r")
+    print()
+
+    return wallet_owners
+
+
+def hot_queries(wallet_id: uuid.UUID, user_id: uuid.UUID, business_name: str):
+    month_ago = datetime.now() - timedelta(days=30)
+
+    def listing(**kwargs):
+        return (
+            select(Transaction)
+            .filter(*Transaction.get_query(business_name=business_name, **kwargs))
+            .order_by(Transaction.created_at.desc(), Transaction.uid.desc())
+            .offset(100)
+            .limit(20)
+        )
+
+    return {
+        "latest_balance": select(Transaction.balance)
+        .where(Transaction.wallet_id == wallet_id, Transaction.currency == "USD")
+        .order_by(Transaction.created_at.desc())
+        .limit(1),
+        "wallet_transactions": select(Transaction)
+        .where(
+            Transaction.wallet_id == wallet_id,
+            Transaction.created_at >= month_ago,
+            Transaction.created_at <= datetime.now(),
+        )
+        .limit(20),
+        "business_list": listing(),
+        "business_user_list": listing(user_id=user_id),
+        "business_wallet_list": listing(wallet_id=wallet_id),
+        "business_count": select(func.count()).filter(
+            *Transaction.get_query(business_name=business_name)
+        ),
+    }
+
+
+def explain(conn, query) -> str:
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    prefix = {
+        "postgresql": "EXPLAIN (ANALYZE, BUFFERS)",
+        "sqlite": "EXPLAIN QUERY PLAN",
+    }.get(conn.dialect.name, "EXPLAIN")
+    rows = conn.exec_driver_sql(f"{prefix} {compiled}").all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def measure(engine, queries: dict, repeat: int) -> dict[str, tuple[float, str]]:
+    results = {}
+    with engine.connect() as conn:
+        for name, query in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(query).all()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = (statistics.median(timings), explain(conn, query))
+    return results
+
+
+def use_indexes(engine, drop: list[Index], create: list[Index]):
+    with engine.begin() as conn:
+        for index in drop:
+            index.drop(conn, checkfirst=True)
+        for index in create:
+            index.create(conn, checkfirst=True)
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("ANALYZE transaction")
+        elif conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--wallets", type=int, default=100_000)
+    parser.add_argument("--businesses", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    wallet_owners = seed(
+        engine, args.rows, args.wallets, args.businesses, args.batch_size
+    )
+    try:
+        queries = hot_queries(*random.choice(wallet_owners))
+
+        use_indexes(engine, drop=composite_indexes, create=single_indexes)
+        before = measure(engine, queries, args.repeat)
+        use_indexes(engine, drop=single_indexes, create=composite_indexes)
+        after = measure(engine, queries, args.repeat)
+    finally:
+        Base.metadata.drop_all(engine, tables=[table])
+
+    for name in queries:
+        print(f"== {name}: {before[name][0]:.2f} ms -> {after[name][0]:.2f} ms")
+        print(f"-- single-column indexes\n{before[name][1]}")
+        print(f"-- composite indexes\n{after[name][1]}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,62 @@
-import fastapi
-from fastapi.responses import PlainTextResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL, Headers, MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from ufaas_fastapi_business.models import Business
 
+from core.cache import TTLCache
+from server.config import Settings
+from server.db import request_session_scope
+
+
+class OriginCache(TTLCache[str, list[str]]):
+    """Allowed origins by hostname. Hostnames without a business are cached
+    as well."""
+
+    def __init__(self, ttl: float | None = None, max_size: int | None = None):
+        super().__init__(
+            ttl=ttl if ttl is not None else Settings.CORS_CACHE_TTL,
+            max_size=max_size or Settings.CORS_CACHE_MAX_SIZE,
+        )
+
+    def invalidate(self, hostname: str | None = None):
+        """Forget one hostname, e.g. after its business config changed, or
+        everything when no hostname is given."""
+        super().invalidate(hostname)
+
+
+origin_cache = OriginCache()
+
+
+class DynamicCORSMiddleware:
+    """CORS headers for the origins allowed by the business behind the
+    requested hostname.
+
+    Plain ASGI, so responses (streaming ones included) pass through
+    unbuffered and the headers are added to the response start message.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-class DynamicCORSMiddleware(BaseHTTPMiddleware):
     async def get_allowed_origins(self, origin, **kwargs):
+        allowed_origins = origin_cache.get(origin)
+        if allowed_origins is not None:
+            return allowed_origins
+
         business = await Business.get_by_origin(origin)
-        if not business:
-            return []
-        return business.config.allowed_origins
+        allowed_origins = business.config.allowed_origins if business else []
+        origin_cache.set(origin, allowed_origins)
+        return allowed_origins
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: fastapi.Request, call_next):
-        origin = request.headers.get("origin")
-        allowed_origins = await self.get_allowed_origins(origin=request.url.hostname)
+        origin = Headers(scope=scope).get("origin")
+        allowed_origins = await self.get_allowed_origins(
+            origin=URL(scope=scope).hostname
+        )
         headers = {}
         if origin in allowed_origins:
             headers = {
@@ -23,8 +66,10 @@ class DynamicCORSMiddleware(BaseHTTPMiddleware):
                 "Access-Control-Allow-Headers": "Content-Type, Authorization, *",
             }
 
-        if request.method == "OPTIONS":
-            return PlainTextResponse("", status_code=200, headers=headers)
+        if scope["method"] == "OPTIONS":
+            response = PlainTextResponse("", status_code=200, headers=headers)
+            await response(scope, receive, send)
+            return
 
         # if origin and origin not in allowed_origins:
         #     raise BaseHTTPException(
@@ -33,6 +78,30 @@ class DynamicCORSMiddleware(BaseHTTPMiddleware):
         #         message="Origin not allowed",
         #     )
 
-        response: fastapi.Response = await call_next(request)
-        response.headers.update(headers)
-        return response
+        if not headers:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class SQLSessionMiddleware:
+    """Binds one lazily opened SQL session to each HTTP request."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        authorization = Headers(scope=scope).get("authorization")
+        pin_key = str(hash(authorization)) if authorization else None
+        async with request_session_scope(pin_key):
+            await self.app(scope, receive, send)
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import uuid
+from datetime import datetime
+from enum import Enum
+
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from server.config import Settings
+
+
+class TotalMode(str, Enum):
+    """How the `total` of a paginated response is computed."""
+
+    exact = "exact"
+    # planner statistics on Postgres; a count capped at COUNT_ESTIMATE_LIMIT
+    # documents on Mongo, see `total_capped`
+    estimated = "estimated"
+    none = "none"
+
+
+async def mongo_total(query, include_total: TotalMode) -> int | None:
+    """Total of a Beanie find query in the requested mode."""
+    if include_total == TotalMode.none:
+        return None
+    if include_total == TotalMode.estimated:
+        # estimated_document_count ignores the filter, which always includes
+        # at least the business, so count up to a bound instead; one past it
+        # tells a capped count from an exact one
+        return await query.document_model.get_motor_collection().count_documents(
+            query.get_filter_query(), limit=Settings.COUNT_ESTIMATE_LIMIT + 1
+        )
+    return await query.count()
+
+
+def total_capped(total: int | None, include_total: TotalMode) -> bool:
+    """Whether the `mongo_total` count stopped at its bound, so that `total`
+    is only a lower bound."""
+    return (
+        include_total == TotalMode.estimated
+        and total is not None
+        and total > Settings.COUNT_ESTIMATE_LIMIT
+    )
+
+
+def _signature(payload: bytes) -> bytes:
+    if not Settings.CURSOR_SECRET:
+        raise RuntimeError("CURSOR_SECRET is not set")
+    key = Settings.CURSOR_SECRET.encode()
+    return hmac.new(key, payload, hashlib.sha256).digest()[:16]
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_cursor(created_at: datetime, uid: uuid.UUID) -> str:
+    """Opaque, signed keyset cursor pointing right after (created_at, uid)."""
+    payload = json.dumps([created_at.isoformat(), uid.hex]).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload))}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        payload_str, signature_str = cursor.split(".")
+        payload = _b64decode(payload_str)
+        if not hmac.compare_digest(_signature(payload), _b64decode(signature_str)):
+            raise ValueError("Invalid cursor signature")
+        created_at, uid = json.loads(payload)
+        return datetime.fromisoformat(created_at), uuid.UUID(uid)
+    except (ValueError, TypeError):
+        raise BaseHTTPException(400, error="invalid_cursor", message="Invalid cursor")
+
+
+def next_cursor(items: list, limit: int) -> str | None:
+    if not items or len(items) < limit:
+        return None
+    return encode_cursor(items[-1].created_at, items[-1].uid)
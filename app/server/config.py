@@ -23,6 +23,81 @@ class Settings(config.Settings):
     DATABASE_URL_SYNC: str = os.getenv(
         "DATABASE_URL_SYNC", default="sqlite:///./test.db"
     )
+    # optional read replica and how long a client's reads stay on the primary
+    # after it wrote
+    DATABASE_READ_URL: str = os.getenv("DATABASE_READ_URL", default="")
+    DATABASE_READ_PIN_SECONDS: float = float(
+        os.getenv("DATABASE_READ_PIN_SECONDS", default=0)
+    )
+    DATABASE_ECHO: bool = os.getenv(
+        "DATABASE_ECHO", default="false"
+    ).lower() in ("true", "1", "yes")
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", default=10))
+    DATABASE_MAX_OVERFLOW: int = int(os.getenv("DATABASE_MAX_OVERFLOW", default=20))
+    DATABASE_POOL_TIMEOUT: float = float(os.getenv("DATABASE_POOL_TIMEOUT", default=10))
+    DATABASE_POOL_RECYCLE: int = int(os.getenv("DATABASE_POOL_RECYCLE", default=1800))
+    DATABASE_POOL_PRE_PING: bool = os.getenv(
+        "DATABASE_POOL_PRE_PING", default="true"
+    ).lower() in ("true", "1", "yes")
+    # asyncpg prepared statement cache; set to 0 behind pgbouncer
+    DATABASE_STATEMENT_CACHE_SIZE: int = int(
+        os.getenv("DATABASE_STATEMENT_CACHE_SIZE", default=100)
+    )
+
+    # signs pagination cursors; shared by every process, the server does not
+    # start without it
+    CURSOR_SECRET: str = os.getenv("CURSOR_SECRET", default="")
+    # estimated totals: planner estimates below this are counted exactly, and
+    # Mongo counts stop here
+    COUNT_ESTIMATE_LIMIT: int = int(os.getenv("COUNT_ESTIMATE_LIMIT", default=10000))
+
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", default=1000))
+
+    PROPOSAL_WORKERS: int = int(os.getenv("PROPOSAL_WORKERS", default=4))
+    PROPOSAL_POLL_INTERVAL: float = float(
+        os.getenv("PROPOSAL_POLL_INTERVAL", default=5)
+    )
+    PROPOSAL_LEASE_SECONDS: int = int(os.getenv("PROPOSAL_LEASE_SECONDS", default=300))
+    PROPOSAL_BATCH_MAX_SIZE: int = int(
+        os.getenv("PROPOSAL_BATCH_MAX_SIZE", default=1000)
+    )
+    PROPOSAL_BATCH_CHUNK_SIZE: int = int(
+        os.getenv("PROPOSAL_BATCH_CHUNK_SIZE", default=200)
+    )
+
+    # how long the response to an `Idempotency-Key` is replayed, how long a
+    # key stays reserved once its request stops renewing it, and how many
+    # completed responses each process keeps in memory
+    IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", default=24 * 3600))
+    IDEMPOTENCY_PENDING_TTL: int = int(os.getenv("IDEMPOTENCY_PENDING_TTL", default=60))
+    IDEMPOTENCY_CACHE_MAX_SIZE: int = int(
+        os.getenv("IDEMPOTENCY_CACHE_MAX_SIZE", default=10000)
+    )
+
+    HOLD_SWEEP_INTERVAL: float = float(os.getenv("HOLD_SWEEP_INTERVAL", default=30))
+    HOLD_SWEEP_BATCH_SIZE: int = int(os.getenv("HOLD_SWEEP_BATCH_SIZE", default=500))
+
+    # ledger verification: processes, uuid range shards, how old rows must
+    # be before an incremental run checks them, and drifted rows kept per run
+    LEDGER_VERIFY_WORKERS: int = int(os.getenv("LEDGER_VERIFY_WORKERS", default=4))
+    LEDGER_VERIFY_SHARDS: int = int(os.getenv("LEDGER_VERIFY_SHARDS", default=64))
+    LEDGER_VERIFY_BATCH_SIZE: int = int(
+        os.getenv("LEDGER_VERIFY_BATCH_SIZE", default=10000)
+    )
+    LEDGER_VERIFY_SETTLE_SECONDS: int = int(
+        os.getenv("LEDGER_VERIFY_SETTLE_SECONDS", default=300)
+    )
+    LEDGER_VERIFY_MAX_DRIFTS: int = int(
+        os.getenv("LEDGER_VERIFY_MAX_DRIFTS", default=1000)
+    )
+    # `X-Admin-Key` of the /admin endpoints, which are disabled while empty
+    ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY", default="")
+
+    # business configs change in the business service, so this is how long a
+    # revoked origin keeps CORS access, unless DELETE /admin/cors-cache is
+    # called
+    CORS_CACHE_TTL: float = float(os.getenv("CORS_CACHE_TTL", default=60))
+    CORS_CACHE_MAX_SIZE: int = int(os.getenv("CORS_CACHE_MAX_SIZE", default=1024))
 
     USSO_API_KEY: str = os.getenv("USSO_ADMIN_API_KEY")
     USSO_URL: str = os.getenv("USSO_URL", default="https://sso.usso.io")
@@ -1,9 +1,15 @@
 import asyncio
-from typing import AsyncGenerator
+import dataclasses
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncGenerator, AsyncIterator
 
 from fastapi_mongo_base.core.db import init_mongo_db
+from sqlalchemy import event, exc, make_url, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from apps.accounting import models as accounting_models
 from apps.base.models import Base
@@ -11,9 +17,102 @@ from server.config import Settings
 
 __all__ = ["accounting_models", "business_mongo_models"]
 
-engine = create_async_engine(Settings.DATABASE_URL, future=True, echo=True)
+
+@dataclasses.dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0
+    max_wait_seconds: float = 0
+
+    def record(self, waited: float, timed_out: bool = False):
+        self.checkouts += 1
+        self.timeouts += timed_out
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(database_url: str) -> dict:
+    url = make_url(database_url)
+    options = dict(
+        echo=Settings.DATABASE_ECHO, pool_pre_ping=Settings.DATABASE_POOL_PRE_PING
+    )
+    # SQLite is only used locally and keeps SQLAlchemy's own pool choice
+    if url.get_backend_name() == "sqlite":
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=Settings.DATABASE_POOL_SIZE,
+        max_overflow=Settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=Settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=Settings.DATABASE_POOL_RECYCLE,
+    )
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "statement_cache_size": Settings.DATABASE_STATEMENT_CACHE_SIZE
+        }
+    return options
+
+
+class PrimarySession(Session):
+    """Sessions on the primary; their committed writes pin reads to it."""
+
+
+@event.listens_for(PrimarySession, "do_orm_execute")
+def mark_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(PrimarySession, "after_flush")
+def mark_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def pin_after_commit(session):
+    if session.info.pop("wrote", False):
+        record_write()
+
+
+engine = create_async_engine(
+    Settings.DATABASE_URL, **engine_options(Settings.DATABASE_URL)
+)
 async_session: sessionmaker[AsyncSession] = sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False
+    bind=engine,
+    class_=AsyncSession,
+    sync_session_class=PrimarySession,
+    expire_on_commit=False,
+)
+
+# read replica, for the read paths that can tolerate replication lag
+read_engine = (
+    create_async_engine(
+        Settings.DATABASE_READ_URL, **engine_options(Settings.DATABASE_READ_URL)
+    )
+    if Settings.DATABASE_READ_URL
+    else engine
+)
+async_read_session: sessionmaker[AsyncSession] = sessionmaker(
+    bind=read_engine, class_=AsyncSession, expire_on_commit=False
 )
 
 
@@ -22,13 +121,163 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+class RequestSession:
+    """Sessions shared by the SQL calls made while handling one request.
+
+    Opened on first use and only handed to the task serving the request;
+    tasks spawned from it (e.g. by asyncio.gather) get their own sessions,
+    since an AsyncSession must not be used concurrently.
+    """
+
+    def __init__(self, pin_key: str | None = None):
+        self.task = asyncio.current_task()
+        self.session: AsyncSession | None = None
+        self.read_session: AsyncSession | None = None
+        # identifies the client for read-your-writes across its requests
+        self.pin_key = pin_key
+        self.wrote = False
+
+    async def close(self):
+        for session in [self.session, self.read_session]:
+            if session is not None:
+                await session.close()
+
+
+request_session: ContextVar[RequestSession | None] = ContextVar(
+    "request_session", default=None
+)
+# pin_key -> time.monotonic() until which its reads stay on the primary
+pinned_until: dict[str, float] = {}
+
+
+def record_write():
+    scope = request_session.get()
+    if scope is None:
+        return
+
+    scope.wrote = True
+    if scope.pin_key is None or not Settings.DATABASE_READ_PIN_SECONDS:
+        return
+
+    now = time.monotonic()
+    if len(pinned_until) > 10_000:
+        for key in [key for key, until in pinned_until.items() if until <= now]:
+            del pinned_until[key]
+    pinned_until[scope.pin_key] = now + Settings.DATABASE_READ_PIN_SECONDS
+
+
+def use_replica(scope: RequestSession | None) -> bool:
+    if not Settings.DATABASE_READ_URL:
+        return False
+    if scope is None:
+        return True
+    if scope.wrote:
+        return False
+    return pinned_until.get(scope.pin_key, 0) <= time.monotonic()
+
+
+@asynccontextmanager
+async def request_session_scope(
+    pin_key: str | None = None,
+) -> AsyncIterator[RequestSession]:
+    scope = RequestSession(pin_key)
+    token = request_session.set(scope)
+    try:
+        yield scope
+    finally:
+        request_session.reset(token)
+        await scope.close()
+
+
+@asynccontextmanager
+async def get_session(read_only: bool = False) -> AsyncIterator[AsyncSession]:
+    """The session of the current request, or a fresh one outside requests.
+
+    `read_only` sessions go to the read replica, unless this request or, for
+    DATABASE_READ_PIN_SECONDS, this client wrote to the primary.
+    """
+    scope = request_session.get()
+    replica = read_only and use_replica(scope)
+    factory = async_read_session if replica else async_session
+    if scope is None or scope.task is not asyncio.current_task():
+        async with factory() as session:
+            yield session
+        return
+
+    attribute = "read_session" if replica else "session"
+    session = getattr(scope, attribute)
+    if session is None:
+        session = factory()
+        setattr(scope, attribute, session)
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+
+
+def pool_status() -> dict:
+    status = dataclasses.asdict(pool_stats)
+    if isinstance(engine.pool, QueuePool):
+        status.update(
+            size=engine.pool.size(),
+            checked_out=engine.pool.checkedout(),
+            checked_in=engine.pool.checkedin(),
+            overflow=engine.pool.overflow(),
+        )
+    if read_engine is not engine and isinstance(read_engine.pool, QueuePool):
+        status["read"] = dict(
+            size=read_engine.pool.size(),
+            checked_out=read_engine.pool.checkedout(),
+            checked_in=read_engine.pool.checkedin(),
+            overflow=read_engine.pool.overflow(),
+        )
+    return status
+
+
+def engines() -> list:
+    return [engine] if read_engine is engine else [engine, read_engine]
+
+
+async def warm_up_pool():
+    """Open `pool_size` connections up front so the first requests do not pay
+    for connecting."""
+
+    async def ping(pool_engine):
+        async with pool_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    for pool_engine in engines():
+        if isinstance(pool_engine.pool, QueuePool):
+            await asyncio.gather(
+                *[ping(pool_engine) for _ in range(pool_engine.pool.size())]
+            )
+
+
+async def dispose_engines():
+    for pool_engine in engines():
+        await pool_engine.dispose()
+
+
 async def init_sql_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    async with async_session() as session, session.begin():
+        await accounting_models.WalletBalance.backfill(session)
+        await accounting_models.TransactionDailyRollup.backfill(
+            session, only_if_empty=True
+        )
+
     return engine
 
 
 async def init_db():
     _, db = await asyncio.gather(init_sql_db(), init_mongo_db())
+    await accounting_models.WalletHold.drop_legacy_indexes()
+    await accounting_models.TransactionNote.drop_legacy_indexes()
+
+    async with async_session() as session, session.begin():
+        await accounting_models.WalletBalance.backfill_held(session)
+
     return db
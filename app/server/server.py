@@ -4,8 +4,10 @@ from contextlib import asynccontextmanager
 import fastapi
 from fastapi_mongo_base.core import app_factory
 
+from apps.accounting.routes import check_admin_key
 from apps.accounting.routes import router as accounting_router
-from core.middlewares import DynamicCORSMiddleware
+from apps.accounting.workers import hold_sweeper, proposal_workers
+from core.middlewares import DynamicCORSMiddleware, SQLSessionMiddleware, origin_cache
 
 from . import config, db
 
@@ -14,10 +16,18 @@ from . import config, db
 async def lifespan(app: fastapi.FastAPI):  # type: ignore
     """Initialize application services."""
     config.Settings.config_logger()
+    if not config.Settings.CURSOR_SECRET:
+        raise RuntimeError("CURSOR_SECRET is not set")
 
     await db.init_db()
+    await db.warm_up_pool()
+    await proposal_workers.start()
+    await hold_sweeper.start()
     logging.info("Startup complete")
     yield
+    await hold_sweeper.stop()
+    await proposal_workers.stop()
+    await db.dispose_engines()
     logging.info("Shutdown complete")
 
 
@@ -31,6 +41,7 @@ app = app_factory.create_app(
 )
 
 
+app.add_middleware(SQLSessionMiddleware)
 app.add_middleware(DynamicCORSMiddleware)
 
 
@@ -38,6 +49,29 @@ app.include_router(accounting_router, prefix="/api/v1")
 app.include_router(accounting_router, prefix="/api/v1/apps/core")
 
 
+@app.get(
+    "/api/v1/health/db",
+    include_in_schema=False,
+    dependencies=[fastapi.Depends(check_admin_key)],
+)
+async def db_health():
+    """SQL connection pool usage and checkout wait statistics, and the hit
+    rate of the CORS origin cache."""
+    return db.pool_status() | {"cors_cache": origin_cache.stats}
+
+
+@app.delete(
+    "/api/v1/admin/cors-cache",
+    include_in_schema=False,
+    dependencies=[fastapi.Depends(check_admin_key)],
+)
+async def invalidate_cors_cache(hostname: str | None = None):
+    """Forget the allowed origins cached for `hostname`, or for all
+    hostnames, e.g. right after a business revoked an origin."""
+    origin_cache.invalidate(hostname)
+    return origin_cache.stats
+
+
 # Mount the htmlcov directory to be served at /coverage
 # from fastapi.staticfiles import StaticFiles
 
@@ -1,7 +1,15 @@
+import os
+import time
+
 import pytest
 import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from ufaas_fastapi_business.models import Business
 
+from apps.accounting import services
 from apps.accounting.models import Wallet
+from server import db
 
 from ..constants import StaticData
 
@@ -72,3 +80,63 @@ async def wallet_2_original_balance():
 @pytest.fixture
 def constants():
     return StaticData()
+
+
+@pytest.fixture
+def sql_db(monkeypatch):
+    from ..conftest import TestSessionLocal
+
+    monkeypatch.setattr(db, "async_session", TestSessionLocal)
+    monkeypatch.setattr(services, "async_session", TestSessionLocal)
+    return TestSessionLocal
+
+
+# on the loop of the test, which the connections of the engine are bound to
+@pytest_asyncio.fixture(loop_scope="function")
+async def postgres_db(monkeypatch):
+    """Like `sql_db`, on the PostgreSQL database of TEST_POSTGRES_URL."""
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+
+    # every racing proposal waits for a connection while others hold the locks
+    engine = create_async_engine(url, **db.engine_options(url) | {"pool_timeout": 600})
+    async with engine.begin() as conn:
+        await conn.run_sync(db.Base.metadata.drop_all)
+        await conn.run_sync(db.Base.metadata.create_all)
+
+    session_factory = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    monkeypatch.setattr(db, "async_session", session_factory)
+    monkeypatch.setattr(services, "async_session", session_factory)
+    yield session_factory
+
+    async with engine.begin() as conn:
+        await conn.run_sync(db.Base.metadata.drop_all)
+    await engine.dispose()
+
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    """Local time 3:30 ahead of UTC, so naive local and naive UTC differ."""
+    monkeypatch.setenv("TZ", "IRST-03:30")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def business(monkeypatch, constants: StaticData):
+    business = Business(
+        name=constants.business_name_1,
+        domain=constants.business_domain_1,
+        user_id=constants.user_id_1_1,
+    )
+
+    async def get_by_name(cls, name: str):
+        return business if name == business.name else None
+
+    monkeypatch.setattr(Business, "get_by_name", classmethod(get_by_name))
+    return business
@@ -0,0 +1,117 @@
+import asyncio
+import os
+from decimal import Decimal
+
+import pytest
+
+from apps.accounting.models import Participant, Proposal, Wallet
+
+from ..constants import StaticData
+
+# conflicting proposals per stress test; enough to race the locks on every
+# run, set e.g. STRESS_PROPOSALS=1000 for a full stress run
+STRESS_PROPOSALS = int(os.getenv("STRESS_PROPOSALS", default=50))
+
+
+async def transfer(constants: StaticData, source: Wallet, target: Wallet, amount):
+    proposal = Proposal(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        issuer_id=constants.business_id_1,
+        amount=amount,
+        currency="USD",
+        task_status="init",
+        participants=[
+            Participant(wallet_id=source.uid, amount=-amount),
+            Participant(wallet_id=target.uid, amount=amount),
+        ],
+    )
+    await proposal.start_processing()
+    return proposal
+
+
+async def create_wallets(constants: StaticData, funds: list[int]):
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    await income.save()
+
+    wallets = []
+    for fund in funds:
+        wallet = Wallet(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_2,
+        )
+        await wallet.save()
+        if fund:
+            proposal = await transfer(constants, income, wallet, fund)
+            assert proposal.task_status == "completed"
+        wallets.append(wallet)
+    return wallets
+
+
+async def concurrent_debits(constants: StaticData, count: int):
+    """`count` debits of 10 racing for the funds of half of them."""
+    funds = 10 * (count // 2)
+    source, target = await create_wallets(constants, [funds, 0])
+
+    proposals = await asyncio.gather(
+        *[transfer(constants, source, target, 10) for _ in range(count)]
+    )
+
+    completed = [p for p in proposals if p.task_status == "completed"]
+    assert len(completed) == count // 2
+    assert all(p.task_status == "error" for p in proposals if p not in completed)
+    assert await source.get_balance("USD") == {"USD": Decimal(0)}
+    assert await target.get_balance("USD") == {"USD": Decimal(funds)}
+
+    transactions = await source.get_transactions(limit=count)
+    running = sorted(t.balance for t in transactions if t.amount < 0)
+    assert running == [Decimal(balance) for balance in range(0, funds, 10)]
+
+
+async def concurrent_opposite_transfers(constants: StaticData, count: int):
+    first, second = await create_wallets(constants, [1000, 1000])
+
+    proposals = await asyncio.gather(
+        *[
+            transfer(constants, *((first, second) if i % 2 else (second, first)), 7)
+            for i in range(count)
+        ]
+    )
+
+    assert all(p.task_status == "completed" for p in proposals)
+    assert await first.get_balance("USD") == {"USD": Decimal(1000)}
+    assert await second.get_balance("USD") == {"USD": Decimal(1000)}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_debits_never_overdraw(
+    constants: StaticData, sql_db, business
+):
+    await concurrent_debits(constants, STRESS_PROPOSALS)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_opposite_transfers(constants: StaticData, sql_db, business):
+    await concurrent_opposite_transfers(constants, STRESS_PROPOSALS)
+
+
+# the row locks themselves are only taken on PostgreSQL
+@pytest.mark.postgres
+@pytest.mark.asyncio
+async def test_concurrent_debits_never_overdraw_postgres(
+    constants: StaticData, postgres_db, business
+):
+    await concurrent_debits(constants, STRESS_PROPOSALS)
+
+
+@pytest.mark.postgres
+@pytest.mark.asyncio
+async def test_concurrent_opposite_transfers_postgres(
+    constants: StaticData, postgres_db, business
+):
+    await concurrent_opposite_transfers(constants, STRESS_PROPOSALS)
@@ -0,0 +1,178 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+
+from apps.accounting.models import (
+    Participant,
+    Proposal,
+    StatusEnum,
+    Wallet,
+    WalletBalance,
+    WalletHold,
+)
+
+from ..constants import StaticData
+
+
+async def create_wallet(constants: StaticData, **kwargs):
+    wallet = Wallet(
+        business_name=constants.business_name_1, user_id=uuid.uuid4(), **kwargs
+    )
+    await wallet.save()
+    return wallet
+
+
+async def create_hold(wallet: Wallet, amount, expires_in=timedelta(days=1), **kwargs):
+    return await WalletHold.create_item(
+        dict(
+            business_name=wallet.business_name,
+            user_id=wallet.user_id,
+            wallet_id=wallet.uid,
+            wallet=wallet,
+            amount=amount,
+            currency="USD",
+            status=StatusEnum.ACTIVE,
+            expires_at=datetime.now() + expires_in,
+            **kwargs,
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_held_amount_follows_holds(constants: StaticData, sql_db):
+    wallet = await create_wallet(constants)
+    first = await create_hold(wallet, 30)
+    second = await create_hold(wallet, 20)
+    assert await wallet.get_held_amount("USD") == Decimal(50)
+    assert await wallet.get_held_amount("EUR") == Decimal(0)
+
+    await WalletHold.update_item(first, {"status": StatusEnum.INACTIVE})
+    assert await wallet.get_held_amount("USD") == Decimal(20)
+
+    second = await WalletHold.update_item(second, {"amount": Decimal(25)})
+    assert await wallet.get_held_amount("USD") == Decimal(25)
+
+    await WalletHold.delete_item(second)
+    assert await wallet.get_held_amount("USD") == Decimal(0)
+
+
+@pytest.mark.asyncio
+async def test_held_amount_stale_update(constants: StaticData, sql_db):
+    wallet = await create_wallet(constants)
+    hold = await create_hold(wallet, 30, expires_in=timedelta(0))
+
+    # the sweeper expires the hold while a request still holds the old copy
+    await WalletHold.expire_holds(wallet_id=wallet.uid, currency="USD")
+    assert await wallet.get_held_amount("USD") == Decimal(0)
+
+    updated = await WalletHold.update_item(hold, {"description": "late edit"})
+    assert updated.status == StatusEnum.INACTIVE
+    assert updated.description == "late edit"
+    assert await wallet.get_held_amount("USD") == Decimal(0)
+
+
+@pytest.mark.asyncio
+async def test_held_amount_expiry(constants: StaticData, sql_db, local_timezone):
+    wallet = await create_wallet(constants)
+    await create_hold(wallet, 40)
+    expired = await create_hold(
+        wallet,
+        15,
+        expires_in=timedelta(0),
+    )
+    aware = await create_hold(wallet, 5)
+    # an hour from now, not hours ago once taken as naive local time
+    expires_at = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(hours=1)
+    aware = await WalletHold.update_item(aware, {"expires_at": expires_at})
+    assert aware.expires_at == expires_at.astimezone().replace(tzinfo=None)
+    await WalletHold.expire_holds(wallet_id=wallet.uid, currency="USD")
+
+    assert await wallet.get_held_amount("USD") == Decimal(45)
+    expired = await WalletHold.get(expired.id)
+    assert expired.status == StatusEnum.INACTIVE
+
+    async with sql_db() as session:
+        balance = await session.get(WalletBalance, (wallet.uid, "USD"))
+    assert balance.held_expires_at > datetime.now()
+
+
+@pytest.mark.asyncio
+async def test_held_amount_sweep_race(constants: StaticData, sql_db, monkeypatch):
+    wallet = await create_wallet(constants)
+    deleted = await create_hold(wallet, 10, expires_in=timedelta(0))
+    extended = await create_hold(wallet, 20, expires_in=timedelta(0))
+    expired = await create_hold(wallet, 30, expires_in=timedelta(0))
+
+    find = WalletHold.find
+
+    def find_then_change(*args, **kwargs):
+        query = find(*args, **kwargs)
+        to_list = query.to_list
+
+        async def change_after_read(*args, **kwargs):
+            candidates = await to_list(*args, **kwargs)
+            monkeypatch.setattr(WalletHold, "find", find)
+            # requests delete and extend holds the sweeper has just read
+            await WalletHold.delete_item(deleted)
+            await WalletHold.update_item(
+                extended, {"expires_at": datetime.now() + timedelta(days=1)}
+            )
+            return candidates
+
+        query.to_list = change_after_read
+        return query
+
+    monkeypatch.setattr(WalletHold, "find", find_then_change)
+    swept = await WalletHold.expire_holds(wallet_id=wallet.uid, currency="USD")
+
+    assert [hold.id for hold in swept] == [expired.id]
+    assert (await WalletHold.get(extended.id)).status == StatusEnum.ACTIVE
+    assert await wallet.get_held_amount("USD") == Decimal(20)
+
+
+@pytest.mark.asyncio
+async def test_held_amount_blocks_proposal(constants: StaticData, sql_db, business):
+    income = await create_wallet(
+        constants, wallet_type="app_income", main_currency="USD"
+    )
+    wallet = await create_wallet(constants)
+    target = await create_wallet(constants)
+
+    async def transfer(source, target, amount):
+        proposal = Proposal(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_1,
+            issuer_id=constants.business_id_1,
+            amount=amount,
+            currency="USD",
+            task_status="init",
+            participants=[
+                Participant(wallet_id=source.uid, amount=-amount),
+                Participant(wallet_id=target.uid, amount=amount),
+            ],
+        )
+        await proposal.start_processing()
+        return proposal.task_status
+
+    assert await transfer(income, wallet, 100) == "completed"
+    await create_hold(wallet, 80)
+    assert await transfer(wallet, target, 30) == "error"
+    assert await transfer(wallet, target, 20) == "completed"
+
+
+@pytest.mark.asyncio
+async def test_held_amount_backfill(constants: StaticData, sql_db):
+    wallet = await create_wallet(constants)
+    await create_hold(wallet, 10)
+    await create_hold(wallet, 5)
+
+    async with sql_db() as session, session.begin():
+        await session.execute(update(WalletBalance).values(held=0))
+    assert await wallet.get_held_amount("USD") == Decimal(0)
+
+    async with sql_db() as session, session.begin():
+        await WalletBalance.backfill_held(session)
+    assert await wallet.get_held_amount("USD") == Decimal(15)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from beanie.odm.operators.update.general import Set
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from apps.accounting.idempotency import (
+    error_response,
+    fingerprint,
+    idempotent,
+    reserve,
+    response_cache,
+    utcnow,
+)
+from apps.accounting.models import IdempotencyRecord
+from server.config import Settings
+
+from ..constants import StaticData
+
+
+@pytest.mark.asyncio
+async def test_idempotent_replay(constants: StaticData):
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return 202, {"uid": str(uuid.uuid4()), "task_status": "init"}
+
+    async def request(payload):
+        return await idempotent(
+            key, payload, constants.business_name_1, constants.user_id_1_1, handler
+        )
+
+    first = await request({"amount": 100})
+    assert first.status_code == 202
+
+    # replayed from the in-process cache, then from the stored record
+    replayed = await request({"amount": 100})
+    response_cache.invalidate(key)
+    stored = await request({"amount": 100})
+    assert len(calls) == 1
+    assert replayed.body == stored.body == first.body
+    assert json.loads(stored.body)["task_status"] == "init"
+    assert stored.status_code == 202
+
+    with pytest.raises(BaseHTTPException):
+        await request({"amount": 200})
+
+
+@pytest.mark.asyncio
+async def test_idempotent_failure_releases_key(constants: StaticData):
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+
+    async def failing():
+        raise ValueError("failed")
+
+    async def succeeding():
+        return 201, {"ok": True}
+
+    with pytest.raises(ValueError):
+        await idempotent(
+            key, {}, constants.business_name_1, constants.user_id_1_1, failing
+        )
+    assert await IdempotencyRecord.find_one(IdempotencyRecord.key == key) is None
+
+    response = await idempotent(
+        key, {}, constants.business_name_1, constants.user_id_1_1, succeeding
+    )
+    assert response.status_code == 201
+
+
+@pytest.mark.asyncio
+async def test_idempotent_pending_key_expires(constants: StaticData):
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+
+    async def handler():
+        return 201, {"ok": True}
+
+    async def request():
+        return await idempotent(
+            key, {}, constants.business_name_1, constants.user_id_1_1, handler
+        )
+
+    # a request that reserved the key and died before answering
+    pending = await reserve(
+        key, fingerprint({}), constants.business_name_1, constants.user_id_1_1
+    )
+    assert pending.expires_at <= utcnow() + timedelta(
+        seconds=Settings.IDEMPOTENCY_PENDING_TTL
+    )
+    with pytest.raises(BaseHTTPException) as conflict:
+        await request()
+    assert conflict.value.status_code == 409
+
+    await IdempotencyRecord.find_one(IdempotencyRecord.key == key).update(
+        Set({"expires_at": utcnow() - timedelta(seconds=1)})
+    )
+    response = await request()
+    assert response.status_code == 201
+
+    # the stored response is kept for the full TTL
+    record = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+    assert record.status_code == 201
+    assert record.expires_at > utcnow() + timedelta(
+        seconds=Settings.IDEMPOTENCY_TTL - 60
+    )
+
+
+@pytest.mark.asyncio
+async def test_idempotent_stores_error_after_change(constants: StaticData):
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        # the change is made, answering it fails
+        return error_response(
+            BaseHTTPException(400, error="invalid_status", message="failed")
+        )
+
+    responses = [
+        await idempotent(
+            key, {}, constants.business_name_1, constants.user_id_1_1, handler
+        )
+        for _ in range(2)
+    ]
+    assert len(calls) == 1
+    assert [response.status_code for response in responses] == [400, 400]
+    assert json.loads(responses[1].body)["error"] == "invalid_status"
+
+
+@pytest.mark.asyncio
+async def test_idempotent_renews_pending_key(constants: StaticData, monkeypatch):
+    monkeypatch.setattr(Settings, "IDEMPOTENCY_PENDING_TTL", 0.3)
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+    calls = []
+
+    async def slow_handler():
+        calls.append(1)
+        await asyncio.sleep(1)
+        return 201, {"ok": True}
+
+    async def request():
+        return await idempotent(
+            key, {}, constants.business_name_1, constants.user_id_1_1, slow_handler
+        )
+
+    first = asyncio.create_task(request())
+    # a retry long after the first reservation would have expired
+    await asyncio.sleep(0.7)
+    with pytest.raises(BaseHTTPException) as conflict:
+        await request()
+    assert conflict.value.status_code == 409
+
+    assert (await first).status_code == 201
+    assert len(calls) == 1
+    record = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+    assert record.status_code == 201
+
+
+@pytest.mark.asyncio
+async def test_idempotent_expires_at_utc(constants: StaticData, local_timezone):
+    key = f"{constants.business_name_1}:proposals:create:{uuid.uuid4()}"
+    pending = timedelta(seconds=Settings.IDEMPOTENCY_PENDING_TTL)
+
+    await reserve(
+        key, fingerprint({}), constants.business_name_1, constants.user_id_1_1
+    )
+    record = await IdempotencyRecord.find_one(IdempotencyRecord.key == key)
+    expected = datetime.now(timezone.utc).replace(tzinfo=None) + pending
+    assert abs(record.expires_at - expected) < timedelta(seconds=5)
@@ -0,0 +1,214 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi_mongo_base.core.exceptions import BaseHTTPException
+
+from apps.accounting.models import Transaction, Wallet
+from core.pagination import (
+    TotalMode,
+    decode_cursor,
+    encode_cursor,
+    next_cursor,
+    total_capped,
+)
+from server.config import Settings
+
+
+def test_cursor_roundtrip():
+    created_at, uid = datetime.now(), uuid.uuid4()
+    cursor = encode_cursor(created_at, uid)
+    assert decode_cursor(cursor) == (created_at, uid)
+
+    payload, signature = cursor.split(".")
+    with pytest.raises(BaseHTTPException):
+        decode_cursor(
+            f"{encode_cursor(created_at, uuid.uuid4()).split('.')[0]}.{signature}"
+        )
+    with pytest.raises(BaseHTTPException):
+        decode_cursor(payload)
+
+
+def test_cursor_requires_secret(monkeypatch):
+    cursor = encode_cursor(datetime.now(), uuid.uuid4())
+    # never signed or checked with an empty key
+    monkeypatch.setattr(Settings, "CURSOR_SECRET", "")
+    with pytest.raises(RuntimeError):
+        encode_cursor(datetime.now(), uuid.uuid4())
+    with pytest.raises(RuntimeError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.asyncio
+async def test_transaction_keyset_pagination(sql_db):
+    created_at = datetime.now()
+    wallet_id = uuid.uuid4()
+    async with sql_db() as session, session.begin():
+        for i in range(5):
+            session.add(
+                Transaction(
+                    business_name="keyset",
+                    user_id=uuid.uuid4(),
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=wallet_id,
+                    amount=i,
+                    currency="USD",
+                    balance=i,
+                    created_at=created_at,
+                )
+            )
+
+    seen, cursor = [], None
+    while True:
+        items, total = await Transaction.list_total_combined(
+            business_name="keyset", limit=2, cursor=cursor
+        )
+        assert total == 5
+        seen += [item.uid for item in items]
+        encoded = next_cursor(items, 2)
+        if encoded is None:
+            break
+        cursor = decode_cursor(encoded)
+
+    assert len(seen) == len(set(seen)) == 5
+    assert seen == sorted(seen, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_transaction_list_total_single_statement(sql_db):
+    from sqlalchemy import event
+
+    from ..conftest import test_engine
+
+    async with sql_db() as session, session.begin():
+        for i in range(3):
+            session.add(
+                Transaction(
+                    business_name="combined",
+                    user_id=uuid.uuid4(),
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=uuid.uuid4(),
+                    amount=i,
+                    currency="USD",
+                    balance=i,
+                )
+            )
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(test_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        items, total = await Transaction.list_total_combined(
+            business_name="combined", offset=1, limit=5
+        )
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", count_statement)
+    assert (len(items), total) == (2, 3)
+    assert len(statements) == 1
+
+    # past the last page and on an empty listing
+    assert await Transaction.list_total_combined(
+        business_name="combined", offset=5
+    ) == ([], 3)
+    assert await Transaction.list_total_combined(business_name="empty") == ([], 0)
+
+
+@pytest.mark.asyncio
+async def test_transaction_total_modes(sql_db):
+    async with sql_db() as session, session.begin():
+        for i in range(3):
+            session.add(
+                Transaction(
+                    business_name="modes",
+                    user_id=uuid.uuid4(),
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=uuid.uuid4(),
+                    amount=i,
+                    currency="USD",
+                    balance=i,
+                )
+            )
+
+    items, total = await Transaction.list_total_combined(
+        business_name="modes", limit=2, include_total=TotalMode.none
+    )
+    assert (len(items), total) == (2, None)
+
+    # SQLite has no planner estimate, so the estimate falls back to a count
+    for offset, limit in [(0, 2), (0, 5), (2, 2)]:
+        _, total = await Transaction.list_total_combined(
+            business_name="modes",
+            offset=offset,
+            limit=limit,
+            include_total=TotalMode.estimated,
+        )
+        assert total == 3
+
+
+@pytest.mark.asyncio
+async def test_wallet_estimated_total_capped(monkeypatch):
+    business_name = f"capped {uuid.uuid4()}"
+    for _ in range(3):
+        await Wallet(business_name=business_name, user_id=uuid.uuid4()).save()
+
+    for limit, expected in [(2, (3, True)), (3, (3, False))]:
+        monkeypatch.setattr(Settings, "COUNT_ESTIMATE_LIMIT", limit)
+        _, total = await Wallet.list_total_combined(
+            business_name=business_name, include_total=TotalMode.estimated
+        )
+        assert (total, total_capped(total, TotalMode.estimated)) == expected
+
+
+@pytest.mark.asyncio
+async def test_wallet_keyset_pagination(constants):
+    business_name = f"keyset {uuid.uuid4()}"
+    created_at = datetime.now().replace(microsecond=0)
+    for _ in range(5):
+        await Wallet(
+            business_name=business_name,
+            user_id=constants.user_id_1_1,
+            created_at=created_at,
+        ).save()
+
+    seen, cursor = [], None
+    while True:
+        items, total = await Wallet.list_total_combined(
+            business_name=business_name, limit=2, cursor=cursor
+        )
+        assert total == 5
+        seen += [item.uid for item in items]
+        encoded = next_cursor(items, 2)
+        if encoded is None:
+            break
+        cursor = decode_cursor(encoded)
+
+    assert len(seen) == len(set(seen)) == 5
+
+
+@pytest.mark.asyncio
+async def test_latest_notes_batched(constants):
+    from apps.accounting.models import TransactionNote
+
+    now = datetime.now().replace(microsecond=0)
+    transaction_ids = [uuid.uuid4() for _ in range(3)]
+    notes_by_transaction = [
+        [("b", now + timedelta(seconds=1)), ("a", now)],
+        # same created_at, the later insert wins
+        [("c", now), ("d", now)],
+        [],
+    ]
+    for transaction_id, notes in zip(transaction_ids, notes_by_transaction):
+        for note, created_at in notes:
+            await TransactionNote(
+                business_name=constants.business_name_1,
+                user_id=constants.user_id_1_1,
+                transaction_id=transaction_id,
+                note=note,
+                created_at=created_at,
+            ).save()
+
+    notes = await TransactionNote.get_latest_notes(transaction_ids)
+    assert notes == {transaction_ids[0]: "b", transaction_ids[1]: "d"}
@@ -105,7 +105,7 @@ async def test_valid_proposal_api_create_business(
     )
     resp_json = response.json()
     logging.info(f"{resp_json}")
-    assert response.status_code == 200
+    assert response.status_code == 202
 
 
 @pytest.mark.asyncio
@@ -205,4 +205,4 @@ async def test_valid_proposal_api_start_business(
     )
     resp_json = response.json()
     logging.info(f"{resp_json}")
-    assert response.status_code == 200
+    assert response.status_code == 202
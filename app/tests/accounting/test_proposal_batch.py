@@ -0,0 +1,118 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from apps.accounting import services
+from apps.accounting.models import Participant, Proposal, TransactionNote, Wallet
+from apps.accounting.services import process_proposals_batch
+from server.config import Settings
+
+from ..constants import StaticData
+
+
+def make_proposal(
+    constants: StaticData, source, target, amount, task_status="init", **kwargs
+):
+    return Proposal(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        issuer_id=constants.business_id_1,
+        amount=amount,
+        currency="USD",
+        task_status=task_status,
+        participants=[
+            Participant(wallet_id=source, amount=-amount),
+            Participant(wallet_id=target, amount=amount),
+        ],
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_proposal_batch_statuses(
+    constants: StaticData, sql_db, business, monkeypatch
+):
+    monkeypatch.setattr(Settings, "PROPOSAL_BATCH_CHUNK_SIZE", 3)
+
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    first = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    second = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    for wallet in [income, first, second]:
+        await wallet.save()
+
+    proposals = [
+        make_proposal(constants, income.uid, first.uid, 50, note="funding"),
+        *[make_proposal(constants, first.uid, second.uid, 20) for _ in range(4)],
+        make_proposal(constants, uuid.uuid4(), second.uid, 20),
+        make_proposal(constants, income.uid, second.uid, 5, task_status="draft"),
+    ]
+
+    await process_proposals_batch(business, proposals)
+
+    assert [proposal.task_status for proposal in proposals] == [
+        "completed",
+        "completed",
+        "completed",
+        "error",
+        "error",
+        "error",
+        "draft",
+    ]
+    assert "Insufficient balance" in proposals[3].task_report
+    assert "does not exist" in proposals[5].task_report
+
+    stored = [await Proposal.find_one(Proposal.uid == p.uid) for p in proposals]
+    assert [p.task_status for p in stored] == [p.task_status for p in proposals]
+
+    assert await first.get_balance("USD") == {"USD": Decimal(10)}
+    assert await second.get_balance("USD") == {"USD": Decimal(40)}
+
+    transactions = await proposals[0].get_transactions()
+    notes = await TransactionNote.get_latest_notes([t.uid for t in transactions])
+    assert set(notes.values()) == {"funding"}
+
+
+@pytest.mark.asyncio
+async def test_proposal_batch_leases_each_chunk(
+    constants: StaticData, sql_db, business, monkeypatch
+):
+    monkeypatch.setattr(Settings, "PROPOSAL_BATCH_CHUNK_SIZE", 1)
+    monkeypatch.setattr(Settings, "PROPOSAL_LEASE_SECONDS", 1)
+
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    for item in [income, wallet]:
+        await item.save()
+
+    remaining: list[timedelta] = []
+    commit_batch_chunk = services.commit_batch_chunk
+
+    async def slow_commit_batch_chunk(currency, chunk):
+        [(proposal, _)] = chunk
+        stored = await Proposal.find_one(Proposal.uid == proposal.uid)
+        remaining.append(stored.lease_expires_at - datetime.now())
+        await asyncio.sleep(0.6)
+        return await commit_batch_chunk(currency, chunk)
+
+    monkeypatch.setattr(services, "commit_batch_chunk", slow_commit_batch_chunk)
+
+    proposals = [make_proposal(constants, income.uid, wallet.uid, 5) for _ in range(3)]
+    await process_proposals_batch(business, proposals)
+
+    assert [proposal.task_status for proposal in proposals] == ["completed"] * 3
+    # the last chunk starts past the lease taken when the batch was stored
+    assert len(remaining) == 3
+    assert min(remaining) > timedelta(seconds=0.5)
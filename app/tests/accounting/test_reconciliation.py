@@ -0,0 +1,70 @@
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from apps.accounting.models import Participant, Proposal, Transaction, Wallet
+from apps.accounting.reconciliation import verify_ledger
+from server.config import Settings
+
+from ..constants import StaticData
+
+
+@pytest.mark.asyncio
+async def test_verify_ledger(constants: StaticData, sql_db, business, monkeypatch):
+    monkeypatch.setattr(Settings, "LEDGER_VERIFY_SETTLE_SECONDS", 0)
+
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    await income.save()
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    await wallet.save()
+
+    for amount in [100, 50]:
+        proposal = Proposal(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_1,
+            issuer_id=constants.business_id_1,
+            amount=amount,
+            currency="USD",
+            task_status="init",
+            participants=[
+                Participant(wallet_id=income.uid, amount=-amount),
+                Participant(wallet_id=wallet.uid, amount=amount),
+            ],
+        )
+        await proposal.start_processing()
+        assert proposal.task_status == "completed"
+
+    report = await verify_ledger(incremental=False, workers=0, shards=4)
+    assert report.rows_checked == 4
+    assert report.drift_count == 0
+
+    # a leg without its counterpart, whose balance does not follow either
+    drifted = Transaction(
+        business_name=constants.business_name_1,
+        user_id=wallet.user_id,
+        proposal_id=uuid.uuid4(),
+        wallet_id=wallet.uid,
+        amount=10,
+        currency="USD",
+        balance=170,
+        created_at=datetime.now() + timedelta(milliseconds=1),
+    )
+    async with sql_db() as session, session.begin():
+        session.add(drifted)
+    monkeypatch.setattr(Settings, "LEDGER_VERIFY_SETTLE_SECONDS", -1)
+
+    # resumes from the watermark, seeded with the balance of 150 held there
+    report = await verify_ledger(workers=0, shards=4)
+    assert report.rows_checked == 1
+    assert report.drift_count == 2
+    assert {drift["kind"] for drift in report.drifts} == {"balance", "proposal"}
+    balance_drift = next(d for d in report.drifts if d["kind"] == "balance")
+    assert balance_drift["transaction_id"] == str(drifted.uid)
+    assert Decimal(balance_drift["expected"]) == 160
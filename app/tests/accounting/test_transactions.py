@@ -66,3 +66,54 @@ async def test_update_transactions(
     logging.info(f"{resp_json}")
     assert response.status_code == 200
     assert resp_json["note"] == "Test note"
+
+
+@pytest.mark.asyncio
+async def test_export_batches(sql_db):
+    import uuid
+    from datetime import datetime, timedelta
+
+    from apps.accounting.models import Transaction, TransactionNote
+
+    wallet_id, start = uuid.uuid4(), datetime.now() - timedelta(days=10)
+    async with sql_db() as session, session.begin():
+        for i in range(5):
+            session.add(
+                Transaction(
+                    business_name="export",
+                    user_id=uuid.uuid4(),
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=wallet_id,
+                    amount=i,
+                    currency="USD",
+                    balance=i,
+                    created_at=start + timedelta(days=i),
+                )
+            )
+    first = await Transaction.list_items(business_name="export", limit=10)
+    await TransactionNote(
+        transaction_id=first[-1].uid,
+        business_name="export",
+        user_id=first[-1].user_id,
+        note="first",
+    ).save()
+
+    batches = [
+        batch
+        async for batch in Transaction.export_batches(
+            batch_size=2, business_name="export", wallet_id=wallet_id
+        )
+    ]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    rows = [row for batch in batches for row in batch]
+    assert [row["amount"] for row in rows] == [0, 1, 2, 3, 4]
+    assert rows[0]["note"] == "first"
+    assert all(row["note"] is None for row in rows[1:])
+
+    batches = [
+        batch
+        async for batch in Transaction.export_batches(
+            business_name="export", created_at_from=start + timedelta(days=3)
+        )
+    ]
+    assert [row["amount"] for batch in batches for row in batch] == [3, 4]
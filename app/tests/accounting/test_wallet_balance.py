@@ -0,0 +1,377 @@
+import uuid
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from apps.accounting.models import Participant, Proposal, Wallet, WalletBalance
+
+from ..constants import StaticData
+
+
+@pytest.mark.asyncio
+async def test_wallet_balance_follows_ledger(constants: StaticData, sql_db, business):
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    await income.save()
+    wallet = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_2,
+    )
+    await wallet.save()
+
+    for amount in [100, 50]:
+        proposal = Proposal(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_1,
+            issuer_id=constants.business_id_1,
+            amount=amount,
+            currency="USD",
+            task_status="init",
+            participants=[
+                Participant(wallet_id=income.uid, amount=-amount),
+                Participant(wallet_id=wallet.uid, amount=amount),
+            ],
+        )
+        await proposal.start_processing()
+        assert proposal.task_status == "completed"
+
+    assert await wallet.get_balance("USD") == {"USD": Decimal(150)}
+    assert await wallet.get_balance() == {"USD": Decimal(150)}
+    assert await wallet.get_currencies() == ["USD"]
+    assert await wallet.get_balance("EUR") == {"EUR": Decimal(0)}
+
+    async with sql_db() as session:
+        result = await session.execute(
+            select(WalletBalance).where(WalletBalance.wallet_id == wallet.uid)
+        )
+        wallet_balance = result.scalar_one()
+    assert wallet_balance.balance == Decimal(150)
+
+    transactions = await wallet.get_transactions()
+    assert max(transaction.balance for transaction in transactions) == 150
+
+
+@pytest.mark.asyncio
+async def test_wallet_balance_backfill(sql_db):
+    from apps.accounting.models import Transaction
+
+    wallet_id = uuid.uuid4()
+    async with sql_db() as session, session.begin():
+        for balance in [10, 30, 20]:
+            session.add(
+                Transaction(
+                    business_name="backfill",
+                    user_id=uuid.uuid4(),
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=wallet_id,
+                    amount=balance,
+                    currency="EUR",
+                    balance=balance,
+                )
+            )
+            await session.flush()
+
+    async with sql_db() as session, session.begin():
+        await WalletBalance.backfill(session)
+
+    async with sql_db() as session:
+        result = await session.execute(
+            select(WalletBalance.balance).where(WalletBalance.wallet_id == wallet_id)
+        )
+        assert result.scalar_one() == Decimal(20)
+
+
+@pytest.mark.asyncio
+async def test_wallet_balances_bulk_single_query(constants: StaticData, sql_db):
+    from sqlalchemy import event
+
+    from ..conftest import test_engine
+
+    wallets = [
+        Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+        for _ in range(3)
+    ]
+    wallets.append(
+        Wallet(
+            business_name=constants.business_name_1,
+            user_id=uuid.uuid4(),
+            wallet_type="app_income",
+            main_currency="USD",
+        )
+    )
+    async with sql_db() as session, session.begin():
+        await WalletBalance.apply_changes(
+            session, "USD", {wallet.uid: Decimal(10) for wallet in wallets[:2]}
+        )
+        await WalletBalance.apply_changes(session, "EUR", {wallets[0].uid: Decimal(5)})
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(test_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        balances = await Wallet.get_balances_bulk([wallet.uid for wallet in wallets])
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    assert len(statements) == 1
+    assert [wallet.balance_from_stored(balances[wallet.uid]) for wallet in wallets] == [
+        {"EUR": Decimal(5), "USD": Decimal(10)},
+        {"USD": Decimal(10)},
+        {},
+        {"USD": Decimal("Infinity")},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_proposal_single_insert(constants: StaticData, sql_db, business):
+    from sqlalchemy import event
+
+    from apps.accounting.models import TransactionNote
+
+    from ..conftest import test_engine
+
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    await income.save()
+    recipients = [
+        Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+        for _ in range(20)
+    ]
+    for wallet in recipients:
+        await wallet.save()
+
+    proposal = Proposal(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        issuer_id=constants.business_id_1,
+        amount=200,
+        currency="USD",
+        task_status="init",
+        participants=[Participant(wallet_id=income.uid, amount=-200)]
+        + [Participant(wallet_id=wallet.uid, amount=10) for wallet in recipients],
+        note="payout",
+    )
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(test_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        await proposal.start_processing()
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    assert proposal.task_status == "completed"
+    ledger = [
+        statement
+        for statement in statements
+        if '"transaction"' in statement and not statement.startswith("SELECT")
+    ]
+    assert len(ledger) == 1 and ledger[0].startswith('INSERT INTO "transaction"')
+
+    transactions = await proposal.get_transactions()
+    assert len(transactions) == 21
+    notes = await TransactionNote.find(
+        TransactionNote.transaction_id == transactions[0].uid
+    ).to_list()
+    assert [(note.note, note.user_id) for note in notes] == [
+        ("payout", transactions[0].user_id)
+    ]
+    assert await recipients[0].get_balance("USD") == {"USD": Decimal(10)}
+
+
+@pytest.mark.asyncio
+async def test_wallet_statement(constants: StaticData, sql_db):
+    from datetime import datetime
+
+    from sqlalchemy import event
+
+    from apps.accounting.models import Transaction, TransactionDailyRollup
+
+    from ..conftest import test_engine
+
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    ledger = [(1, 100, 100), (5, -30, 70), (10, 50, 120), (20, -20, 100)]
+    async with sql_db() as session, session.begin():
+        for day, amount, balance in ledger:
+            session.add(
+                Transaction(
+                    business_name=constants.business_name_1,
+                    user_id=wallet.user_id,
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=wallet.uid,
+                    amount=amount,
+                    currency="USD",
+                    balance=balance,
+                    created_at=datetime(2025, 1, day),
+                )
+            )
+    async with sql_db() as session, session.begin():
+        await TransactionDailyRollup.backfill(session)
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(test_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        statement = await wallet.get_statement(
+            "USD", datetime(2025, 1, 2), datetime(2025, 1, 15)
+        )
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    assert len(statements) == 1
+    assert statement["opening_balance"] == Decimal(100)
+    assert statement["closing_balance"] == Decimal(120)
+    assert statement["total_credits"] == Decimal(50)
+    assert statement["total_debits"] == Decimal(-30)
+    assert statement["transaction_count"] == 2
+
+    statement = await wallet.get_statement(
+        "USD", datetime(2024, 12, 1), datetime(2024, 12, 31)
+    )
+    assert statement["opening_balance"] == statement["closing_balance"] == 0
+    assert statement["transaction_count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_daily_rollup(constants: StaticData, sql_db, business):
+    from datetime import date, datetime, timedelta
+
+    from apps.accounting.models import TransactionDailyRollup
+
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    await income.save()
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    await wallet.save()
+
+    for amount in [100, 50]:
+        proposal = Proposal(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_1,
+            issuer_id=constants.business_id_1,
+            amount=amount,
+            currency="USD",
+            task_status="init",
+            participants=[
+                Participant(wallet_id=income.uid, amount=-amount),
+                Participant(wallet_id=wallet.uid, amount=amount),
+            ],
+        )
+        await proposal.start_processing()
+        assert proposal.task_status == "completed"
+
+    today = date.today()
+    volume = await TransactionDailyRollup.volume(
+        constants.business_name_1, today, today, wallet_id=wallet.uid
+    )
+    assert volume == [
+        dict(
+            day=today,
+            currency="USD",
+            credit=Decimal(150),
+            debit=Decimal(0),
+            credit_count=2,
+            debit_count=0,
+        )
+    ]
+    business_volume = await TransactionDailyRollup.volume(
+        constants.business_name_1, today, today, currency="USD"
+    )
+    assert business_volume[0]["debit"] <= Decimal(-150)
+
+    # recomputing from the ledger gives the incrementally kept totals
+    async with sql_db() as session:
+        kept = (await session.execute(select(TransactionDailyRollup))).scalars().all()
+        kept = {
+            (row.wallet_id, row.day): (row.credit, row.debit, row.credit_count)
+            for row in kept
+        }
+    async with sql_db() as session, session.begin():
+        await TransactionDailyRollup.backfill(session)
+    async with sql_db() as session:
+        rebuilt = (await session.execute(select(TransactionDailyRollup))).scalars()
+        rebuilt = {
+            (row.wallet_id, row.day): (row.credit, row.debit, row.credit_count)
+            for row in rebuilt
+        }
+    assert rebuilt == kept
+
+    # whole days come from the rollup, the rest of the period from the ledger
+    statement = await wallet.get_statement(
+        "USD",
+        datetime.combine(today, datetime.min.time()) - timedelta(hours=1),
+        datetime.now() + timedelta(days=1),
+    )
+    assert statement["total_credits"] == Decimal(150)
+    assert statement["transaction_count"] == 2
+    assert statement["closing_balance"] == Decimal(150)
+
+
+@pytest.mark.asyncio
+async def test_wallet_balance_as_of(constants: StaticData, sql_db, local_timezone):
+    from datetime import datetime, timezone
+
+    from apps.accounting.models import Transaction
+
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    ledger = [
+        (1, "USD", 100, 100),
+        (3, "EUR", 40, 40),
+        (5, "USD", -30, 70),
+        (9, "EUR", 10, 50),
+    ]
+    async with sql_db() as session, session.begin():
+        for day, currency, amount, balance in ledger:
+            session.add(
+                Transaction(
+                    business_name=constants.business_name_1,
+                    user_id=wallet.user_id,
+                    proposal_id=uuid.uuid4(),
+                    wallet_id=wallet.uid,
+                    amount=amount,
+                    currency=currency,
+                    balance=balance,
+                    created_at=datetime(2025, 1, day),
+                )
+            )
+            await WalletBalance.apply_changes(
+                session, currency, {wallet.uid: Decimal(amount)}
+            )
+
+    assert await wallet.get_balance(as_of=datetime(2024, 12, 31)) == {}
+    assert await wallet.get_balance(as_of=datetime(2025, 1, 4)) == {
+        "EUR": Decimal(40),
+        "USD": Decimal(100),
+    }
+    assert await wallet.get_balance("USD", as_of=datetime(2025, 1, 5)) == {
+        "USD": Decimal(70)
+    }
+    assert await wallet.get_balance(
+        as_of=datetime(2025, 2, 1, tzinfo=timezone.utc)
+    ) == await wallet.get_balance()
+    # 01:30 of Jan 5 in local time, after the USD debit
+    assert await wallet.get_balance(
+        "USD", as_of=datetime(2025, 1, 4, 22, tzinfo=timezone.utc)
+    ) == {"USD": Decimal(70)}
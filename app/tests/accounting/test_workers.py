@@ -0,0 +1,253 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from beanie.odm.operators.update.general import Set
+
+from apps.accounting import services, workers
+from apps.accounting.models import (
+    Participant,
+    Proposal,
+    StatusEnum,
+    Wallet,
+    WalletHold,
+)
+from apps.accounting.workers import HoldSweeper, ProposalWorkerPool
+
+from ..constants import StaticData
+
+
+async def create_proposals(constants: StaticData, count: int, **kwargs):
+    income = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_1,
+        wallet_type="app_income",
+        main_currency="USD",
+    )
+    wallet = Wallet(
+        business_name=constants.business_name_1,
+        user_id=constants.user_id_1_2,
+    )
+    await asyncio.gather(income.save(), wallet.save())
+
+    proposals = []
+    for _ in range(count):
+        proposal = Proposal(
+            business_name=constants.business_name_1,
+            user_id=constants.user_id_1_1,
+            issuer_id=constants.business_id_1,
+            amount=10,
+            currency="USD",
+            task_status="init",
+            participants=[
+                Participant(wallet_id=income.uid, amount=-10),
+                Participant(wallet_id=wallet.uid, amount=10),
+            ],
+            **kwargs,
+        )
+        await proposal.save()
+        proposals.append(proposal)
+    return wallet, proposals
+
+
+async def wait_for_status(proposals: list[Proposal], task_status: str):
+    for _ in range(100):
+        items = [await Proposal.find_one(Proposal.uid == p.uid) for p in proposals]
+        if all(item.task_status == task_status for item in items):
+            return items
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"Proposals did not reach {task_status}")
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_drains_queue(constants: StaticData, sql_db, business):
+    wallet, proposals = await create_proposals(constants, 12)
+
+    pool = ProposalWorkerPool(concurrency=3, poll_interval=0.05)
+    await pool.start()
+    try:
+        await wait_for_status(proposals, "completed")
+    finally:
+        await pool.stop()
+
+    assert not pool.running
+    assert await wallet.get_balance("USD") == {"USD": Decimal(120)}
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_claims_once(constants: StaticData, sql_db, business):
+    _, [proposal] = await create_proposals(constants, 1)
+
+    pool = ProposalWorkerPool(concurrency=1)
+    first, second = await asyncio.gather(
+        pool.claim(proposal.uid), pool.claim(proposal.uid)
+    )
+    assert (first is None) != (second is None)
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_recovers_interrupted(
+    constants: StaticData, sql_db, business
+):
+    expired = datetime.now() - timedelta(minutes=1)
+    wallet, proposals = await create_proposals(constants, 2, lease_expires_at=expired)
+    done, interrupted = proposals
+
+    await done.start_processing()
+    done.task_status = "processing"
+    interrupted.task_status = "processing"
+    await asyncio.gather(done.save(), interrupted.save())
+
+    pool = ProposalWorkerPool(concurrency=1, poll_interval=0.05)
+    await pool.start()
+    try:
+        await wait_for_status(proposals, "completed")
+    finally:
+        await pool.stop()
+
+    # the already committed proposal is not booked a second time
+    assert await wallet.get_balance("USD") == {"USD": Decimal(20)}
+
+
+def stall_first_run(monkeypatch) -> tuple[asyncio.Event, asyncio.Event]:
+    """Hold the first processing run before it locks the wallets."""
+    stalled, release = asyncio.Event(), asyncio.Event()
+    load_held_amounts = services.load_held_amounts
+
+    async def stalling_load_held_amounts(sources, currency):
+        if not stalled.is_set():
+            stalled.set()
+            await release.wait()
+        await load_held_amounts(sources, currency)
+
+    monkeypatch.setattr(services, "load_held_amounts", stalling_load_held_amounts)
+    return stalled, release
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_renews_lease(
+    constants: StaticData, sql_db, business, monkeypatch
+):
+    wallet, [proposal] = await create_proposals(constants, 1)
+    stalled, release = stall_first_run(monkeypatch)
+
+    runs = []
+    process_proposal = workers.process_proposal
+
+    async def counting_process_proposal(proposal: Proposal):
+        runs.append(proposal.uid)
+        await process_proposal(proposal)
+
+    monkeypatch.setattr(workers, "process_proposal", counting_process_proposal)
+
+    pool = ProposalWorkerPool(concurrency=2, poll_interval=0.05, lease_seconds=0.3)
+    await pool.start()
+    try:
+        await stalled.wait()
+        # well past the first lease, which the worker keeps renewing
+        await asyncio.sleep(1)
+        release.set()
+        await wait_for_status([proposal], "completed")
+    finally:
+        await pool.stop()
+
+    assert runs == [proposal.uid]
+    assert await wallet.get_balance("USD") == {"USD": Decimal(10)}
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_not_written_twice(
+    constants: StaticData, sql_db, business, monkeypatch
+):
+    wallet, [proposal] = await create_proposals(constants, 1)
+    stalled, release = stall_first_run(monkeypatch)
+
+    # a worker whose lease runs out while it waits, e.g. on a stalled process
+    pool = ProposalWorkerPool(concurrency=1)
+    stale = asyncio.create_task(
+        services.process_proposal(await pool.claim(proposal.uid))
+    )
+    await stalled.wait()
+    await Proposal.find_one(Proposal.uid == proposal.uid).update(
+        Set({"lease_expires_at": datetime.now() - timedelta(minutes=1)})
+    )
+
+    await pool.recover()
+    await services.process_proposal(await pool.claim(proposal.uid))
+    release.set()
+    await stale
+
+    [stored] = await wait_for_status([proposal], "completed")
+    assert len(await stored.get_transactions()) == 2
+    assert await wallet.get_balance("USD") == {"USD": Decimal(10)}
+
+
+@pytest.mark.asyncio
+async def test_hold_sweeper_expires_in_batches(constants: StaticData, sql_db):
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    await wallet.save()
+
+    holds = []
+    for expires_in in [timedelta(0)] * 5 + [timedelta(days=1)]:
+        hold = await WalletHold.create_item(
+            dict(
+                business_name=wallet.business_name,
+                user_id=wallet.user_id,
+                wallet_id=wallet.uid,
+                wallet=wallet,
+                amount=10,
+                currency="USD",
+                status=StatusEnum.ACTIVE,
+                expires_at=datetime.now() + expires_in,
+            )
+        )
+        holds.append(hold)
+
+    events: list[WalletHold] = []
+
+    async def on_expired(expired: list[WalletHold]):
+        events.extend(expired)
+
+    sweeper = HoldSweeper(batch_size=2)
+    sweeper.subscribe(on_expired)
+    assert await sweeper.sweep() == 5
+    assert await sweeper.sweep() == 0
+
+    assert {hold.uid for hold in events} == {hold.uid for hold in holds[:5]}
+    active = await WalletHold.get_holds(
+        user_id=wallet.user_id,
+        business_name=wallet.business_name,
+        wallet_id=wallet.uid,
+    )
+    assert [hold.uid for hold in active] == [holds[-1].uid]
+    assert await wallet.get_held_amount("USD") == Decimal(10)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_sweeps_release_once(constants: StaticData, sql_db):
+    wallet = Wallet(business_name=constants.business_name_1, user_id=uuid.uuid4())
+    await wallet.save()
+
+    for _ in range(6):
+        await WalletHold.create_item(
+            dict(
+                business_name=wallet.business_name,
+                user_id=wallet.user_id,
+                wallet_id=wallet.uid,
+                wallet=wallet,
+                amount=10,
+                currency="USD",
+                status=StatusEnum.ACTIVE,
+                expires_at=datetime.now(),
+            )
+        )
+
+    first, second = await asyncio.gather(
+        WalletHold.expire_holds(wallet_id=wallet.uid, currency="USD"),
+        WalletHold.expire_holds(wallet_id=wallet.uid, currency="USD"),
+    )
+    assert len(first) + len(second) == 6
+    assert not {hold.uid for hold in first} & {hold.uid for hold in second}
+    assert await wallet.get_held_amount("USD") == Decimal(0)
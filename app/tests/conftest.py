@@ -1,5 +1,6 @@
 import logging
 import os
+import tempfile
 from typing import AsyncGenerator
 
 import debugpy
@@ -11,6 +12,7 @@ from fastapi_mongo_base import models as base_mongo_models
 from fastapi_mongo_base.utils.basic import get_all_subclasses
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from usso.session import UssoSession
 
 from server.config import Settings
@@ -20,6 +22,12 @@ from server.server import app as fastapi_app
 from .constants import StaticData
 
 
+@pytest.fixture(scope="session", autouse=True)
+def cursor_secret():
+    if not Settings.CURSOR_SECRET:
+        Settings.CURSOR_SECRET = "test-cursor-secret"
+
+
 @pytest.fixture(scope="session", autouse=True)
 def setup_debugpy():
     if os.getenv("DEBUGPY", "False").lower() in ("true", "1", "yes"):
@@ -27,10 +35,12 @@ def setup_debugpy():
         debugpy.wait_for_client()
 
 
-DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+# A file rather than :memory:, which shares one connection between all
+# sessions: the rollback of one session would discard the writes of another.
+DATABASE_URL = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db"
 
 # Create the engine and session factory for the test database
-test_engine = create_async_engine(DATABASE_URL, echo=True)
+test_engine = create_async_engine(DATABASE_URL, echo=True, poolclass=NullPool)
 TestSessionLocal = sessionmaker(
     bind=test_engine, class_=AsyncSession, expire_on_commit=False
 )
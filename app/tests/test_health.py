@@ -8,3 +8,40 @@ async def test_health(client: httpx.AsyncClient):
     response = await client.get("/api/v1/health")
     assert response.status_code == 200
     assert response.json() == {"status": "up", "host": "test.uln.me"}
+
+
+@pytest.mark.asyncio
+async def test_invalidate_cors_cache(client: httpx.AsyncClient, monkeypatch):
+    from core.middlewares import origin_cache
+    from server.config import Settings
+
+    monkeypatch.setattr(Settings, "ADMIN_API_KEY", "admin-key")
+    origin_cache.set("revoked.uln.me", ["https://app.revoked.uln.me"])
+
+    response = await client.delete("/api/v1/admin/cors-cache")
+    assert response.status_code == 401
+    assert origin_cache.get("revoked.uln.me") == ["https://app.revoked.uln.me"]
+
+    response = await client.delete(
+        "/api/v1/admin/cors-cache",
+        params={"hostname": "revoked.uln.me"},
+        headers={"X-Admin-Key": "admin-key"},
+    )
+    assert response.status_code == 200
+    assert origin_cache.get("revoked.uln.me") is None
+
+
+@pytest.mark.asyncio
+async def test_db_health_requires_admin_key(client: httpx.AsyncClient, monkeypatch):
+    from server.config import Settings
+
+    monkeypatch.setattr(Settings, "ADMIN_API_KEY", "admin-key")
+
+    response = await client.get("/api/v1/health/db")
+    assert response.status_code == 401
+
+    response = await client.get(
+        "/api/v1/health/db", headers={"X-Admin-Key": "admin-key"}
+    )
+    assert response.status_code == 200
+    assert {"checkouts", "cors_cache"} <= response.json().keys()
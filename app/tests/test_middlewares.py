@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from ufaas_fastapi_business.models import Business
+
+from core.middlewares import DynamicCORSMiddleware, OriginCache, origin_cache
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+
+    async def get_by_origin(origin):
+        calls.append(origin)
+        if origin != "test.uln.me":
+            return None
+        return SimpleNamespace(
+            config=SimpleNamespace(allowed_origins=["https://app.uln.me"])
+        )
+
+    monkeypatch.setattr(Business, "get_by_origin", get_by_origin)
+    origin_cache.invalidate()
+    yield calls
+    origin_cache.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_allowed_origins_cached(lookups):
+    middleware = DynamicCORSMiddleware(app=None)
+    hits, misses = origin_cache.hits, origin_cache.misses
+
+    for _ in range(3):
+        assert await middleware.get_allowed_origins("test.uln.me") == [
+            "https://app.uln.me"
+        ]
+        assert await middleware.get_allowed_origins("unknown.uln.me") == []
+    assert lookups == ["test.uln.me", "unknown.uln.me"]
+    assert origin_cache.hits - hits == 4
+    assert origin_cache.misses - misses == 2
+
+    origin_cache.invalidate("test.uln.me")
+    await middleware.get_allowed_origins("test.uln.me")
+    assert lookups == ["test.uln.me", "unknown.uln.me", "test.uln.me"]
+
+
+def test_origin_cache_bounds():
+    cache = OriginCache(ttl=60, max_size=2)
+    cache.set("a", ["https://a"])
+    cache.set("b", [])
+    assert cache.get("a") == ["https://a"]
+    cache.set("c", [])
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == ["https://a"]
+    assert cache.stats == {"hits": 2, "misses": 1, "size": 2}
+
+    expired = OriginCache(ttl=0, max_size=2)
+    expired.set("a", [])
+    assert expired.get("a") is None
+
+
+def cors_app(calls: list):
+    async def home(request):
+        calls.append(request.method)
+        return PlainTextResponse("ok")
+
+    async def stream(request):
+        async def chunks():
+            for i in range(3):
+                calls.append(f"chunk {i}")
+                yield f"{i}\n"
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(routes=[Route("/", home), Route("/stream", stream)])
+    return DynamicCORSMiddleware(app)
+
+
+@pytest.mark.asyncio
+async def test_cors_headers(lookups):
+    calls = []
+    transport = httpx.ASGITransport(app=cors_app(calls))
+    async with httpx.AsyncClient(
+        transport=transport, base_url="https://test.uln.me"
+    ) as client:
+        response = await client.get("/", headers={"Origin": "https://app.uln.me"})
+        assert response.text == "ok"
+        assert response.headers["access-control-allow-origin"] == "https://app.uln.me"
+
+        response = await client.get("/", headers={"Origin": "https://evil.uln.me"})
+        assert "access-control-allow-origin" not in response.headers
+
+        # preflights are answered without reaching the app
+        response = await client.options("/", headers={"Origin": "https://app.uln.me"})
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == "https://app.uln.me"
+        assert calls == ["GET", "GET"]
+
+        response = await client.get(
+            "/stream", headers={"Origin": "https://app.uln.me"}
+        )
+        assert response.text == "0\n1\n2\n"
+        assert response.headers["access-control-allow-origin"] == "https://app.uln.me"
+
+    # each chunk is sent on before the next one is produced, which the
+    # buffering httpx transport cannot show
+    calls.clear()
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "scheme": "https",
+        "path": "/stream",
+        "raw_path": b"/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test.uln.me"), (b"origin", b"https://app.uln.me")],
+        "server": ("test.uln.me", 443),
+    }
+
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message["body"]:
+            calls.append(f"sent {message['body'].decode().strip()}")
+
+    await cors_app(calls)(scope, receive, send)
+    assert calls == ["chunk 0", "sent 0", "chunk 1", "sent 1", "chunk 2", "sent 2"]